@@ -1,2 +1,43 @@
-from easyturk import EasyTurk
-import interface
+"""EasyTurk: A wrapper for custom AMT tasks.
+
+Submodules, and the boto3, jinja2 and flask dependencies they need, are
+imported the first time they are used, so that importing easyturk is fast:
+
+    from easyturk import EasyTurk   # Imports easyturk.easyturk.
+    from easyturk import interface  # Imports easyturk.interface.
+"""
+
+import importlib
+import sys
+
+
+SUBMODULES = ('async_easyturk', 'bulk', 'consensus', 'export',
+              'interface', 'journal', 'metrics', 'mock_mturk', 'notify',
+              'parse', 'payload', 'score', 'store', 'worker_stats')
+
+# Names that are loaded from the easyturk.easyturk module.
+EASYTURK_NAMES = ('ENVIRONMENTS', 'EasyTurk', 'MAX_POOL_CONNECTIONS',
+                  'get_client', 'get_jinja_env')
+
+
+def __getattr__(name):
+    if name in SUBMODULES:
+        value = importlib.import_module('.' + name, __name__)
+    elif name in EASYTURK_NAMES:
+        module = importlib.import_module('.easyturk', __name__)
+        value = getattr(module, name)
+    else:
+        raise AttributeError('module %r has no attribute %r' %
+                             (__name__, name))
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + list(SUBMODULES) + list(EASYTURK_NAMES))
+
+
+if sys.version_info < (3, 7):
+    # Module level __getattr__ needs Python 3.7, so import eagerly instead.
+    from .easyturk import EasyTurk
+    from . import interface
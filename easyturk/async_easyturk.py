@@ -0,0 +1,482 @@
+"""An asyncio version of the EasyTurk api calls.
+
+Requires Python 3 and aiobotocore.
+"""
+
+from .bulk import backoff_delay
+from .bulk import is_throttle_error
+from datetime import datetime
+
+import asyncio
+import json
+
+from .easyturk import ENVIRONMENTS
+from .easyturk import EasyTurk
+from .metrics import error_code
+from .metrics import monotonic
+from .metrics import payload_size
+
+
+class AsyncEasyTurk(object):
+    """Class with the same api calls as EasyTurk, written as coroutines.
+
+    The MTurk client is created when entering the async context manager:
+
+        async with AsyncEasyTurk(sandbox=True) as et:
+            hit = await et.launch_hit(...)
+
+    All api calls share a semaphore, so any number of coroutines can be
+    scheduled at once while at most max_concurrency requests are in flight.
+    Throttled calls are retried with the same backoff as bulk.call_with_retry.
+    Templates are rendered and answers parsed by the EasyTurk in
+    self.easyturk, which shares the store, metrics, parse cache, HIT types
+    and notification settings.
+    """
+
+    def __init__(self, sandbox=True, max_concurrency=100,
+                 template_cache_dir=None, store=None, metrics=None,
+                 client=None, max_retries=5, easyturk=None):
+        """Constructor for AsyncEasyTurk.
+
+        Args:
+            sandbox: Whether we are launching on sandbox.
+            max_concurrency: Maximum number of in-flight api calls.
+            template_cache_dir: Directory for compiled templates.
+            store: An optional HITStore, or the path to its database, that
+                records launched HITs.
+            metrics: An optional metrics.Metrics to record api calls and
+                stage timings in.
+            client: An optional client whose methods are coroutines, to use
+                instead of an aiobotocore client.
+            max_retries: Maximum number of retries for a throttled call.
+            easyturk: An optional EasyTurk to share, such as one with
+                notifications enabled. template_cache_dir, store and
+                metrics are then ignored.
+        """
+        if easyturk is None:
+            easyturk = EasyTurk(sandbox=sandbox,
+                                template_cache_dir=template_cache_dir,
+                                store=store, metrics=metrics)
+        self.easyturk = easyturk
+        self.sandbox = sandbox
+        self.store = self.easyturk.store
+        self.metrics = self.easyturk.metrics
+        self.max_retries = max_retries
+        self.client_context = None
+        if client is None:
+            from aiobotocore.config import AioConfig
+            from aiobotocore.session import AioSession
+
+            env = (ENVIRONMENTS['sandbox'] if sandbox
+                   else ENVIRONMENTS["production"])
+            self.session = AioSession(profile='mturk')
+            self.client_context = self.session.create_client(
+                    service_name='mturk',
+                    region_name='us-east-1',
+                    endpoint_url=env['endpoint'],
+                    config=AioConfig(max_pool_connections=max_concurrency),
+            )
+        self._mtc = client
+        self.max_concurrency = max_concurrency
+        # Created on first use, so that they belong to the running loop.
+        self._semaphore = None
+        self._hit_types_lock = None
+
+    @property
+    def semaphore(self):
+        """The semaphore that limits the number of in-flight api calls.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    @property
+    def hit_types_lock(self):
+        """The lock that keeps coroutines from registering a HIT type twice.
+        """
+        if self._hit_types_lock is None:
+            self._hit_types_lock = asyncio.Lock()
+        return self._hit_types_lock
+
+    @property
+    def mtc(self):
+        """The aiobotocore client, only available inside the context.
+        """
+        if self._mtc is None:
+            raise RuntimeError('AsyncEasyTurk must be used as an async '
+                               'context manager.')
+        return self._mtc
+
+    async def __aenter__(self):
+        if self.client_context is not None:
+            self._mtc = await self.client_context.__aenter__()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if self.client_context is not None:
+            await self.client_context.__aexit__(exc_type, exc, tb)
+            self._mtc = None
+
+    async def _call_once(self, operation, **kwargs):
+        """Calls an MTurk operation once while holding the semaphore.
+
+        Args:
+            operation: Name of the client method.
+            kwargs: Arguments of the call.
+
+        Returns:
+            The response of the call.
+        """
+        async with self.semaphore:
+            start = monotonic()
+            code = None
+            throttled = False
+            try:
+                return await getattr(self.mtc, operation)(**kwargs)
+            except Exception as e:
+                code = error_code(e)
+                throttled = is_throttle_error(e)
+                raise
+            finally:
+                self.metrics.record_call(
+                        operation, monotonic() - start,
+                        request_bytes=payload_size(kwargs),
+                        error_code=code, throttled=throttled)
+
+    async def _call(self, operation, **kwargs):
+        """Calls an MTurk operation, retrying with backoff when throttled.
+
+        The semaphore is released while waiting to retry.
+
+        Args:
+            operation: Name of the client method.
+            kwargs: Arguments of the call.
+
+        Returns:
+            The response of the call.
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return await self._call_once(operation, **kwargs)
+            except Exception as e:
+                if attempt > self.max_retries or not is_throttle_error(e):
+                    raise
+                self.metrics.record_retry(e)
+                await asyncio.sleep(backoff_delay(attempt))
+
+    async def get_account_balance(self):
+        """Retrieves the account balance.
+
+        Returns:
+            available account balance.
+        """
+        response = await self._call('get_account_balance')
+        return response['AvailableBalance']
+
+    async def get_hit_type(self, hit_type_properties):
+        """Registers a HIT type once and caches its id.
+
+        The cache is the one of self.easyturk, and new HIT types get its
+        notification settings, as in EasyTurk.get_hit_type.
+
+        Args:
+            hit_type_properties: A dictionary of create_hit_type arguments.
+
+        Returns:
+            The HITTypeId.
+        """
+        key = json.dumps(hit_type_properties, sort_keys=True)
+        async with self.hit_types_lock:
+            with self.easyturk.hit_types_lock:
+                if key in self.easyturk.hit_types:
+                    return self.easyturk.hit_types[key]
+            response = await self._call('create_hit_type',
+                                        **hit_type_properties)
+            with self.easyturk.hit_types_lock:
+                registered = key not in self.easyturk.hit_types
+                hit_type_id = self.easyturk.hit_types.setdefault(
+                        key, response['HITTypeId'])
+                notification = self.easyturk.notification
+            if registered and notification is not None:
+                await self._call('update_notification_settings',
+                                 HITTypeId=hit_type_id,
+                                 Notification=notification, Active=True)
+            return hit_type_id
+
+    async def launch_hit(self, template_location, input_data, hit_type=True,
+                         unique_request_token=None,
+                         requester_annotation=None, **kwargs):
+        """Launches a HIT.
+
+        Takes the same arguments as EasyTurk.launch_hit.
+
+        Returns:
+            A hit_id.
+        """
+        hit_properties = self.easyturk.get_hit_properties(
+                template_location, input_data,
+                unique_request_token=unique_request_token,
+                requester_annotation=requester_annotation, **kwargs)
+        if hit_type:
+            hit_type_properties, hit_properties = (
+                    self.easyturk.split_hit_properties(hit_properties))
+            hit_properties['HITTypeId'] = await self.get_hit_type(
+                    hit_type_properties)
+            hit = await self._call('create_hit_with_hit_type',
+                                   **hit_properties)
+        else:
+            hit = await self._call('create_hit', **hit_properties)
+        if self.store is not None:
+            self.store.add_hit(hit['HIT']['HITId'], template_location,
+                               input_data, hit_properties['MaxAssignments'])
+        return hit
+
+    async def _paginate(self, operation, key, page_size=100, where=None,
+                        **kwargs):
+        """Lazily iterates over every page of an MTurk list api.
+
+        Args:
+            operation: Name of a list method of the MTurk client.
+            key: The key in the response containing the items.
+            page_size: Number of items requested per page (at most 100).
+            where: An optional function that returns True for the items
+                that should be yielded.
+            kwargs: Additional arguments passed to the list method.
+
+        Yields:
+            The items of every page, following NextToken until exhausted.
+        """
+        kwargs['MaxResults'] = page_size
+        while True:
+            response = await self._call(operation, **kwargs)
+            for item in response[key]:
+                if where is None or where(item):
+                    yield item
+            next_token = response.get('NextToken')
+            if not next_token or len(response[key]) == 0:
+                return
+            kwargs['NextToken'] = next_token
+
+    def iter_hits(self, page_size=100, where=None):
+        """Lazily iterates over all the HITs in the account.
+
+        Returns:
+            An async iterator of HIT dictionaries.
+        """
+        return self._paginate('list_hits', 'HITs',
+                              page_size=page_size, where=where)
+
+    def iter_assignments(self, hit_id, statuses=None, page_size=100,
+                         where=None):
+        """Lazily iterates over the assignments of a HIT.
+
+        Returns:
+            An async iterator of assignment dictionaries.
+        """
+        kwargs = {'HITId': hit_id}
+        if statuses is not None:
+            kwargs['AssignmentStatuses'] = statuses
+        return self._paginate('list_assignments_for_hit', 'Assignments',
+                              page_size=page_size, where=where, **kwargs)
+
+    async def list_hits(self, page_size=100, where=None):
+        """Lists the HITs that have already been launched.
+
+        Returns:
+            A list of HITs.
+        """
+        return [hit async for hit in self.iter_hits(
+                page_size=page_size, where=where)]
+
+    async def get_results(self, hit_id, reject_on_fail=False,
+                          return_errors=False):
+        """Retrives the output of a hit if it has finished.
+
+        Args:
+            hit_id: The hit id of the HIT.
+            reject_on_fail: If the hit returns unparsable answers,
+                then reject it.
+            return_errors: Whether to also return the parse errors instead
+                of printing them.
+
+        Returns:
+            A list of dictionaries in the format of EasyTurk.get_results,
+            and the parse errors if return_errors is set.
+        """
+        status = ['Approved', 'Submitted', 'Rejected']
+        try:
+            assignments = [a async for a in self.iter_assignments(
+                    hit_id, statuses=status)]
+        except Exception:
+            assignments = []
+        outputs, errors = self.easyturk.parse_assignments(assignments)
+        results = []
+        rejections = []
+        for a in assignments:
+            output = outputs.get(a['AssignmentId'])
+            if output is not None:
+                results.append(self.easyturk._result_from_assignment(
+                        a, output))
+            elif reject_on_fail:
+                rejections.append(self._call(
+                    'reject_assignment', AssignmentId=a['AssignmentId'],
+                    RequesterFeedback='Invalid results'))
+        for response in await asyncio.gather(*rejections,
+                                             return_exceptions=True):
+            if isinstance(response, Exception):
+                print(response)
+        if return_errors:
+            return results, errors
+        for error in errors:
+            print('Failed to parse assignment %s of hit %s: %s' % (
+                error['assignment_id'], error['hit_id'], error['message']))
+        return results
+
+    async def delete_hit(self, hit_id):
+        """Disables a hit.
+
+        Args:
+            hit_id: The hit id to disable.
+
+        Returns:
+            A boolean indicating success.
+        """
+        try:
+            await self._call('delete_hit', HITId=hit_id)
+            return True
+        except Exception:
+            try:
+                await self._call('update_expiration_for_hit', HITId=hit_id,
+                                 ExpireAt=datetime.now())
+                await self._call('delete_hit', HITId=hit_id)
+                return True
+            except Exception as e:
+                print(e)
+                return False
+
+    async def approve_hit(self, hit_id, reject_on_fail=False,
+                          override_rejection=False):
+        """Approves a hit so that the worker can get paid.
+
+        Args:
+            hit_id: The hit id to disable.
+            reject_on_fail: If the hit returns unparsable answers,
+                then reject it.
+            override_rejection: overrides a previous rejection if it exists.
+
+        Returns:
+           Tuple of the assignment ids that were approved and rejected.
+        """
+        status = ['Approved', 'Submitted', 'Rejected']
+        try:
+            assignments = [a async for a in self.iter_assignments(
+                    hit_id, statuses=status)]
+        except Exception:
+            return [], []
+        submitted = [a for a in assignments
+                     if a['AssignmentStatus'] == 'Submitted']
+        outputs, _ = self.easyturk.parse_assignments(submitted)
+        approve_ids = []
+        reject_ids = []
+        for a in submitted:
+            if outputs.get(a['AssignmentId']) is not None:
+                approve_ids.append(a['AssignmentId'])
+            elif reject_on_fail:
+                reject_ids.append(a['AssignmentId'])
+
+        calls = [self._call('approve_assignment', AssignmentId=assignment_id,
+                            RequesterFeedback='Good job',
+                            OverrideRejection=override_rejection)
+                 for assignment_id in approve_ids]
+        calls += [self._call('reject_assignment', AssignmentId=assignment_id,
+                             RequesterFeedback='Invalid results')
+                  for assignment_id in reject_ids]
+        responses = await asyncio.gather(*calls, return_exceptions=True)
+        done = []
+        for assignment_id, response in zip(approve_ids + reject_ids,
+                                           responses):
+            if isinstance(response, Exception):
+                print(response)
+            else:
+                done.append(assignment_id)
+        return ([a for a in approve_ids if a in done],
+                [a for a in reject_ids if a in done])
+
+    async def reject_assignment(self, assignment_id):
+        """Reject an assignment so that the worker can get paid.
+
+        Args:
+            assignment_id: An assignment id.
+
+        Returns:
+            A boolean indicating success.
+        """
+        response = await self._call('get_assignment',
+                                    AssignmentId=assignment_id)
+        if response['Assignment']['AssignmentStatus'] == 'Submitted':
+            await self._call('reject_assignment', AssignmentId=assignment_id,
+                             RequesterFeedback='Invalid results')
+            return True
+        return False
+
+    async def approve_assignment(self, assignment_id, reject_on_fail=False,
+                                 override_rejection=False):
+        """Approves an assignment so that the worker can get paid.
+
+        Args:
+            assignment_id: An assignment id.
+            reject_on_fail: If the hit returns unparsable answers,
+                then reject it.
+            override_rejection: overrides a previous rejection if it exists.
+
+        Returns:
+            A boolean indicating success.
+        """
+        response = await self._call('get_assignment',
+                                    AssignmentId=assignment_id)
+        a = response['Assignment']
+        if a['AssignmentStatus'] == 'Submitted':
+            output, _ = self.easyturk.parser.parse(a)
+            if output is not None:
+                await self._call('approve_assignment',
+                                 AssignmentId=assignment_id,
+                                 RequesterFeedback='Good job',
+                                 OverrideRejection=override_rejection)
+                return True
+            elif reject_on_fail:
+                await self._call('reject_assignment',
+                                 AssignmentId=assignment_id,
+                                 RequesterFeedback='Invalid results')
+                return False
+        return False
+
+    async def show_hit_progress(self, hit_ids):
+        """Show the progress of the hits.
+
+        Args:
+            hit_ids: A list of HIT ids.
+
+        Returns:
+            A dictionary from hit_id to a dictionary of completed
+            and maximum assignments, for the HITs that could be fetched.
+        """
+        async def progress(hit_id):
+            hit = await self._call('get_hit', HITId=hit_id)
+            completed = 0
+            async for _ in self.iter_assignments(
+                    hit_id, statuses=['Submitted']):
+                completed += 1
+            return {'completed': completed,
+                    'max_assignments': hit['HIT']['MaxAssignments']}
+
+        progresses = await asyncio.gather(*[progress(h) for h in hit_ids],
+                                          return_exceptions=True)
+        output = {}
+        for hit_id, p in zip(hit_ids, progresses):
+            if isinstance(p, Exception):
+                print(p)
+            else:
+                output[hit_id] = p
+        return output
@@ -0,0 +1,262 @@
+"""Script to benchmark launching, fetching, approving and cleaning up HITs.
+
+Runs EasyTurk against the in-process MockMTurk, so it needs no AWS account,
+and reports the throughput and p50/p99 latency of every stage. With
+--startup, it instead measures how long importing easyturk takes in fresh
+processes.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from .bulk import TokenBucket
+from .bulk import launch_hits
+from .bulk import monotonic
+from .easyturk import EasyTurk
+from .metrics import LATENCY_BUCKETS
+from .mock_mturk import MockMTurk
+
+
+def percentile(values, p):
+    """Computes a percentile with the nearest-rank method.
+
+    Args:
+        values: A list of numbers.
+        p: The percentile, between 0 and 100.
+
+    Returns:
+        The percentile, or None if there are no values.
+    """
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    index = max(0, min(len(values) - 1,
+                       int(round(p / 100.0 * len(values))) - 1))
+    return values[index]
+
+
+def histogram_percentile(histogram, p):
+    """Estimates a percentile from a latency histogram of metrics.Metrics.
+
+    As Prometheus' histogram_quantile, the values are assumed to be spread
+    evenly within their bucket.
+
+    Args:
+        histogram: A histogram snapshot, with count and cumulative buckets.
+        p: The percentile, between 0 and 100.
+
+    Returns:
+        The percentile, the upper bound of the last bucket if it is above
+        it, or None if the histogram is empty.
+    """
+    if histogram is None or histogram['count'] == 0:
+        return None
+    rank = p / 100.0 * histogram['count']
+    lower = 0.0
+    below = 0
+    for bound in LATENCY_BUCKETS:
+        count = histogram['buckets'][str(bound)]
+        if count >= rank:
+            if count == below:
+                return bound
+            return lower + (bound - lower) * (rank - below) / (count - below)
+        lower = bound
+        below = count
+    return LATENCY_BUCKETS[-1]
+
+
+def run_stage(name, et, operation, count, func):
+    """Runs a stage of the benchmark and summarizes it.
+
+    The calls and latencies are read from the metrics of the EasyTurk.
+
+    Args:
+        name: Name of the stage.
+        et: The EasyTurk used by the stage.
+        operation: The client operation whose latency is reported.
+        count: Number of items the stage processes.
+        func: A function that runs the stage.
+
+    Returns:
+        A dictionary with the throughput and latency of the stage.
+    """
+    et.metrics.reset()
+    start = monotonic()
+    func()
+    seconds = monotonic() - start
+    operations = et.metrics.snapshot()['operations']
+    latency = operations.get(operation, {}).get('latency')
+    return {'stage': name,
+            'items': count,
+            'seconds': seconds,
+            'throughput': count / seconds if seconds > 0 else None,
+            'calls': sum(o['calls'] for o in operations.values()),
+            'p50': histogram_percentile(latency, 50),
+            'p99': histogram_percentile(latency, 99)}
+
+
+def benchmark(num_hits=1000, tasks_per_hit=10, max_assignments=1,
+              num_workers=16, rate=100.0, latency=0.05, jitter=0.02,
+              max_rate=None, throttle_probability=0.0,
+              template='write_caption.html'):
+    """Benchmarks the full lifecycle of a batch of HITs.
+
+    Returns:
+        A list of dictionaries, one per stage.
+    """
+    mock = MockMTurk(latency=latency, jitter=jitter, max_rate=max_rate,
+                     throttle_probability=throttle_probability)
+    et = EasyTurk(sandbox=True, client=mock)
+    data = [{'url': 'http://example.com/%d.jpg' % i}
+            for i in range(num_hits * tasks_per_hit)]
+    hit_ids = []
+    results = {}
+    stages = []
+
+    def launch():
+        ids, _ = launch_hits(
+                et, template, data, tasks_per_hit, num_workers=num_workers,
+                rate=rate, reward=1, title='Benchmark',
+                description='Benchmark', keywords='benchmark',
+                max_assignments=max_assignments)
+        hit_ids.extend(h for h in ids if h is not None)
+
+    def fetch():
+        bucket = TokenBucket(rate=rate)
+
+        def get(hit_id):
+            bucket.acquire()
+            return et.get_results(hit_id)
+
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            results.update(zip(hit_ids, executor.map(get, hit_ids)))
+
+    def approve():
+        submitted = [r['assignment_id'] for rs in results.values()
+                     for r in rs if r['status'] == 'Submitted']
+        et.approve_assignments(submitted, num_workers=num_workers, rate=rate)
+
+    def cleanup():
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            list(executor.map(et.delete_hit, hit_ids))
+
+    stages.append(run_stage('launch', et, 'create_hit_with_hit_type',
+                            num_hits, launch))
+    stages.append(run_stage('fetch', et, 'list_assignments_for_hit',
+                            len(hit_ids), fetch))
+    num_assignments = sum(len(rs) for rs in results.values())
+    stages.append(run_stage('approve', et, 'approve_assignment',
+                            num_assignments, approve))
+    stages.append(run_stage('cleanup', et, 'delete_hit', len(hit_ids),
+                            cleanup))
+    return stages
+
+
+# Statements whose startup time is measured, in fresh processes.
+STARTUP_STATEMENTS = [
+    ('import', 'import easyturk'),
+    ('EasyTurk', 'from easyturk import EasyTurk'),
+    ('render', 'from easyturk import EasyTurk; '
+               'EasyTurk().render_template("write_caption.html", [])'),
+    ('interface', 'from easyturk import interface'),
+]
+
+STARTUP_SCRIPT = """import sys, time
+start = time.time()
+exec(sys.argv[1])
+print(time.time() - start, 'boto3' in sys.modules)
+"""
+
+
+def benchmark_startup(repeat=10):
+    """Benchmarks importing easyturk in fresh python processes.
+
+    Args:
+        repeat: Number of processes started per statement.
+
+    Returns:
+        A list of dictionaries, one per statement, with the p50/p99 time
+        of the statement itself and of the whole process, and whether
+        boto3 was imported.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    stages = []
+    for name, statement in STARTUP_STATEMENTS:
+        seconds = []
+        processes = []
+        for _ in range(repeat):
+            start = monotonic()
+            output = subprocess.check_output(
+                    [sys.executable, '-c', STARTUP_SCRIPT, statement],
+                    cwd=root)
+            processes.append(monotonic() - start)
+            statement_seconds, boto3 = output.decode('utf-8').split()
+            seconds.append(float(statement_seconds))
+        stages.append({'stage': name,
+                       'statement': statement,
+                       'p50': percentile(seconds, 50),
+                       'p99': percentile(seconds, 99),
+                       'process_p50': percentile(processes, 50),
+                       'boto3': boto3 == 'True'})
+    return stages
+
+
+def format_ms(seconds):
+    return '-' if seconds is None else '%.1f' % (seconds * 1000)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--hits', type=int, default=1000)
+    parser.add_argument('--tasks-per-hit', type=int, default=10)
+    parser.add_argument('--max-assignments', type=int, default=1)
+    parser.add_argument('--num-workers', type=int, default=16)
+    parser.add_argument('--rate', type=float, default=100.0)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--jitter', type=float, default=0.02)
+    parser.add_argument('--max-rate', type=float, default=None)
+    parser.add_argument('--throttle-probability', type=float, default=0.0)
+    parser.add_argument('--template', default='write_caption.html')
+    parser.add_argument('--json', action='store_true')
+    parser.add_argument('--startup', action='store_true')
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    if args.startup:
+        stages = benchmark_startup(repeat=args.repeat)
+        if args.json:
+            print(json.dumps(stages, indent=2))
+        else:
+            print('%-10s %9s %9s %12s %6s' % (
+                'stage', 'p50 ms', 'p99 ms', 'process ms', 'boto3'))
+            for s in stages:
+                print('%-10s %9s %9s %12s %6s' % (
+                    s['stage'], format_ms(s['p50']), format_ms(s['p99']),
+                    format_ms(s['process_p50']), s['boto3']))
+        sys.exit(0)
+
+    stages = benchmark(
+            num_hits=args.hits, tasks_per_hit=args.tasks_per_hit,
+            max_assignments=args.max_assignments,
+            num_workers=args.num_workers, rate=args.rate,
+            latency=args.latency, jitter=args.jitter,
+            max_rate=args.max_rate,
+            throttle_probability=args.throttle_probability,
+            template=args.template)
+
+    if args.json:
+        print(json.dumps(stages, indent=2))
+    else:
+        print('%-8s %8s %9s %11s %7s %9s %9s' % (
+            'stage', 'items', 'seconds', 'items/sec', 'calls', 'p50 ms',
+            'p99 ms'))
+        for s in stages:
+            print('%-8s %8d %9.2f %11.1f %7d %9s %9s' % (
+                s['stage'], s['items'], s['seconds'], s['throughput'] or 0,
+                s['calls'], format_ms(s['p50']), format_ms(s['p99'])))
@@ -0,0 +1,561 @@
+"""Concurrent, rate-limited bulk operations against MTurk.
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from itertools import islice
+
+import json
+import random
+import threading
+import time
+
+from .journal import LaunchJournal
+from .journal import chunk_token
+from .journal import existing_hit_id
+from .journal import is_duplicate_token_error
+from .payload import PayloadPlanner
+
+
+# Clock used to measure durations, unaffected by changes of the system time.
+monotonic = getattr(time, 'monotonic', time.time)
+
+# Error codes that MTurk and botocore use when a request has been throttled.
+THROTTLE_CODES = ('Throttling', 'ThrottlingException', 'TooManyRequests',
+                  'RequestLimitExceeded', 'ServiceUnavailable')
+
+
+class TokenBucket(object):
+    """Thread-safe token bucket that limits the rate of api calls.
+    """
+
+    def __init__(self, rate=5.0, capacity=None):
+        """Constructor for TokenBucket.
+
+        Args:
+            rate: Number of tokens added to the bucket per second.
+            capacity: Maximum number of tokens the bucket can hold.
+                Defaults to rate, which allows bursts of one second.
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self.tokens = self.capacity
+        self.last = monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """Blocks until the requested number of tokens is available.
+
+        Args:
+            tokens: Number of tokens to consume.
+        """
+        while True:
+            with self.lock:
+                now = monotonic()
+                self.tokens = min(self.capacity,
+                                  self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def is_throttle_error(e):
+    """Checks whether an exception was caused by MTurk throttling.
+
+    Args:
+        e: An exception raised by a boto3 call.
+
+    Returns:
+        A boolean indicating whether the call should be retried.
+    """
+    error = getattr(e, 'response', {}).get('Error', {})
+    if error.get('Code') in THROTTLE_CODES:
+        return True
+    message = str(error.get('Message', e)).lower()
+    return 'rate exceeded' in message or 'throttl' in message
+
+
+def backoff_delay(attempt, backoff=0.5, max_backoff=30.0):
+    """Computes how long to wait before retrying a throttled call.
+
+    Args:
+        attempt: Number of attempts made so far, starting at 1.
+        backoff: Initial backoff in seconds.
+        max_backoff: Upper bound on the backoff in seconds.
+
+    Returns:
+        The exponential backoff of the attempt in seconds, with jitter.
+    """
+    delay = min(max_backoff, backoff * (2 ** (attempt - 1)))
+    return delay * (0.5 + random.random() / 2)
+
+
+def call_with_retry(func, rate_limiter=None, max_retries=5, backoff=0.5,
+                    max_backoff=30.0, on_retry=None):
+    """Calls a function, retrying with exponential backoff when throttled.
+
+    Args:
+        func: A function that takes no arguments and makes an api call.
+        rate_limiter: An optional TokenBucket acquired before every attempt.
+        max_retries: Maximum number of retries after the first attempt.
+        backoff: Initial backoff in seconds.
+        max_backoff: Upper bound on the backoff in seconds.
+        on_retry: An optional function called with the error before every
+            retry, such as metrics.Metrics.record_retry.
+
+    Returns:
+        The function's return value.
+    """
+    attempt = 0
+    while True:
+        attempt += 1
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        try:
+            return func()
+        except Exception as e:
+            if attempt > max_retries or not is_throttle_error(e):
+                raise
+            if on_retry is not None:
+                on_retry(e)
+            time.sleep(backoff_delay(attempt, backoff, max_backoff))
+
+
+def _iter_json_array(f, read_size=65536):
+    """Lazily decodes the elements of a json array from a file.
+
+    Args:
+        f: A file object positioned at the start of the array.
+        read_size: Number of characters read at a time.
+
+    Yields:
+        The elements of the array.
+    """
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    started = False
+    eof = False
+    while True:
+        while pos < len(buf) and (buf[pos].isspace() or buf[pos] == ',' or
+                                  (not started and buf[pos] == '[')):
+            started = started or buf[pos] == '['
+            pos += 1
+        if pos < len(buf) and buf[pos] == ']':
+            return
+        if pos < len(buf):
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                if eof:
+                    raise
+                end = None
+            if end is not None:
+                # Values at the end of the buffer, like numbers, may be
+                # incomplete until the next separator has been read.
+                after = end
+                while after < len(buf) and buf[after].isspace():
+                    after += 1
+                if eof or (after < len(buf) and buf[after] in ',]'):
+                    yield item
+                    pos = end
+                    continue
+        if eof:
+            return
+        data = f.read(read_size)
+        eof = len(data) == 0
+        buf = buf[pos:] + data
+        pos = 0
+
+
+def iter_tasks(data):
+    """Lazily iterates over the tasks to launch.
+
+    Args:
+        data: An iterable of tasks, or the path to a JSONL file or a file
+            containing a json array of tasks.
+
+    Yields:
+        Tasks.
+    """
+    if not isinstance(data, str):
+        for task in data:
+            yield task
+        return
+    with open(data) as f:
+        first = f.read(1)
+        while first.isspace():
+            first = f.read(1)
+        f.seek(0)
+        if first == '[':
+            for task in _iter_json_array(f):
+                yield task
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def chunk(data, tasks_per_hit):
+    """Lazily splits the data into lists of tasks_per_hit tasks.
+
+    Args:
+        data: An iterable of tasks.
+        tasks_per_hit: Number of tasks in each chunk.
+
+    Yields:
+        Chunks of tasks.
+    """
+    iterator = iter(data)
+    while True:
+        tasks = list(islice(iterator, tasks_per_hit))
+        if len(tasks) == 0:
+            return
+        yield tasks
+
+
+def find_hits_by_token(et):
+    """Maps the tokens of HITs launched with a journal to their ids.
+
+    launch_hits stores the UniqueRequestToken of every HIT it launches with
+    a journal in the HIT's RequesterAnnotation, so the HIT of a token can be
+    recovered even when MTurk's duplicate token error does not name it.
+
+    Args:
+        et: An EasyTurk instance.
+
+    Returns:
+        A dictionary from RequesterAnnotation to HITId.
+    """
+    return dict((hit['RequesterAnnotation'], hit['HITId'])
+                for hit in et.iter_hits()
+                if hit.get('RequesterAnnotation'))
+
+
+def launch_hits(et, template, data, tasks_per_hit, num_workers=8, rate=5.0,
+                max_retries=5, max_in_flight=None, max_bytes=None,
+                journal=None, **hit_kwargs):
+    """Launches one HIT per chunk of data using a bounded pool of workers.
+
+    All workers share a single TokenBucket so that the total request rate
+    stays under MTurk's throttling limits. Throttled calls are retried with
+    exponential backoff; any other error marks the chunk as failed.
+
+    The data is read and chunked lazily while earlier chunks are being
+    launched, so memory is bounded by the chunks in flight rather than by
+    the size of the data.
+
+    When max_bytes is set, chunks hold as many tasks, up to tasks_per_hit,
+    as fit in max_bytes. Chunks with a single task that does not fit are
+    reported as failed without being sent. Pass minify=True to also minify
+    the questions, so that more tasks fit.
+
+    With a journal, the progress of every chunk is written to disk, and
+    running the same launch again skips the chunks that were launched and
+    re-issues the ones that were in flight. Those HITs are created with a
+    UniqueRequestToken derived from the content of their chunk, so that
+    MTurk does not create a chunk that was in flight twice. Without a
+    journal, launching the same data again creates new HITs.
+
+    Args:
+        et: An EasyTurk instance.
+        template: The template to launch.
+        data: An iterable of tasks, or the path to a JSONL file or a file
+            containing a json array of tasks.
+        tasks_per_hit: Number of tasks per hit, or the maximum number of
+            tasks per hit when max_bytes is set.
+        num_workers: Maximum number of concurrent create_hit calls.
+        rate: Maximum number of create_hit calls per second.
+        max_retries: Maximum number of retries for a throttled chunk.
+        max_in_flight: Maximum number of chunks read ahead of the oldest
+            unfinished chunk. Defaults to twice num_workers.
+        max_bytes: Optional size budget of each question in bytes.
+        journal: Optional journal.LaunchJournal, or the path to its file,
+            to record and resume the launch. A journal opened from a path
+            is closed when the launch ends.
+        hit_kwargs: Additional arguments passed to EasyTurk.launch_hit.
+
+    Returns:
+        A tuple of hit ids and a report. The hit ids are ordered like the
+        chunks of the input, with None for chunks that failed to launch.
+        The report contains one dictionary per chunk with the following
+        fields:
+            - chunk
+            - start
+            - size
+            - bytes (the size of the question, when max_bytes is set)
+            - hit_id
+            - success
+            - attempts
+            - resumed (whether the HIT was launched by an earlier run)
+            - error
+    """
+    owns_journal = (journal is not None and
+                    not isinstance(journal, LaunchJournal))
+    if owns_journal:
+        journal = LaunchJournal(journal)
+    try:
+        return _launch_hits(et, template, data, tasks_per_hit, num_workers,
+                            rate, max_retries, max_in_flight, max_bytes,
+                            journal, hit_kwargs)
+    finally:
+        if owns_journal:
+            journal.close()
+
+
+def _launch_hits(et, template, data, tasks_per_hit, num_workers, rate,
+                 max_retries, max_in_flight, max_bytes, journal, hit_kwargs):
+    """Implements launch_hits once its journal is open.
+    """
+    if max_in_flight is None:
+        max_in_flight = 2 * num_workers
+    bucket = TokenBucket(rate=rate)
+    tokens = {}
+    tokens_lock = threading.Lock()
+
+    def recover(error, token):
+        """Finds the HIT an earlier run created for a token, or None.
+        """
+        if token is None or not is_duplicate_token_error(error):
+            return None
+        hit_id = existing_hit_id(error)
+        if hit_id is not None:
+            return hit_id
+        # The error does not name the HIT, so list the HITs once and find
+        # it by its RequesterAnnotation.
+        with tokens_lock:
+            if token not in tokens:
+                tokens.update(call_with_retry(
+                        lambda: find_hits_by_token(et),
+                        rate_limiter=bucket,
+                        max_retries=max_retries,
+                        on_retry=et.metrics.record_retry))
+            return tokens.get(token)
+
+    if max_bytes is not None:
+        planner = PayloadPlanner(
+                et, template, max_bytes=max_bytes,
+                frame_height=hit_kwargs.get('frame_height', 9000),
+                minify=hit_kwargs.get('minify', False))
+
+    def launch(index, start, tasks, size):
+        report = {'chunk': index,
+                  'start': start,
+                  'size': len(tasks),
+                  'bytes': size,
+                  'hit_id': None,
+                  'success': False,
+                  'attempts': 0,
+                  'resumed': False,
+                  'error': None}
+        if size is not None and size > max_bytes:
+            report['error'] = ('Question is %d bytes, over the limit of %d.'
+                               % (size, max_bytes))
+            return report
+
+        token = None
+        if journal is not None:
+            token = chunk_token(template, tasks, start, hit_kwargs)
+            hit_id = journal.hit_id(token)
+            if hit_id is not None:
+                report.update({'hit_id': hit_id, 'success': True,
+                               'resumed': True})
+                return report
+            journal.start(token, index)
+
+        def create():
+            report['attempts'] += 1
+            return et.launch_hit(template, tasks, unique_request_token=token,
+                                 requester_annotation=token, **hit_kwargs)
+
+        try:
+            try:
+                hit = call_with_retry(create, rate_limiter=bucket,
+                                      max_retries=max_retries,
+                                      on_retry=et.metrics.record_retry)
+                hit_id = hit['HIT']['HITId']
+            except Exception as e:
+                # The chunk was created by an earlier run that did not get
+                # to record it.
+                hit_id = recover(e, token)
+                if hit_id is None:
+                    raise
+                report['resumed'] = True
+                if et.store is not None:
+                    et.store.add_hit(hit_id, template, tasks,
+                                     hit_kwargs.get('max_assignments', 1))
+            if journal is not None:
+                journal.finish(token, index, hit_id)
+            report['hit_id'] = hit_id
+            report['success'] = True
+        except Exception as e:
+            report['error'] = str(e)
+        return report
+
+    reports = []
+    in_flight = deque()
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        if max_bytes is not None:
+            chunks = planner.plan(iter_tasks(data), tasks_per_hit)
+        else:
+            chunks = ((tasks, None)
+                      for tasks in chunk(iter_tasks(data), tasks_per_hit))
+        start = 0
+        for index, (tasks, size) in enumerate(chunks):
+            in_flight.append(executor.submit(launch, index, start, tasks,
+                                             size))
+            start += len(tasks)
+            if len(in_flight) >= max_in_flight:
+                reports.append(in_flight.popleft().result())
+        while in_flight:
+            reports.append(in_flight.popleft().result())
+    hit_ids = [r['hit_id'] for r in reports]
+    return hit_ids, reports
+
+
+def _num_submitted(hit):
+    """Number of assignments of a HIT that are submitted but not reviewed.
+    """
+    return (hit['MaxAssignments'] - hit['NumberOfAssignmentsAvailable'] -
+            hit['NumberOfAssignmentsPending'] -
+            hit['NumberOfAssignmentsCompleted'])
+
+
+def cleanup_hits(et, statuses=None, created_before=None, created_after=None,
+                 hit_type_id=None, approve=False, wait=0, poll_interval=10,
+                 num_workers=8, rate=5.0, max_retries=5):
+    """Expires and deletes every matching HIT of the account concurrently.
+
+    HITs are listed page by page and filtered. The selected HITs are
+    expired in parallel, then polled until none of their assignments are
+    being worked on or awaiting review, and deleted in parallel as soon as
+    they are. Submitted assignments are approved if approve is set,
+    otherwise they have to be reviewed elsewhere within wait seconds.
+
+    Args:
+        et: An EasyTurk instance.
+        statuses: Optional list of HITStatus values to clean up.
+        created_before: Optional datetime (with a timezone) before which
+            the HITs were created.
+        created_after: Optional datetime (with a timezone) after which the
+            HITs were created.
+        hit_type_id: Optional HITTypeId of the HITs.
+        approve: Whether to approve submitted assignments.
+        wait: Seconds to keep polling HITs with pending assignments.
+        poll_interval: Seconds between polls.
+        num_workers: Maximum number of concurrent api calls.
+        rate: Maximum number of api calls per second.
+        max_retries: Maximum number of retries for a throttled call.
+
+    Returns:
+        A list with one dictionary per selected HIT with the following
+        fields:
+            - hit_id
+            - hit_type_id
+            - status (before the cleanup)
+            - expired
+            - approved (the number of assignments approved)
+            - deleted
+            - error
+    """
+    bucket = TokenBucket(rate=rate)
+
+    def call(func):
+        return call_with_retry(func, rate_limiter=bucket,
+                               max_retries=max_retries,
+                               on_retry=et.metrics.record_retry)
+
+    def selected(hit):
+        created = hit['CreationTime']
+        if statuses is not None and hit['HITStatus'] not in statuses:
+            return False
+        if created_before is not None and created >= created_before:
+            return False
+        if created_after is not None and created <= created_after:
+            return False
+        if hit_type_id is not None and hit['HITTypeId'] != hit_type_id:
+            return False
+        return True
+
+    hits = call(lambda: list(et.iter_hits(where=selected)))
+    reports = [{'hit_id': hit['HITId'],
+                'hit_type_id': hit['HITTypeId'],
+                'status': hit['HITStatus'],
+                'expired': False,
+                'approved': 0,
+                'deleted': False,
+                'error': None} for hit in hits]
+
+    def expire(args):
+        hit, report = args
+        if hit['HITStatus'] not in ('Assignable', 'Unassignable'):
+            return hit
+        try:
+            call(lambda: et.mtc.update_expiration_for_hit(
+                    HITId=hit['HITId'], ExpireAt=datetime.now()))
+            report['expired'] = True
+        except Exception as e:
+            report['error'] = str(e)
+            return hit
+        # Assignments may have been submitted since the HITs were listed,
+        # so the HIT is fetched again by settle.
+        return None
+
+    def settle(args):
+        """Approves what it can and returns whether the HIT can be deleted.
+        """
+        hit, report = args
+        try:
+            if hit is None:
+                hit = call(lambda: et.mtc.get_hit(HITId=report['hit_id']))
+                hit = hit['HIT']
+            if approve and _num_submitted(hit) > 0:
+                submitted = call(lambda: list(et.iter_assignments(
+                        report['hit_id'], statuses=['Submitted'])))
+                for a in submitted:
+                    call(lambda: et.mtc.approve_assignment(
+                            AssignmentId=a['AssignmentId'],
+                            RequesterFeedback='Good job'))
+                    report['approved'] += 1
+                return hit['NumberOfAssignmentsPending'] == 0, report
+            return (hit['NumberOfAssignmentsPending'] == 0 and
+                    _num_submitted(hit) == 0), report
+        except Exception as e:
+            report['error'] = str(e)
+            return False, report
+
+    def delete(report):
+        try:
+            call(lambda: et.mtc.delete_hit(HITId=report['hit_id']))
+            report['deleted'] = True
+        except Exception as e:
+            report['error'] = str(e)
+
+    deadline = monotonic() + wait
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        hits = list(executor.map(expire, zip(hits, reports)))
+        todo = [(hit, r) for hit, r in zip(hits, reports)
+                if r['error'] is None]
+        while len(todo) > 0:
+            ready = []
+            waiting = []
+            for done, report in executor.map(settle, todo):
+                if done:
+                    ready.append(report)
+                elif report['error'] is None:
+                    # Poll the HIT again in the next round.
+                    waiting.append((None, report))
+            list(executor.map(delete, ready))
+            todo = waiting
+            if len(todo) > 0 and monotonic() + poll_interval > deadline:
+                break
+            if len(todo) > 0:
+                time.sleep(poll_interval)
+    for _, report in todo:
+        report['error'] = ('Assignments are still being worked on or '
+                           'awaiting review.')
+    return reports
@@ -0,0 +1,390 @@
+"""Incremental aggregation of the redundant labels of several workers.
+
+When a HIT has more than one assignment, the aggregators below merge the
+outputs of its workers into one consensus label per (hit_id, task index).
+Results can be added as they arrive: only the tasks they belong to are
+updated, and the worker-reliability model is refined from its previous
+estimates instead of being fit from scratch.
+
+Requires numpy.
+"""
+
+import numpy as np
+
+from .score import boxes_to_array
+from .score import iou
+
+
+# Ways VoteAggregator can combine the votes of a task.
+METHODS = ('majority', 'weighted', 'em')
+
+
+def _labels(output, field):
+    """Iterates over the labels of an output.
+
+    Args:
+        output: The parsed output of an assignment, a list with one entry
+            per task.
+        field: The field of each task that holds its label.
+
+    Yields:
+        Tuples of the task index, a key and a label. Labels that are
+        dictionaries, like the option of verify_bbox, yield one label per
+        key, other labels use the key None.
+    """
+    for i, task in enumerate(output or []):
+        if not isinstance(task, dict) or task.get(field) is None:
+            continue
+        value = task[field]
+        if isinstance(value, dict):
+            for key, label in value.items():
+                if label is not None:
+                    yield i, key, label
+        else:
+            yield i, None, value
+
+
+class VoteAggregator(object):
+    """Aggregates categorical labels, like those of the verify_* tasks.
+
+    Supports three methods:
+        - majority: the label with the most votes.
+        - weighted: votes weighted by the log odds of each worker's rate of
+          agreement with the majority.
+        - em: a one-coin Dawid-Skene model, fit with expectation
+          maximization, that jointly estimates each worker's accuracy and
+          each task's label.
+    """
+
+    def __init__(self, method='majority', field='option', smoothing=1.0,
+                 em_iterations=50, em_tolerance=1e-4):
+        """Constructor for VoteAggregator.
+
+        Args:
+            method: One of METHODS.
+            field: The field of each task's output that holds the label.
+            smoothing: Pseudo counts added to the estimated reliability of
+                every worker.
+            em_iterations: Maximum number of iterations per fit.
+            em_tolerance: Change in accuracies below which a fit stops.
+        """
+        if method not in METHODS:
+            raise ValueError('Unknown method %s, expected one of %s.' %
+                             (method, ', '.join(METHODS)))
+        self.method = method
+        self.field = field
+        self.smoothing = smoothing
+        self.em_iterations = em_iterations
+        self.em_tolerance = em_tolerance
+        self.seen = set()
+        self.items = {}
+        self.agreements = {}
+        self.totals = {}
+
+        # Label matrix of the em model, one (item, worker, label) per row.
+        self.item_index = {}
+        self.worker_index = {}
+        self.label_index = {}
+        self.rows = []
+        self.accuracy = np.zeros(0)
+        self.class_prior = np.zeros(0)
+        self.posteriors = None
+        self.fitted_rows = 0
+
+    def add(self, results):
+        """Adds the votes of new assignments.
+
+        Assignments that were already added are skipped.
+
+        Args:
+            results: A list of results, as returned by EasyTurk.get_results.
+
+        Returns:
+            The set of (hit_id, task index) whose votes changed.
+        """
+        updated = set()
+        for result in results:
+            if result['assignment_id'] in self.seen:
+                continue
+            self.seen.add(result['assignment_id'])
+            for i, key, label in _labels(result['output'], self.field):
+                if self._vote((result['hit_id'], i, key),
+                              result['worker_id'], label):
+                    updated.add((result['hit_id'], i))
+        return updated
+
+    def _vote(self, key, worker_id, label):
+        """Adds a vote and updates the majority and worker agreements.
+
+        Returns:
+            Whether the vote was added.
+        """
+        item = self.items.get(key)
+        if item is None:
+            item = {'votes': {}, 'counts': {}, 'majority': None}
+            self.items[key] = item
+            self.item_index[key] = len(self.item_index)
+        if worker_id in item['votes']:
+            return False
+        item['votes'][worker_id] = label
+        item['counts'][label] = item['counts'].get(label, 0) + 1
+
+        # The majority only changes when another label overtakes it.
+        old = item['majority']
+        new = old
+        if old is None or item['counts'][label] > item['counts'][old]:
+            new = label
+        if new != old:
+            for other, other_label in item['votes'].items():
+                if other == worker_id:
+                    continue
+                if other_label == old:
+                    self.agreements[other] -= 1
+                elif other_label == new:
+                    self.agreements[other] += 1
+            item['majority'] = new
+        self.totals[worker_id] = self.totals.get(worker_id, 0) + 1
+        self.agreements[worker_id] = (self.agreements.get(worker_id, 0) +
+                                      (1 if label == new else 0))
+
+        if worker_id not in self.worker_index:
+            self.worker_index[worker_id] = len(self.worker_index)
+        if label not in self.label_index:
+            self.label_index[label] = len(self.label_index)
+        self.rows.append((self.item_index[key], self.worker_index[worker_id],
+                          self.label_index[label]))
+        return True
+
+    def _agreement_rate(self, worker_id):
+        return ((self.agreements[worker_id] + self.smoothing) /
+                (self.totals[worker_id] + 2 * self.smoothing))
+
+    def _fit(self):
+        """Fits the em model, starting from the previous estimates.
+        """
+        if self.fitted_rows == len(self.rows):
+            return
+        rows = np.asarray(self.rows, dtype=np.int64)
+        items, workers, labels = rows[:, 0], rows[:, 1], rows[:, 2]
+        num_items = len(self.item_index)
+        num_workers = len(self.worker_index)
+        num_labels = max(2, len(self.label_index))
+
+        # New workers start from their agreement with the majority, and
+        # new labels from a uniform prior.
+        worker_ids = sorted(self.worker_index, key=self.worker_index.get)
+        accuracy = np.asarray([self._agreement_rate(w)
+                               for w in worker_ids])
+        accuracy[:len(self.accuracy)] = self.accuracy
+        prior = np.full(num_labels, 1.0 / num_labels)
+        if len(self.class_prior) > 0:
+            prior[:len(self.class_prior)] = self.class_prior
+            prior /= prior.sum()
+
+        counts = np.bincount(workers, minlength=num_workers)
+        for _ in range(self.em_iterations):
+            accuracy = np.clip(accuracy, 1e-3, 1 - 1e-3)
+            right = np.log(accuracy)
+            wrong = np.log((1 - accuracy) / (num_labels - 1))
+
+            # Expectation: posterior over the true label of every item.
+            log_posteriors = np.tile(np.log(prior), (num_items, 1))
+            log_posteriors += np.bincount(
+                    items, weights=wrong[workers],
+                    minlength=num_items)[:, None]
+            np.add.at(log_posteriors, (items, labels),
+                      right[workers] - wrong[workers])
+            log_posteriors -= log_posteriors.max(axis=1, keepdims=True)
+            posteriors = np.exp(log_posteriors)
+            posteriors /= posteriors.sum(axis=1, keepdims=True)
+
+            # Maximization: worker accuracies and the label prior.
+            correct = np.bincount(workers, weights=posteriors[items, labels],
+                                  minlength=num_workers)
+            new_accuracy = ((correct + self.smoothing) /
+                            (counts + 2 * self.smoothing))
+            prior = ((posteriors.sum(axis=0) + 1) /
+                     (num_items + num_labels))
+            change = np.abs(new_accuracy - accuracy).max()
+            accuracy = new_accuracy
+            if change < self.em_tolerance:
+                break
+
+        self.accuracy = accuracy
+        self.class_prior = prior
+        self.posteriors = posteriors
+        self.fitted_rows = len(self.rows)
+
+    def worker_reliability(self):
+        """Estimates how reliable every worker is.
+
+        Returns:
+            A dictionary from worker_id to the worker's estimated accuracy
+            with the em method, or to its smoothed rate of agreement with
+            the majority otherwise.
+        """
+        if self.method == 'em':
+            self._fit()
+            return dict((w, float(self.accuracy[i]))
+                        for w, i in self.worker_index.items())
+        return dict((w, self._agreement_rate(w)) for w in self.totals)
+
+    def _label(self, key, item, weights, labels):
+        if self.method == 'majority':
+            return item['majority']
+        if self.method == 'em':
+            return labels[int(np.argmax(self.posteriors[
+                    self.item_index[key]]))]
+        scores = {}
+        for worker_id, label in item['votes'].items():
+            scores[label] = scores.get(label, 0.0) + weights[worker_id]
+        return max(scores, key=scores.get)
+
+    def consensus(self, keys=None):
+        """Computes the consensus label of every task.
+
+        Args:
+            keys: An optional collection of (hit_id, task index), such as
+                the return value of add, to only compute those tasks.
+
+        Returns:
+            A dictionary from (hit_id, task index) to the consensus label,
+            or to a dictionary from key to label for dictionary labels.
+        """
+        weights = None
+        labels = None
+        if self.method == 'weighted':
+            num_labels = max(2, len(self.label_index))
+            weights = {}
+            for worker_id in self.totals:
+                rate = self._agreement_rate(worker_id)
+                weights[worker_id] = (np.log(rate / (1 - rate)) +
+                                      np.log(num_labels - 1))
+        elif self.method == 'em':
+            self._fit()
+            labels = sorted(self.label_index, key=self.label_index.get)
+
+        if keys is not None:
+            keys = set(keys)
+        output = {}
+        for key, item in self.items.items():
+            hit_id, i, label_key = key
+            if keys is not None and (hit_id, i) not in keys:
+                continue
+            label = self._label(key, item, weights, labels)
+            if label_key is None:
+                output[(hit_id, i)] = label
+            else:
+                output.setdefault((hit_id, i), {})[label_key] = label
+        return output
+
+
+class BoxAggregator(object):
+    """Clusters the bboxes drawn by several workers, like in annotate_bbox.
+
+    Every box is matched to the cluster of the same task whose median box
+    overlaps it the most, if their IoU is at least iou_threshold and no
+    other box of the same worker is in it. Otherwise it starts a new
+    cluster.
+    """
+
+    def __init__(self, iou_threshold=0.5, min_support=0.5,
+                 field='objects'):
+        """Constructor for BoxAggregator.
+
+        Args:
+            iou_threshold: Minimum IoU of a box with a cluster to join it.
+            min_support: Minimum fraction of the workers of a task that
+                must have drawn a cluster for it to be in the consensus.
+            field: The field of each task's output that holds the list of
+                objects, each with a name and a rect.
+        """
+        self.iou_threshold = iou_threshold
+        self.min_support = min_support
+        self.field = field
+        self.seen = set()
+        self.items = {}
+
+    def add(self, results):
+        """Adds the boxes of new assignments.
+
+        Assignments that were already added are skipped.
+
+        Args:
+            results: A list of results, as returned by EasyTurk.get_results.
+
+        Returns:
+            The set of (hit_id, task index) whose clusters changed.
+        """
+        updated = set()
+        for result in results:
+            if result['assignment_id'] in self.seen:
+                continue
+            self.seen.add(result['assignment_id'])
+            for i, task in enumerate(result['output'] or []):
+                if not isinstance(task, dict):
+                    continue
+                key = (result['hit_id'], i)
+                item = self.items.setdefault(
+                        key, {'workers': set(), 'clusters': [],
+                              'centers': np.zeros((0, 4))})
+                item['workers'].add(result['worker_id'])
+                for obj in task.get(self.field) or []:
+                    if obj.get('rect') is not None:
+                        self._cluster(item, result['worker_id'], obj)
+                updated.add(key)
+        return updated
+
+    def _cluster(self, item, worker_id, obj):
+        box = boxes_to_array([obj['rect']])[0]
+        best = None
+        if len(item['clusters']) > 0:
+            overlaps = iou(item['centers'], box[None, :])
+            for c, cluster in enumerate(item['clusters']):
+                if worker_id in cluster['workers']:
+                    overlaps[c] = -1
+            c = int(np.argmax(overlaps))
+            if overlaps[c] >= self.iou_threshold:
+                best = c
+        if best is None:
+            item['clusters'].append({'boxes': [], 'names': [],
+                                     'workers': set()})
+            item['centers'] = np.vstack([item['centers'], box])
+            best = len(item['clusters']) - 1
+        cluster = item['clusters'][best]
+        cluster['boxes'].append(box)
+        cluster['names'].append(obj.get('name'))
+        cluster['workers'].add(worker_id)
+        item['centers'][best] = np.median(cluster['boxes'], axis=0)
+
+    def consensus(self, keys=None):
+        """Computes the consensus objects of every task.
+
+        Args:
+            keys: An optional collection of (hit_id, task index), such as
+                the return value of add, to only compute those tasks.
+
+        Returns:
+            A dictionary from (hit_id, task index) to a list of objects,
+            most supported first. Each object is a dictionary with the
+            most common name, the median rect and its support, the fraction
+            of the task's workers that drew it.
+        """
+        output = {}
+        for key, item in self.items.items():
+            if keys is not None and key not in keys:
+                continue
+            objects = []
+            for c, cluster in enumerate(item['clusters']):
+                support = float(len(cluster['workers'])) / len(item['workers'])
+                if support < self.min_support:
+                    continue
+                names = [n for n in cluster['names'] if n]
+                x, y, w, h = item['centers'][c].tolist()
+                objects.append({'name': (max(set(names), key=names.count)
+                                         if names else None),
+                                'rect': {'x': x, 'y': y, 'w': w, 'h': h},
+                                'support': support})
+            objects.sort(key=lambda o: -o['support'])
+            output[key] = objects
+        return output
@@ -1,45 +1,187 @@
 """A bunch of api calls functions that we used to talk to MTurk.
 """
 
-from boto3 import Session
+from .bulk import TokenBucket
+from .bulk import call_with_retry
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from jinja2 import Environment
-from jinja2 import FileSystemLoader
+from .metrics import InstrumentedClient
+from .metrics import Metrics
+from .parse import AnswerParser
+from .payload import compact_json
+from .payload import minify_html
+from .store import FINAL_STATUSES
+from .store import HITStore
 
 import json
 import os
-import xml
+import threading
+
+
+# Marker rendered in place of the input so that the static html around it
+# can be cached and reused for every HIT.
+INPUT_PLACEHOLDER = '__EASYTURK_INPUT_PLACEHOLDER__'
+
+ENVIRONMENTS = {
+        "production": {
+            "endpoint": "https://mturk-requester.us-east-1.amazonaws.com",
+            "preview": "https://www.mturk.com/mturk/preview"
+        },
+        "sandbox": {
+            "endpoint": "https://mturk-requester-sandbox.us-east-1.amazonaws.com",
+            "preview": "https://workersandbox.mturk.com/mturk/preview"
+        },
+}
+
+# Events that notifications are sent for by default.
+NOTIFICATION_EVENTS = ('AssignmentSubmitted', 'HITReviewable')
+
+# Arguments of create_hit that describe the HIT type instead of the HIT.
+HIT_TYPE_KEYS = ('Title', 'Description', 'Keywords', 'Reward',
+                 'AssignmentDurationInSeconds', 'AutoApprovalDelayInSeconds',
+                 'QualificationRequirements')
+
+# Default size of the connection pool of the shared MTurk clients.
+MAX_POOL_CONNECTIONS = 50
+
+_jinja_envs = {}
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_jinja_env(cache_dir=None):
+    """Get a jinja2 Environment object that we can use to find templates.
+
+    Environments are shared within the process and compiled templates are
+    stored in an on-disk bytecode cache, so each template is compiled once
+    per process and not at all by later processes.
+
+    Args:
+        cache_dir: Directory for the bytecode cache. Defaults to the
+            EASYTURK_CACHE_DIR environment variable or the system's
+            temporary directory.
+
+    Returns:
+        A jinja2 Environment.
+    """
+    from jinja2 import Environment
+    from jinja2 import FileSystemBytecodeCache
+    from jinja2 import FileSystemLoader
+
+    cache_dir = cache_dir or os.environ.get('EASYTURK_CACHE_DIR')
+    if cache_dir not in _jinja_envs:
+        dir_location = os.path.dirname(os.path.abspath(__file__))
+        templates = os.path.join(dir_location, 'templates')
+        if cache_dir is not None and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        _jinja_envs[cache_dir] = Environment(
+                loader=FileSystemLoader(templates),
+                bytecode_cache=FileSystemBytecodeCache(cache_dir))
+    return _jinja_envs[cache_dir]
+
+
+def get_client(sandbox=True, max_pool_connections=MAX_POOL_CONNECTIONS,
+               keep_alive=True):
+    """Get an MTurk client that is shared within the process.
+
+    Creating a client loads the botocore service models and opens new
+    connections, so clients are created once per configuration and reused
+    by every EasyTurk. boto3 clients are safe to use from many threads.
+
+    Args:
+        sandbox: Whether the client talks to the sandbox.
+        max_pool_connections: Maximum number of connections kept open.
+        keep_alive: Whether to enable TCP keep-alive on the connections.
+
+    Returns:
+        A boto3 MTurk client.
+    """
+    from boto3 import Session
+    from botocore.config import Config
+
+    key = (sandbox, max_pool_connections, keep_alive)
+    with _clients_lock:
+        if key not in _clients:
+            env = (ENVIRONMENTS['sandbox'] if sandbox
+                   else ENVIRONMENTS["production"])
+            try:
+                config = Config(max_pool_connections=max_pool_connections,
+                                tcp_keepalive=keep_alive)
+            except TypeError:
+                # botocore before 1.27 has no tcp_keepalive option, but
+                # still keeps pooled connections alive between requests.
+                config = Config(max_pool_connections=max_pool_connections)
+            session = Session(profile_name='mturk')
+            _clients[key] = session.client(
+                    service_name='mturk',
+                    region_name='us-east-1',
+                    endpoint_url=env['endpoint'],
+                    config=config,
+            )
+        return _clients[key]
+
+
+def _is_finished(hit):
+    """Whether a HIT can no longer receive any work.
+
+    Args:
+        hit: A HIT dictionary from list_hits or get_hit.
+
+    Returns:
+        True if the HIT is Reviewable or Disposed, or has expired, and no
+        assignment is still being worked on.
+    """
+    if hit.get('NumberOfAssignmentsPending', 0) > 0:
+        return False
+    if hit['HITStatus'] in ('Reviewable', 'Disposed'):
+        return True
+    expiration = hit.get('Expiration')
+    return (expiration is not None and
+            expiration <= datetime.now(expiration.tzinfo))
 
 
 class EasyTurk(object):
     """Class that contains all the api calls to interface with MTurk.
+
+    The MTurk client and the jinja2 environment are created the first time
+    they are needed, so an EasyTurk that only renders templates never
+    imports boto3 or loads AWS credentials.
     """
 
-    def __init__(self, sandbox=True):
+    def __init__(self, sandbox=True, template_cache_dir=None, store=None,
+                 client=None, parse_processes=None, metrics=None,
+                 max_pool_connections=MAX_POOL_CONNECTIONS):
         """Constructor for EasyTurk.
 
         Args:
             sandbox: Whether we are launching on sandbox.
+            template_cache_dir: Directory for compiled templates.
+            store: An optional HITStore, or the path to its database, that
+                records launched HITs and their assignments.
+            client: An optional MTurk client to use instead of the shared
+                one from get_client, such as a mock_mturk.MockMTurk.
+            parse_processes: Number of processes used to parse large
+                batches of answers. None parses in the calling thread.
+            metrics: An optional metrics.Metrics to record api calls and
+                stage timings in, for example to share one between several
+                EasyTurk instances. A new one is created by default.
+            max_pool_connections: Size of the connection pool of the
+                shared client.
         """
-        environments = {
-                "production": {
-                    "endpoint": "https://mturk-requester.us-east-1.amazonaws.com",
-                    "preview": "https://www.mturk.com/mturk/preview"
-                },
-                "sandbox": {
-                    "endpoint": "https://mturk-requester-sandbox.us-east-1.amazonaws.com",
-                    "preview": "https://workersandbox.mturk.com/mturk/preview"
-                },
-        }
         self.sandbox = sandbox
-        env = (environments['sandbox'] if sandbox
-               else environments["production"])
-        self.session = Session(profile_name='mturk')
-        self.mtc = self.session.client(
-                service_name='mturk',
-                region_name='us-east-1',
-                endpoint_url=env['endpoint'],
-        )
+        self.max_pool_connections = max_pool_connections
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.mtc = client
+        self.template_cache_dir = template_cache_dir
+        self.jinja_env = None
+        self.template_parts = {}
+        if store is not None and not isinstance(store, HITStore):
+            store = HITStore(store)
+        self.store = store
+        self.parser = AnswerParser(processes=parse_processes)
+        self.hit_types = {}
+        self.hit_types_lock = threading.Lock()
+        self.notification = None
 
     def create_html_question(self, html, frame_height):
         head = ("<HTMLQuestion xmlns=\"http://mechanicalturk.amazonaws.com/"
@@ -49,12 +191,74 @@ class EasyTurk(object):
         xml = head + str(frame_height) + tail
         return xml.format(html)
 
+    @property
+    def mtc(self):
+        """The instrumented MTurk client, created on first use.
+        """
+        if self._mtc is None:
+            self.mtc = self._create_client()
+        return self._mtc
+
+    @mtc.setter
+    def mtc(self, client):
+        if client is not None:
+            client = InstrumentedClient(client, self.metrics)
+        self._mtc = client
+
+    def _create_client(self):
+        """Gets the shared MTurk client for this instance's settings.
+        """
+        return get_client(sandbox=self.sandbox,
+                          max_pool_connections=self.max_pool_connections)
+
     def get_jinja_env(self):
         """Get a jinja2 Environment object that we can use to find templates.
         """
-        dir_location = os.path.dirname(os.path.abspath(__file__))
-        templates = os.path.join(dir_location, 'templates')
-        return Environment(loader=FileSystemLoader(templates))
+        if self.jinja_env is None:
+            self.jinja_env = get_jinja_env(self.template_cache_dir)
+        return self.jinja_env
+
+    def get_template_parts(self, template_location, minify=False):
+        """Pre-renders the static html before and after the input payload.
+
+        Args:
+            template_location: The template to render.
+            minify: Whether to minify the html and inlined javascript.
+
+        Returns:
+            A tuple of the html prefix and suffix, or None if the template
+            does not render its input exactly once.
+        """
+        key = (template_location, minify)
+        if key not in self.template_parts:
+            template = self.get_jinja_env().get_template(template_location)
+            html = template.render({'input': INPUT_PLACEHOLDER})
+            parts = html.split(INPUT_PLACEHOLDER)
+            if minify:
+                parts = [minify_html(part) for part in parts]
+            self.template_parts[key] = (
+                    tuple(parts) if len(parts) == 2 else None)
+        return self.template_parts[key]
+
+    def render_template(self, template_location, input_data, minify=False):
+        """Renders a template with the given input.
+
+        Args:
+            template_location: The template to render.
+            input_data: A json serializable object passed to the template.
+            minify: Whether to minify the html and inlined javascript.
+
+        Returns:
+            The rendered html.
+        """
+        with self.metrics.time_stage('render'):
+            payload = compact_json(input_data)
+            parts = self.get_template_parts(template_location, minify=minify)
+            if parts is None:
+                template = self.get_jinja_env().get_template(template_location)
+                html = template.render({'input': payload})
+                return minify_html(html) if minify else html
+            return parts[0] + payload + parts[1]
 
     def get_account_balance(self):
         """Retrieves the account balance.
@@ -64,17 +268,19 @@ class EasyTurk(object):
         """
         return self.mtc.get_account_balance()['AvailableBalance']
 
-    def launch_hit(self, template_location, input_data, reward=0,
-                   frame_height=9000, title=None, description=None,
-                   keywords=None, duration=900, max_assignments=1,
-                   country='US', hits_approved=10000, lifetime=604800,
-                   percent_approved=95):
-        """Launches a HIT.
+    def get_hit_properties(self, template_location, input_data, reward=0,
+                           frame_height=9000, title=None, description=None,
+                           keywords=None, duration=900, max_assignments=1,
+                           country='US', hits_approved=10000,
+                           lifetime=604800, percent_approved=95,
+                           minify=False, unique_request_token=None,
+                           requester_annotation=None):
+        """Builds the arguments of the create_hit call for a HIT.
 
-        Make sure that none of the arguments are None.
+        Takes the arguments of launch_hit, other than hit_type.
 
         Returns:
-            A hit_id.
+            A dictionary of create_hit arguments.
         """
         if self.sandbox:
             percent_approved = 0
@@ -107,15 +313,134 @@ class EasyTurk(object):
                           'Reward': str(reward)}
 
         # Setup HTML Question.
-        env = self.get_jinja_env()
-        template = env.get_template(template_location)
-        template_params = {'input': json.dumps(input_data)}
-        html = template.render(template_params)
+        html = self.render_template(template_location, input_data,
+                                    minify=minify)
         html_question = self.create_html_question(html, frame_height)
 
         hit_properties['Question'] = html_question
+        if unique_request_token is not None:
+            hit_properties['UniqueRequestToken'] = unique_request_token
+        if requester_annotation is not None:
+            hit_properties['RequesterAnnotation'] = requester_annotation
+        return hit_properties
+
+    def split_hit_properties(self, hit_properties):
+        """Splits create_hit arguments into HIT type and HIT arguments.
+
+        Args:
+            hit_properties: A dictionary of create_hit arguments.
+
+        Returns:
+            A tuple of the create_hit_type arguments and the remaining
+            arguments of create_hit_with_hit_type.
+        """
+        hit_type = {}
+        rest = {}
+        for key, value in hit_properties.items():
+            if key in HIT_TYPE_KEYS:
+                hit_type[key] = value
+            else:
+                rest[key] = value
+        return hit_type, rest
+
+    def get_hit_type(self, hit_type_properties):
+        """Registers a HIT type once and caches its id.
+
+        Args:
+            hit_type_properties: A dictionary of create_hit_type arguments.
+
+        Returns:
+            The HITTypeId.
+        """
+        key = json.dumps(hit_type_properties, sort_keys=True)
+        with self.hit_types_lock:
+            if key not in self.hit_types:
+                response = call_with_retry(
+                        lambda: self.mtc.create_hit_type(
+                            **hit_type_properties),
+                        on_retry=self.metrics.record_retry)
+                self.hit_types[key] = response['HITTypeId']
+                if self.notification is not None:
+                    self._set_notification(response['HITTypeId'],
+                                           self.notification)
+            return self.hit_types[key]
+
+    def _set_notification(self, hit_type_id, notification):
+        call_with_retry(
+                lambda: self.mtc.update_notification_settings(
+                    HITTypeId=hit_type_id,
+                    Notification=notification,
+                    Active=True),
+                on_retry=self.metrics.record_retry)
+
+    def enable_notifications(self, queue_url, hit_type_ids=None,
+                             event_types=NOTIFICATION_EVENTS):
+        """Sends the events of HIT types to an SQS queue.
 
-        hit = self.mtc.create_hit(**hit_properties)
+        The events are consumed by notify.NotificationConsumer. Unless
+        hit_type_ids is given, notifications are enabled for every HIT type
+        this instance has launched HITs with, and for every HIT type it
+        registers afterwards. HIT types are registered per instance, so
+        launch with this instance, for example by passing it as the et of
+        the interface.launch_* functions.
+
+        Args:
+            queue_url: The url of the SQS queue. Its policy must allow
+                MTurk to send messages to it.
+            hit_type_ids: Optional list of HITTypeIds.
+            event_types: The events to be notified of.
+        """
+        notification = {'Destination': queue_url,
+                        'Transport': 'SQS',
+                        'Version': '2014-08-15',
+                        'EventTypes': list(event_types)}
+        if hit_type_ids is None:
+            with self.hit_types_lock:
+                self.notification = notification
+                hit_type_ids = list(self.hit_types.values())
+        for hit_type_id in hit_type_ids:
+            self._set_notification(hit_type_id, notification)
+
+    def launch_hit(self, template_location, input_data, reward=0,
+                   frame_height=9000, title=None, description=None,
+                   keywords=None, duration=900, max_assignments=1,
+                   country='US', hits_approved=10000, lifetime=604800,
+                   percent_approved=95, minify=False, hit_type=True,
+                   unique_request_token=None, requester_annotation=None):
+        """Launches a HIT.
+
+        Make sure that none of the arguments are None. Set minify to
+        shrink the question by minifying the template's html and inlined
+        javascript. Unless hit_type is False, the title, reward, duration
+        and qualifications are registered once as a HIT type, which is
+        reused by every HIT launched with the same configuration. MTurk
+        refuses to create a second HIT with the same unique_request_token
+        within 24 hours. The requester_annotation is only visible to the
+        requester and is returned with the HIT.
+
+        Returns:
+            A hit_id.
+        """
+        hit_properties = self.get_hit_properties(
+                template_location, input_data, reward=reward,
+                frame_height=frame_height, title=title,
+                description=description, keywords=keywords,
+                duration=duration, max_assignments=max_assignments,
+                country=country, hits_approved=hits_approved,
+                lifetime=lifetime, percent_approved=percent_approved,
+                minify=minify, unique_request_token=unique_request_token,
+                requester_annotation=requester_annotation)
+        if hit_type:
+            hit_type_properties, hit_properties = self.split_hit_properties(
+                    hit_properties)
+            hit_properties['HITTypeId'] = self.get_hit_type(
+                    hit_type_properties)
+            hit = self.mtc.create_hit_with_hit_type(**hit_properties)
+        else:
+            hit = self.mtc.create_hit(**hit_properties)
+        if self.store is not None:
+            self.store.add_hit(hit['HIT']['HITId'], template_location,
+                               input_data, max_assignments)
         return hit
 
     def _parse_response_from_assignment(self, assignment):
@@ -127,21 +452,53 @@ class EasyTurk(object):
         Returns:
             A Python object or list of the worker's response.
         """
-        try:
-            output_tree = xml.etree.ElementTree.fromstring(assignment['Answer'])
-            output = json.loads(output_tree[0][1].text)
-            return output
-        except ValueError as e:
-            print(e)
-            return None
-
-    def get_results(self, hit_id, reject_on_fail=False):
+        output, _ = self.parser.parse(assignment)
+        return output
+
+    def parse_assignments(self, assignments):
+        """Parses out the workers' responses from many assignments.
+
+        Outputs are memoized by assignment id, and large batches are spread
+        across parse_processes processes.
+
+        Args:
+            assignments: A list of assignment dictionaries from boto.
+
+        Returns:
+            A tuple of a dictionary from assignment_id to the worker's
+            response and a list of parse errors, as described in
+            parse.AnswerParser.parse_batch.
+        """
+        with self.metrics.time_stage('parse'):
+            return self.parser.parse_batch(assignments)
+
+    def _result_from_assignment(self, assignment, output):
+        """Builds the result dictionary returned for an assignment.
+
+        Args:
+            assignment: A dictionary describing the assignment from boto.
+            output: The parsed response of the worker.
+
+        Returns:
+            A dictionary with the fields documented in get_results.
+        """
+        return {'assignment_id': assignment['AssignmentId'],
+                'hit_id': assignment['HITId'],
+                'worker_id': assignment['WorkerId'],
+                'output': output,
+                'accept_time': assignment['AcceptTime'],
+                'submit_time': assignment['SubmitTime'],
+                'status': assignment['AssignmentStatus']}
+
+    def get_results(self, hit_id, reject_on_fail=False, return_errors=False):
         """Retrives the output of a hit if it has finished.
 
         Args:
             hit_id: The hit id of the HIT.
             reject_on_fail: If the hit returns unparsable answers,
                 then reject it.
+            return_errors: Whether to also return the parse errors instead
+                of printing them.
 
         Returns:
             A list of dictionaries with the following fields:
@@ -149,30 +506,37 @@ class EasyTurk(object):
                 - hit_id
                 - worker_id
                 - output
+                - accept_time
                 - submit_time
-            The number of dictionaries is equal to the number of assignments.
+                - status
+            The number of dictionaries is equal to the number of assignments
+            that could be parsed. If return_errors is set, a tuple of this
+            list and the list of parse errors, as described in
+            parse.AnswerParser.parse_batch.
         """
         status = ['Approved', 'Submitted', 'Rejected']
         try:
-            assignments = self.mtc.list_assignments_for_hit(
-                    HITId=hit_id, AssignmentStatuses=status)
+            assignments = call_with_retry(
+                    lambda: list(self.iter_assignments(hit_id,
+                                                       statuses=status)),
+                    on_retry=self.metrics.record_retry)
         except Exception:
-            return []
+            assignments = []
+        outputs, errors = self.parse_assignments(assignments)
         results = []
-        for a in assignments['Assignments']:
-            output = self._parse_response_from_assignment(a)
+        for a in assignments:
+            output = outputs.get(a['AssignmentId'])
             if output is not None:
-                results.append({
-                    'assignment_id': a['AssignmentId'],
-                    'hit_id': hit_id,
-                    'worker_id': a['WorkerId'],
-                    'output': output,
-                    'submit_time': a['SubmitTime'],
-                })
+                results.append(self._result_from_assignment(a, output))
             elif reject_on_fail:
                 self.mtc.reject_assignment(
                     AssignmentId=a['AssignmentId'],
                     RequesterFeedback='Invalid results')
+        if return_errors:
+            return results, errors
+        for error in errors:
+            print('Failed to parse assignment %s of hit %s: %s' % (
+                error['assignment_id'], error['hit_id'], error['message']))
         return results
 
     def delete_hit(self, hit_id):
@@ -195,7 +559,7 @@ class EasyTurk(object):
                 self.mtc.delete_hit(HITId=hit_id)
                 return True
             except Exception as e:
-                print e
+                print(e)
                 return False
 
     def approve_hit(self, hit_id, reject_on_fail=False,
@@ -213,13 +577,15 @@ class EasyTurk(object):
         """
         status = ['Approved', 'Submitted', 'Rejected']
         try:
-            assignments = self.mtc.list_assignments_for_hit(
-                    HITId=hit_id, AssignmentStatuses=status)
+            assignments = call_with_retry(
+                    lambda: list(self.iter_assignments(hit_id,
+                                                       statuses=status)),
+                    on_retry=self.metrics.record_retry)
         except:
             return [], []
         approve_ids = []
         reject_ids = []
-        for a in assignments['Assignments']:
+        for a in assignments:
             if a['AssignmentStatus'] == 'Submitted':
                 output = self._parse_response_from_assignment(a)
                 if output is not None:
@@ -254,6 +620,85 @@ class EasyTurk(object):
             return True
         return False
 
+    def _review_assignments(self, assignment_ids, review, num_workers,
+                            rate):
+        """Calls a review api concurrently for many assignments.
+
+        Args:
+            assignment_ids: A list of assignment ids.
+            review: A function that reviews the assignment with the given
+                id with a single api call.
+            num_workers: Maximum number of concurrent calls.
+            rate: Maximum number of calls per second.
+
+        Returns:
+            A list of the assignment ids whose call succeeded.
+        """
+        bucket = TokenBucket(rate=rate)
+
+        def call(assignment_id):
+            try:
+                call_with_retry(lambda: review(assignment_id),
+                                rate_limiter=bucket,
+                                on_retry=self.metrics.record_retry)
+                return assignment_id
+            except Exception as e:
+                print(e)
+                return None
+
+        if len(assignment_ids) == 0:
+            return []
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            reviewed = executor.map(call, assignment_ids)
+            return [a for a in reviewed if a is not None]
+
+    def approve_assignments(self, assignment_ids, override_rejection=False,
+                            num_workers=8, rate=5.0):
+        """Approves many submitted assignments concurrently.
+
+        Unlike approve_assignment, this does not fetch or parse the
+        assignments again, so the caller should only pass ids of
+        assignments it already knows are Submitted and parsable.
+
+        Args:
+            assignment_ids: A list of assignment ids.
+            override_rejection: overrides a previous rejection if it exists.
+            num_workers: Maximum number of concurrent approve calls.
+            rate: Maximum number of approve calls per second.
+
+        Returns:
+            A list of the assignment ids that were approved.
+        """
+        return self._review_assignments(
+                assignment_ids,
+                lambda assignment_id: self.mtc.approve_assignment(
+                    AssignmentId=assignment_id,
+                    RequesterFeedback='Good job',
+                    OverrideRejection=override_rejection),
+                num_workers, rate)
+
+    def reject_assignments(self, assignment_ids, num_workers=8, rate=5.0):
+        """Rejects many submitted assignments concurrently.
+
+        Unlike reject_assignment, this does not fetch the assignments
+        again, so the caller should only pass ids of assignments it
+        already knows are Submitted.
+
+        Args:
+            assignment_ids: A list of assignment ids.
+            num_workers: Maximum number of concurrent reject calls.
+            rate: Maximum number of reject calls per second.
+
+        Returns:
+            A list of the assignment ids that were rejected.
+        """
+        return self._review_assignments(
+                assignment_ids,
+                lambda assignment_id: self.mtc.reject_assignment(
+                    AssignmentId=assignment_id,
+                    RequesterFeedback='Invalid results'),
+                num_workers, rate)
+
     def approve_assignment(self, assignment_id, reject_on_fail=False,
                            override_rejection=False):
         """Approves an assignment so that the worker can get paid.
@@ -296,19 +741,289 @@ class EasyTurk(object):
         output = {}
         for hit_id in hit_ids:
             hit = self.mtc.get_hit(HITId=hit_id)
-            assignments = self.mtc.list_assignments_for_hit(
-                    HITId=hit_id, AssignmentStatuses=['Submitted'])
-            completed = len(assignments['Assignments'])
+            assignments = self.iter_assignments(
+                    hit_id, statuses=['Submitted'])
+            completed = sum(1 for _ in assignments)
             max_assignments = hit['HIT']['MaxAssignments']
             output[hit_id] = {'completed': completed,
                               'max_assignments': max_assignments}
         return output
 
-    def list_hits(self):
+    def sync(self, approve=False, reject_on_fail=False, num_workers=8,
+             rate=5.0):
+        """Incrementally updates the store with new work from MTurk.
+
+        Only HITs that are still open in the store are polled, and only
+        assignments that have not been seen before are parsed. A HIT is
+        closed once all of its assignments have been approved or rejected,
+        or once it can not receive any more work, because it is Reviewable,
+        Disposed or expired, and all the work it received has been
+        reviewed. Repeated syncs cost time proportional to new activity.
+
+        Submitted assignments that can not be parsed are never approved, so
+        their HITs stay open until they are rejected, with reject_on_fail,
+        or reviewed elsewhere.
+
+        Args:
+            approve: Whether to approve the submitted assignments.
+            reject_on_fail: Whether to reject the submitted assignments
+                that can not be parsed.
+            num_workers: Maximum number of concurrent api calls.
+            rate: Maximum number of api calls per second.
+
+        Returns:
+            A dictionary with the number of HITs polled and closed, the
+            number of assignments that were new, updated, approved and
+            rejected, and the number of submitted assignments of the polled
+            HITs that can not be parsed and were not rejected.
+        """
+        if self.store is None:
+            raise ValueError('EasyTurk was created without a store.')
+        bucket = TokenBucket(rate=rate)
+        status = ['Approved', 'Submitted', 'Rejected']
+
+        def fetch(hit):
+            hit_id, max_assignments = hit
+            try:
+                # The HIT is fetched before its assignments, so that none
+                # are missed if it stops accepting work in between.
+                response = call_with_retry(
+                        lambda: self.mtc.get_hit(HITId=hit_id),
+                        rate_limiter=bucket,
+                        on_retry=self.metrics.record_retry)
+                assignments = call_with_retry(
+                        lambda: list(self.iter_assignments(
+                            hit_id, statuses=status)),
+                        rate_limiter=bucket,
+                        on_retry=self.metrics.record_retry)
+            except Exception as e:
+                print(e)
+                return hit_id, None, None
+            hit = response['HIT']
+            if max_assignments is None:
+                max_assignments = hit['MaxAssignments']
+            return hit_id, (max_assignments, _is_finished(hit)), assignments
+
+        report = {'polled': 0, 'closed': 0, 'new': 0, 'updated': 0,
+                  'approved': 0, 'rejected': 0, 'unparsable': 0}
+        polled = {}
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            for hit_id, progress, assignments in executor.map(
+                    fetch, self.store.open_hits()):
+                if assignments is None:
+                    continue
+                polled[hit_id] = progress
+                known = self.store.assignment_statuses(hit_id)
+                unseen = [a for a in assignments
+                          if a['AssignmentId'] not in known]
+                outputs, _ = self.parse_assignments(unseen)
+                new = [self._result_from_assignment(
+                           a, outputs.get(a['AssignmentId']))
+                       for a in unseen]
+                for a in assignments:
+                    assignment_id = a['AssignmentId']
+                    if (assignment_id in known and
+                            known[assignment_id] != a['AssignmentStatus']):
+                        self.store.set_statuses([assignment_id],
+                                                a['AssignmentStatus'])
+                        report['updated'] += 1
+                self.store.add_assignments(new)
+                report['new'] += len(new)
+        report['polled'] = len(polled)
+
+        if approve:
+            submitted = self.store.submitted_assignment_ids(list(polled))
+            approved = self.approve_assignments(
+                    submitted, num_workers=num_workers, rate=rate)
+            self.store.set_statuses(approved, 'Approved')
+            report['approved'] = len(approved)
+        unparsable = self.store.submitted_assignment_ids(list(polled),
+                                                         parsed=False)
+        if reject_on_fail:
+            rejected = self.reject_assignments(
+                    unparsable, num_workers=num_workers, rate=rate)
+            self.store.set_statuses(rejected, 'Rejected')
+            report['rejected'] = len(rejected)
+            unparsable = set(unparsable) - set(rejected)
+        report['unparsable'] = len(unparsable)
+
+        for hit_id, (max_assignments, finished) in polled.items():
+            statuses = self.store.assignment_statuses(hit_id).values()
+            reviewed = sum(1 for s in statuses if s in FINAL_STATUSES)
+            if (reviewed >= max_assignments or
+                    (finished and reviewed == len(statuses))):
+                self.store.close_hit(hit_id)
+                report['closed'] += 1
+        return report
+
+    def _summarize_hit(self, hit):
+        """Computes the progress of a HIT from its summary.
+
+        Args:
+            hit: A HIT dictionary from list_hits or get_hit.
+
+        Returns:
+            A dictionary of assignment counts for the HIT.
+        """
+        max_assignments = hit['MaxAssignments']
+        pending = hit.get('NumberOfAssignmentsPending', 0)
+        available = hit.get('NumberOfAssignmentsAvailable', 0)
+        return {'max_assignments': max_assignments,
+                'completed': max_assignments - pending - available,
+                'reviewed': hit.get('NumberOfAssignmentsCompleted', 0),
+                'pending': pending,
+                'available': available,
+                'status': hit.get('HITStatus'),
+                'creation_time': hit.get('CreationTime')}
+
+    def show_bulk_progress(self, hit_ids, page_size=100, num_workers=8,
+                           rate=5.0):
+        """Show the progress of many hits using the list_hits summaries.
+
+        The assignment counts are read from the paginated list_hits
+        summaries, so a batch costs one call per page of HITs in the
+        account. Only the hit ids that are missing from the summaries are
+        fetched individually, concurrently.
+
+        Args:
+            hit_ids: A list of HIT ids.
+            page_size: Number of HITs requested per page (at most 100).
+            num_workers: Maximum number of concurrent get_hit calls.
+            rate: Maximum number of get_hit calls per second.
+
+        Returns:
+            A dictionary containing:
+                - hits: Mapping from hit_id to a dictionary of completed,
+                    pending, available, reviewed and maximum assignments.
+                - errors: Mapping from hit_id to an error message for the
+                    hits whose progress could not be fetched.
+                - summary: Aggregate assignment counts, the completion
+                    rate in assignments per second and the estimated
+                    number of seconds until all assignments are done.
+        """
+        wanted = set(hit_ids)
+        hits = {}
+        for hit in self.iter_hits(page_size=page_size,
+                                  where=lambda h: h['HITId'] in wanted):
+            hits[hit['HITId']] = self._summarize_hit(hit)
+            if len(hits) == len(wanted):
+                break
+
+        missing = [hit_id for hit_id in wanted if hit_id not in hits]
+        errors = {}
+        bucket = TokenBucket(rate=rate)
+
+        def fetch(hit_id):
+            try:
+                hit = call_with_retry(
+                        lambda: self.mtc.get_hit(HITId=hit_id)['HIT'],
+                        rate_limiter=bucket,
+                        on_retry=self.metrics.record_retry)
+                return hit_id, self._summarize_hit(hit), None
+            except Exception as e:
+                return hit_id, None, str(e)
+
+        if len(missing) > 0:
+            with ThreadPoolExecutor(max_workers=num_workers) as executor:
+                for hit_id, progress, error in executor.map(fetch, missing):
+                    if progress is not None:
+                        hits[hit_id] = progress
+                    else:
+                        errors[hit_id] = error
+
+        summary = {'hits': len(hits),
+                   'max_assignments': 0,
+                   'completed': 0,
+                   'reviewed': 0,
+                   'pending': 0,
+                   'available': 0}
+        for progress in hits.values():
+            for key in ['max_assignments', 'completed', 'reviewed',
+                        'pending', 'available']:
+                summary[key] += progress[key]
+        creation_times = [p['creation_time'] for p in hits.values()
+                          if p['creation_time'] is not None]
+        summary['rate'] = None
+        summary['eta'] = None
+        if len(creation_times) > 0:
+            started = min(creation_times)
+            elapsed = (datetime.now(started.tzinfo) - started).total_seconds()
+            if elapsed > 0 and summary['completed'] > 0:
+                summary['rate'] = summary['completed'] / elapsed
+                remaining = summary['max_assignments'] - summary['completed']
+                summary['eta'] = remaining / summary['rate']
+        return {'hits': hits, 'errors': errors, 'summary': summary}
+
+    def _paginate(self, method, key, page_size=100, where=None, **kwargs):
+        """Lazily iterates over every page of an MTurk list api.
+
+        Args:
+            method: A list method of the MTurk client.
+            key: The key in the response containing the items.
+            page_size: Number of items requested per page (at most 100).
+            where: An optional function that returns True for the items
+                that should be yielded.
+            kwargs: Additional arguments passed to the list method.
+
+        Yields:
+            The items of every page, following NextToken until exhausted.
+        """
+        kwargs['MaxResults'] = page_size
+        while True:
+            response = method(**kwargs)
+            for item in response[key]:
+                if where is None or where(item):
+                    yield item
+            next_token = response.get('NextToken')
+            if not next_token or len(response[key]) == 0:
+                return
+            kwargs['NextToken'] = next_token
+
+    def iter_hits(self, page_size=100, where=None):
+        """Lazily iterates over all the HITs in the account.
+
+        Args:
+            page_size: Number of HITs requested per page (at most 100).
+            where: An optional function that returns True for the HITs
+                that should be yielded.
+
+        Yields:
+            HIT dictionaries.
+        """
+        return self._paginate(self.mtc.list_hits, 'HITs',
+                              page_size=page_size, where=where)
+
+    def iter_assignments(self, hit_id, statuses=None, page_size=100,
+                         where=None):
+        """Lazily iterates over the assignments of a HIT.
+
+        Args:
+            hit_id: The hit id of the HIT.
+            statuses: An optional list of assignment statuses to include.
+            page_size: Number of assignments requested per page
+                (at most 100).
+            where: An optional function that returns True for the
+                assignments that should be yielded.
+
+        Yields:
+            Assignment dictionaries.
+        """
+        kwargs = {'HITId': hit_id}
+        if statuses is not None:
+            kwargs['AssignmentStatuses'] = statuses
+        return self._paginate(self.mtc.list_assignments_for_hit,
+                              'Assignments', page_size=page_size,
+                              where=where, **kwargs)
+
+    def list_hits(self, page_size=100, where=None):
         """Lists the HITs that have already been launched.
 
+        Args:
+            page_size: Number of HITs requested per page (at most 100).
+            where: An optional function that returns True for the HITs
+                that should be included.
+
         Returns:
             A list of HITs.
         """
-        hits = self.mtc.list_hits()['HITs']
-        return hits
+        return list(self.iter_hits(page_size=page_size, where=where))
@@ -2,17 +2,27 @@
 """
 
 from flask import Flask
+from flask import jsonify
 from flask import render_template
 from flask import request
 
 import json
 import os
+import threading
 
-from easyturk import EasyTurk
+from .easyturk import EasyTurk
+from .export import iter_rows
+from .export import unflatten
+from .store import ResultsIndex
+from .store import ReviewStore
 
 
 # Global server variables.
 app = Flask(__name__)
+review_stores = {}
+review_stores_lock = threading.Lock()
+results_indexes = {}
+results_indexes_lock = threading.Lock()
 
 
 def get_e_filename(filename):
@@ -31,6 +41,109 @@ def get_e_filename(filename):
     return dirname + '_e_' + filename
 
 
+def get_db_filename(eresults_file):
+    """Gets the database of the review decisions and index of the results.
+
+    Args:
+        eresults_file: A converted results file (ex, directory/_e_file.json)
+
+    Returns:
+        A string directory/_e_file.db
+    """
+    return os.path.splitext(eresults_file)[0] + '.db'
+
+
+def get_source(results_file):
+    """Gets a signature of a results file that changes when it is modified.
+
+    Args:
+        results_file: A results file (ex, directory/file.json).
+
+    Returns:
+        A string with the modification time and size of the file.
+    """
+    stat = os.stat(results_file)
+    return '%r:%d' % (stat.st_mtime, stat.st_size)
+
+
+def get_review_store(eresults_file):
+    """Gets the store of review decisions for a results file.
+
+    Args:
+        eresults_file: A converted results file (ex, directory/_e_file.json)
+
+    Returns:
+        A ReviewStore located at directory/_e_file.db.
+    """
+    path = get_db_filename(eresults_file)
+    with review_stores_lock:
+        if path not in review_stores:
+            review_stores[path] = ReviewStore(path)
+        return review_stores[path]
+
+
+def build_results_index(index, results_file, eresults_file):
+    """Builds the index of a results file and applies the review decisions.
+
+    Args:
+        index: The ResultsIndex to build.
+        results_file: A results file (ex, directory/file.json), or an
+            export written by interface.export_completed_hits.
+        eresults_file: The converted results file (ex,
+            directory/_e_file.json).
+    """
+    review_store = get_review_store(eresults_file)
+    if os.path.splitext(results_file)[1] != '.json':
+        # Exports are streamed into the index without converting.
+        index.build_from_results(
+                unflatten(row) for row in iter_rows(results_file))
+    else:
+        if (os.path.exists(eresults_file) and
+                os.path.getmtime(eresults_file) >=
+                os.path.getmtime(results_file)):
+            # Results converted by earlier versions of this script.
+            results = json.load(open(eresults_file))
+        else:
+            results = convert(json.load(open(results_file)))
+        index.build(results)
+        # Decisions kept in converted results by earlier versions, unless
+        # they have been reviewed again since.
+        decisions = review_store.decisions()
+        for approve in [True, False]:
+            review_store.record([hit['assignment_id']
+                                 for hit in results['hits']
+                                 if hit.get('approve') is approve and
+                                 hit['assignment_id'] not in decisions],
+                                approve)
+    decisions = review_store.decisions()
+    for approve in [True, False]:
+        index.record_decisions(
+                [a for a, d in decisions.items() if d is approve], approve)
+
+
+def get_results_index(results_file):
+    """Gets the index of a results file, building it when the file changes.
+
+    Args:
+        results_file: A results file (ex, directory/file.json), or an
+            export written by interface.export_completed_hits.
+
+    Returns:
+        A ResultsIndex located at directory/_e_file.db.
+    """
+    eresults_file = get_e_filename(results_file)
+    path = get_db_filename(eresults_file)
+    source = get_source(results_file)
+    with results_indexes_lock:
+        if path not in results_indexes:
+            results_indexes[path] = ResultsIndex(path)
+        index = results_indexes[path]
+        if index.source() != source:
+            build_results_index(index, results_file, eresults_file)
+            index.set_source(source)
+        return index
+
+
 def convert(results):
     """Converts the results to include metadata for navigation.
 
@@ -56,8 +169,8 @@ def convert(results):
     worker_indices = {}
     worker_ids = []
     for worker_id, assignments in worker_map.items():
-        worker_indices[worker_id] = range(
-                len(hits), len(hits) + len(assignments))
+        worker_indices[worker_id] = list(range(
+                len(hits), len(hits) + len(assignments)))
         hits.extend(assignments)
         worker_ids.append(worker_id)
     output = {'hits': hits,
@@ -69,22 +182,73 @@ def convert(results):
 @app.route('/task')
 def task():
     """Visualizes the results received for a given task.
+
+    The page loads the workers and their assignments from the json api as
+    the reviewer navigates.
     """
     # Compile the template.
     task = request.args['task']
     results_file = request.args['results']
-    eresults_file = get_e_filename(results_file)
-    if os.path.exists(eresults_file):
-        results = json.load(open(eresults_file))
-    else:
-        results = json.load(open(results_file))
-        results = convert(results)
-        json.dump(results, open(eresults_file, 'w'))
+    get_results_index(results_file)
     return render_template(
             'evaluation/' + task,
-            results=results,
             task=results_file,
-            eresults_file=eresults_file)
+            eresults_file=get_e_filename(results_file))
+
+
+@app.route('/api/workers')
+def api_workers():
+    """Lists the workers of a results file with their assignment counts.
+    """
+    index = get_results_index(request.args['results'])
+    offset = int(request.args.get('offset', 0))
+    limit = request.args.get('limit')
+    limit = int(limit) if limit is not None else None
+    return jsonify({'workers': index.workers(offset=offset, limit=limit),
+                    'num_assignments': index.num_assignments(),
+                    'offset': offset})
+
+
+@app.route('/api/workers/<worker_id>/assignments')
+def api_worker_assignments(worker_id):
+    """Returns a page of a worker's assignments with review decisions.
+    """
+    results_file = request.args['results']
+    index = get_results_index(results_file)
+    offset = int(request.args.get('offset', 0))
+    limit = int(request.args.get('limit', 50))
+    assignments = index.assignments(worker_id, offset=offset, limit=limit)
+    review_store = get_review_store(get_e_filename(results_file))
+    decisions = review_store.decisions(
+            [a['assignment_id'] for a in assignments])
+    for assignment in assignments:
+        if assignment['assignment_id'] in decisions:
+            assignment['approve'] = decisions[assignment['assignment_id']]
+    return jsonify({'worker_id': worker_id,
+                    'offset': offset,
+                    'total': index.num_assignments(worker_id),
+                    'assignments': assignments})
+
+
+@app.route('/workers')
+def workers():
+    """Lists the workers of a results file, most suspicious first.
+
+    Shows each worker's assignment count, approval and rejection rates,
+    median work time and disagreement with other workers, so that reviewers
+    can start with the workers most likely to be spamming.
+    """
+    results_file = request.args['results']
+    index = get_results_index(results_file)
+    offset = int(request.args.get('offset', 0))
+    limit = int(request.args.get('limit', 100))
+    return render_template(
+            'evaluation/workers.html',
+            results=results_file,
+            task=request.args.get('task'),
+            workers=index.worker_stats(offset=offset, limit=limit),
+            offset=offset,
+            limit=limit)
 
 
 @app.route('/interface', methods=['POST'])
@@ -102,11 +266,13 @@ def interface():
         else:
             et.reject_assignment(assignment_id)
     eresults_file = request.form['eresults_file']
-    results = json.load(open(eresults_file))
-    for hit in results['hits']:
-        if hit['assignment_id'] in assignment_ids:
-            hit['approve'] = approve
-    json.dump(results, open(eresults_file, 'w'))
+    get_review_store(eresults_file).record(assignment_ids, approve)
+    path = get_db_filename(eresults_file)
+    with results_indexes_lock:
+        if path not in results_indexes:
+            results_indexes[path] = ResultsIndex(path)
+        index = results_indexes[path]
+    index.record_decisions(assignment_ids, approve)
     return 'Succcess'
 
 
@@ -0,0 +1,238 @@
+"""Streaming export of fetched results to JSONL, Parquet or Arrow files.
+
+Results are written a batch at a time as they are fetched, one flat row
+per assignment, so that exporting a large project never holds all of its
+results in memory. The format is chosen by the extension of the path:
+
+    .jsonl    One json object per line. Needs no extra dependency.
+    .parquet  A Parquet file, compressed and readable by most tools.
+    .arrow    An Arrow IPC file, which is memory mapped when read.
+
+Parquet and Arrow need pyarrow. The output of each assignment is stored as
+a json string, since its shape depends on the task.
+"""
+
+from datetime import datetime
+from .payload import compact_json
+
+import json
+import os
+
+
+# The flattened columns of every exported assignment, in order.
+COLUMNS = ('assignment_id', 'hit_id', 'worker_id', 'status', 'accept_time',
+           'submit_time', 'output')
+
+# Columns that hold times.
+TIME_COLUMNS = ('accept_time', 'submit_time')
+
+FORMATS = ('jsonl', 'parquet', 'arrow')
+
+
+def get_format(path):
+    """Gets the export format of a path from its extension.
+
+    Args:
+        path: The location of an export.
+
+    Returns:
+        One of FORMATS.
+    """
+    extension = os.path.splitext(path)[1].lstrip('.').lower()
+    if extension == 'feather':
+        return 'arrow'
+    if extension not in FORMATS:
+        raise ValueError('Unknown export format %r, expected one of %s.' %
+                         (extension, ', '.join(FORMATS)))
+    return extension
+
+
+def flatten(result):
+    """Converts a result into a flat row.
+
+    Args:
+        result: A dictionary as returned by EasyTurk.get_results.
+
+    Returns:
+        A dictionary with the keys of COLUMNS, where times are ISO 8601
+        strings and output is a json string.
+    """
+    row = dict((column, result.get(column)) for column in COLUMNS)
+    for column in TIME_COLUMNS:
+        if isinstance(row[column], datetime):
+            row[column] = row[column].isoformat()
+        elif row[column] is not None:
+            row[column] = str(row[column])
+    row['output'] = compact_json(result.get('output'))
+    return row
+
+
+def unflatten(row):
+    """Converts a flat row back into a result dictionary.
+
+    Args:
+        row: A dictionary with the keys of COLUMNS.
+
+    Returns:
+        A result dictionary with the output decoded.
+    """
+    result = dict(row)
+    if result.get('output') is not None:
+        result['output'] = json.loads(result['output'])
+    return result
+
+
+class JSONLWriter(object):
+    """Appends flattened results to a JSONL file.
+    """
+
+    def __init__(self, path):
+        """Constructor for JSONLWriter.
+
+        Args:
+            path: Location of the JSONL file, which is overwritten.
+        """
+        self.path = path
+        self.f = open(path, 'w')
+        self.num_rows = 0
+
+    def write(self, results):
+        """Writes a batch of results.
+
+        Args:
+            results: A list of result dictionaries.
+        """
+        for result in results:
+            self.f.write(json.dumps(flatten(result)) + '\n')
+        self.num_rows += len(results)
+
+    def close(self):
+        self.f.close()
+
+
+class ArrowWriter(object):
+    """Writes flattened results to a Parquet or Arrow file in batches.
+
+    Every call to write becomes one record batch, or one row group of the
+    Parquet file, so a reader can load the file a batch at a time.
+    """
+
+    def __init__(self, path, format=None):
+        """Constructor for ArrowWriter.
+
+        Args:
+            path: Location of the file, which is overwritten.
+            format: 'parquet' or 'arrow'. Defaults to the path's extension.
+        """
+        import pyarrow as pa
+        self.pa = pa
+        self.path = path
+        self.format = format or get_format(path)
+        self.schema = pa.schema([(column, pa.string())
+                                 for column in COLUMNS])
+        if self.format == 'parquet':
+            import pyarrow.parquet as pq
+            self.writer = pq.ParquetWriter(path, self.schema)
+        elif self.format == 'arrow':
+            self.sink = pa.OSFile(path, 'wb')
+            self.writer = pa.ipc.new_file(self.sink, self.schema)
+        else:
+            raise ValueError('ArrowWriter cannot write %r files.' %
+                             self.format)
+        self.num_rows = 0
+
+    def write(self, results):
+        """Writes a batch of results.
+
+        Args:
+            results: A list of result dictionaries.
+        """
+        if len(results) == 0:
+            return
+        rows = [flatten(result) for result in results]
+        arrays = [self.pa.array([row[column] for row in rows],
+                                type=self.pa.string())
+                  for column in COLUMNS]
+        batch = self.pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+        if self.format == 'parquet':
+            self.writer.write_table(self.pa.Table.from_batches([batch]))
+        else:
+            self.writer.write_batch(batch)
+        self.num_rows += len(rows)
+
+    def close(self):
+        self.writer.close()
+        if self.format == 'arrow':
+            self.sink.close()
+
+
+def open_writer(path):
+    """Opens a writer for the format of a path.
+
+    Args:
+        path: Location of a .jsonl, .parquet or .arrow file.
+
+    Returns:
+        A JSONLWriter or an ArrowWriter.
+    """
+    if get_format(path) == 'jsonl':
+        return JSONLWriter(path)
+    return ArrowWriter(path)
+
+
+def read_table(path):
+    """Reads a Parquet or Arrow export as a pyarrow Table.
+
+    Arrow files are memory mapped, so no data is copied until it is used,
+    and Parquet files are read through a memory map.
+
+    Args:
+        path: Location of a .parquet or .arrow file.
+
+    Returns:
+        A pyarrow Table with the columns of COLUMNS.
+    """
+    import pyarrow as pa
+    format = get_format(path)
+    if format == 'arrow':
+        return pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+    if format == 'parquet':
+        import pyarrow.parquet as pq
+        return pq.read_table(path, memory_map=True)
+    raise ValueError('read_table cannot read %r files.' % format)
+
+
+def iter_rows(path, batch_size=10000):
+    """Iterates over the flat rows of an export without loading it whole.
+
+    Args:
+        path: Location of a .jsonl, .parquet or .arrow file.
+        batch_size: Number of rows converted to Python objects at a time.
+
+    Yields:
+        Dictionaries with the keys of COLUMNS.
+    """
+    if get_format(path) == 'jsonl':
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        return
+    for batch in read_table(path).to_batches(max_chunksize=batch_size):
+        for row in batch.to_pylist():
+            yield row
+
+
+def read_results(path):
+    """Reads an export in the format returned by fetch_completed_hits.
+
+    Args:
+        path: Location of a .jsonl, .parquet or .arrow file.
+
+    Returns:
+        A dictionary from hit_id to the list of its results.
+    """
+    results = {}
+    for row in iter_rows(path):
+        results.setdefault(row['hit_id'], []).append(unflatten(row))
+    return results
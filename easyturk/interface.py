@@ -1,141 +1,338 @@
 """Functions to launch, retrieve, and parse specific EasyTurk tasks.
 """
 
-from easyturk import EasyTurk
+from .bulk import TokenBucket
+from .bulk import launch_hits
+from concurrent.futures import ThreadPoolExecutor
+from .easyturk import EasyTurk
+from .easyturk import MAX_POOL_CONNECTIONS
+from .export import open_writer
+from itertools import islice
+from .payload import MAX_QUESTION_BYTES
 
 
-def launch_verify_question_answer(data, reward=1.00, tasks_per_hit=50, sandbox=False):
+def _launch(template, data, tasks_per_hit, sandbox, num_workers, rate,
+            return_report, store, max_bytes, minify, journal, et,
+            **hit_kwargs):
+    """Launches HITs for a template concurrently.
+
+    Args:
+        template: The template to launch.
+        data: An iterable of tasks, or the path to a JSONL or json file.
+        tasks_per_hit: Number of tasks per hit.
+        sandbox: Whether to interact on sandbox or production.
+        num_workers: Maximum number of concurrent create_hit calls.
+        rate: Maximum number of create_hit calls per second.
+        return_report: Whether to also return the per-chunk report.
+        store: Optional HITStore, or path to one, to record the HITs in.
+        max_bytes: Size budget of each question in bytes, or None.
+        minify: Whether to minify the html and inlined javascript.
+        journal: Optional path of a journal to record and resume the launch.
+        et: Optional EasyTurk to launch with, instead of a new one.
+        hit_kwargs: Additional arguments passed to EasyTurk.launch_hit.
+
+    Returns:
+        A list of hit ids in input order, with None for chunks that failed,
+        and the per-chunk report if return_report is set.
+    """
+    if et is None:
+        et = EasyTurk(sandbox=sandbox, store=store,
+                      max_pool_connections=max(MAX_POOL_CONNECTIONS,
+                                               num_workers))
+    hit_ids, report = launch_hits(
+            et, template, data, tasks_per_hit, num_workers=num_workers,
+            rate=rate, max_bytes=max_bytes, journal=journal, minify=minify,
+            **hit_kwargs)
+    for r in report:
+        if not r['success']:
+            print('Failed to launch chunk %d: %s' % (r['chunk'], r['error']))
+    if return_report:
+        return hit_ids, report
+    return hit_ids
+
+
+def launch_verify_question_answer(data, reward=1.00, tasks_per_hit=50, sandbox=False,
+                                  num_workers=8, rate=5.0, return_report=False,
+                                  store=None, max_bytes=MAX_QUESTION_BYTES,
+                                  minify=False, journal=None, et=None):
     """Launches HITs to ask workers to verify bounding boxes.
 
     Args:
-        data: List containing image urls, questions and answers, for the task.
+        data: Iterable containing image urls, questions and answers, for the task,
+            or the path to a JSONL or json file containing them.
         reward: A postive valued dollar amount per task.
-        tasks_per_hit: Number of images per hit.
+        tasks_per_hit: Maximum number of images per hit. Fewer are used
+            when needed to keep each question under max_bytes.
         sandbox: Whether to interact on sandbox or production.
+        num_workers: Maximum number of concurrent create_hit calls.
+        rate: Maximum number of create_hit calls per second.
+        return_report: Whether to also return the per-chunk report.
+        store: Optional HITStore, or path to one, to record the HITs in.
+        max_bytes: Size budget of each question in bytes, or None to
+            disable size planning.
+        minify: Whether to minify the template's html and inlined
+            javascript, so that more tasks fit in max_bytes. The template
+            is sent as written by default.
+        journal: Optional path of a journal file. Running the same launch
+            again with it resumes an interrupted launch without creating
+            duplicate HITs.
+        et: Optional EasyTurk to launch with, such as one with
+            notifications enabled. sandbox and store are then ignored.
 
     Returns:
-        A list of hit ids that have been launched.
+        A list of hit ids that have been launched, in input order.
     """
-    et = EasyTurk(sandbox=sandbox)
-    template = 'verify_question_answer.html'
-    hit_ids = []
-    i = 0
-    while i < len(data):
-        hit = et.launch_hit(
-            template, data[i:i+tasks_per_hit], reward=reward,
+    return _launch(
+            'verify_question_answer.html', data, tasks_per_hit, sandbox,
+            num_workers, rate, return_report, store, max_bytes, minify,
+            journal, et,
+            reward=reward,
             title='Verify the answer to a question about an picture',
             description=('Verify whether an answer to a question about a picture is correct.'),
             keywords='image, text, picture, answer, question, relationship')
-        hit_id = hit['HIT']['HITId']
-        hit_ids.append(hit_id)
-        i += tasks_per_hit
-    return hit_ids
 
 
-def launch_verify_relationship(data, reward=1.00, tasks_per_hit=30, sandbox=False):
+def launch_verify_relationship(data, reward=1.00, tasks_per_hit=30, sandbox=False,
+                               num_workers=8, rate=5.0, return_report=False,
+                               store=None, max_bytes=MAX_QUESTION_BYTES,
+                               minify=False, journal=None, et=None):
     """Launches HITs to ask workers to verify bounding boxes.
 
     Args:
-        data: List containing image urls, relationships, for the task.
+        data: Iterable containing image urls, relationships, for the task,
+            or the path to a JSONL or json file containing them.
         reward: A postive valued dollar amount per task.
-        tasks_per_hit: Number of images per hit.
+        tasks_per_hit: Maximum number of images per hit. Fewer are used
+            when needed to keep each question under max_bytes.
         sandbox: Whether to interact on sandbox or production.
+        num_workers: Maximum number of concurrent create_hit calls.
+        rate: Maximum number of create_hit calls per second.
+        return_report: Whether to also return the per-chunk report.
+        store: Optional HITStore, or path to one, to record the HITs in.
+        max_bytes: Size budget of each question in bytes, or None to
+            disable size planning.
+        minify: Whether to minify the template's html and inlined
+            javascript, so that more tasks fit in max_bytes. The template
+            is sent as written by default.
+        journal: Optional path of a journal file. Running the same launch
+            again with it resumes an interrupted launch without creating
+            duplicate HITs.
+        et: Optional EasyTurk to launch with, such as one with
+            notifications enabled. sandbox and store are then ignored.
 
     Returns:
-        A list of hit ids that have been launched.
+        A list of hit ids that have been launched, in input order.
     """
-    et = EasyTurk(sandbox=sandbox)
-    template = 'verify_relationship.html'
-    hit_ids = []
-    i = 0
-    while i < len(data):
-        hit = et.launch_hit(
-            template, data[i:i+tasks_per_hit], reward=reward,
+    return _launch(
+            'verify_relationship.html', data, tasks_per_hit, sandbox,
+            num_workers, rate, return_report, store, max_bytes, minify,
+            journal, et,
+            reward=reward,
             title='Verify relationships between objects in pictures',
             description=('Verify whether the relationships are correctly identified in pictures.'),
             keywords='image, text, picture, object, bounding box, relationship')
-        hit_id = hit['HIT']['HITId']
-        hit_ids.append(hit_id)
-        i += tasks_per_hit
-    return hit_ids
 
 
-def launch_verify_bbox(data, reward=1.00, tasks_per_hit=30, sandbox=False):
+def launch_verify_bbox(data, reward=1.00, tasks_per_hit=30, sandbox=False,
+                       num_workers=8, rate=5.0, return_report=False,
+                       store=None, max_bytes=MAX_QUESTION_BYTES,
+                       minify=False, journal=None, et=None):
     """Launches HITs to ask workers to verify bounding boxes.
 
     Args:
-        data: List containing image urls, objects, for the task.
+        data: Iterable containing image urls, objects, for the task,
+            or the path to a JSONL or json file containing them.
         reward: A postive valued dollar amount per task.
-        tasks_per_hit: Number of images per hit.
+        tasks_per_hit: Maximum number of images per hit. Fewer are used
+            when needed to keep each question under max_bytes.
         sandbox: Whether to interact on sandbox or production.
+        num_workers: Maximum number of concurrent create_hit calls.
+        rate: Maximum number of create_hit calls per second.
+        return_report: Whether to also return the per-chunk report.
+        store: Optional HITStore, or path to one, to record the HITs in.
+        max_bytes: Size budget of each question in bytes, or None to
+            disable size planning.
+        minify: Whether to minify the template's html and inlined
+            javascript, so that more tasks fit in max_bytes. The template
+            is sent as written by default.
+        journal: Optional path of a journal file. Running the same launch
+            again with it resumes an interrupted launch without creating
+            duplicate HITs.
+        et: Optional EasyTurk to launch with, such as one with
+            notifications enabled. sandbox and store are then ignored.
 
     Returns:
-        A list of hit ids that have been launched.
+        A list of hit ids that have been launched, in input order.
     """
-    et = EasyTurk(sandbox=sandbox)
-    template = 'verify_bbox.html'
-    hit_ids = []
-    i = 0
-    while i < len(data):
-        hit = et.launch_hit(
-            template, data[i:i+tasks_per_hit], reward=reward,
+    return _launch(
+            'verify_bbox.html', data, tasks_per_hit, sandbox,
+            num_workers, rate, return_report, store, max_bytes, minify,
+            journal, et,
+            reward=reward,
             title='Verify objects in pictures',
             description=('Verify whether objects are correctly identified in pictures.'),
             keywords='image, text, picture, object, bounding box')
-        hit_id = hit['HIT']['HITId']
-        hit_ids.append(hit_id)
-        i += tasks_per_hit
-    return hit_ids
 
 
-def launch_caption(data, reward=1.00, tasks_per_hit=10, sandbox=False):
+def launch_caption(data, reward=1.00, tasks_per_hit=10, sandbox=False,
+                   num_workers=8, rate=5.0, return_report=False,
+                   store=None, max_bytes=MAX_QUESTION_BYTES,
+                   minify=False, journal=None, et=None):
     """Launches HITs to ask workers to caption images.
 
     Args:
-        data: List containing image urls for the task.
+        data: Iterable containing image urls for the task, or the path
+            to a JSONL or json file containing them.
         reward: A postive valued dollar amount per task.
-        tasks_per_hit: Number of images per hit.
+        tasks_per_hit: Maximum number of images per hit. Fewer are used
+            when needed to keep each question under max_bytes.
         sandbox: Whether to interact on sandbox or production.
+        num_workers: Maximum number of concurrent create_hit calls.
+        rate: Maximum number of create_hit calls per second.
+        return_report: Whether to also return the per-chunk report.
+        store: Optional HITStore, or path to one, to record the HITs in.
+        max_bytes: Size budget of each question in bytes, or None to
+            disable size planning.
+        minify: Whether to minify the template's html and inlined
+            javascript, so that more tasks fit in max_bytes. The template
+            is sent as written by default.
+        journal: Optional path of a journal file. Running the same launch
+            again with it resumes an interrupted launch without creating
+            duplicate HITs.
+        et: Optional EasyTurk to launch with, such as one with
+            notifications enabled. sandbox and store are then ignored.
 
     Returns:
-        A list of hit ids that have been launched.
+        A list of hit ids that have been launched, in input order.
     """
-    et = EasyTurk(sandbox=sandbox)
-    template = 'write_caption.html'
-    hit_ids = []
-    i = 0
-    while i < len(data):
-        hit = et.launch_hit(
-            template, data[i:i+tasks_per_hit], reward=reward,
+    return _launch(
+            'write_caption.html', data, tasks_per_hit, sandbox,
+            num_workers, rate, return_report, store, max_bytes, minify,
+            journal, et,
+            reward=reward,
             title='Caption some pictures',
             description=('Write captions about the contents of images.'),
             keywords='image, caption, text')
-        hit_id = hit['HIT']['HITId']
-        hit_ids.append(hit_id)
-        i += tasks_per_hit
-    return hit_ids
 
 
-def fetch_completed_hits(hit_ids, approve=True, sandbox=False):
+def iter_completed_hits(hit_ids, approve=True, sandbox=False,
+                        num_workers=8, rate=5.0, batch_size=1000, et=None):
+    """Grabs the results for the hit ids, a batch of HITs at a time.
+
+    Each HIT's assignments are listed and parsed once, concurrently. When
+    approving, only the Submitted assignments are approved, reusing the
+    status and output that were already fetched. Only one batch of results
+    is held in memory at a time.
+
+    Args:
+        hit_ids: An iterable of hit ids to fetch.
+        approve: Whether to approve the hits that have been submitted.
+        sandbox: Whether to interact on sandbox or production.
+        num_workers: Maximum number of concurrent api calls.
+        rate: Maximum number of api calls per second.
+        batch_size: Number of HITs fetched and approved per batch.
+        et: Optional EasyTurk to fetch with, so that the outputs it already
+            parsed are reused across calls. sandbox is then ignored.
+
+    Yields:
+        Tuples of a hit_id and its results, for the HITs that have been
+        submitted, in the order of hit_ids.
+    """
+    if et is None:
+        et = EasyTurk(sandbox=sandbox,
+                      max_pool_connections=max(MAX_POOL_CONNECTIONS,
+                                               num_workers))
+    hit_ids = (hit_id for hit_id in hit_ids if hit_id is not None)
+    bucket = TokenBucket(rate=rate)
+
+    def fetch(hit_id):
+        bucket.acquire()
+        return et.get_results(hit_id, reject_on_fail=False)
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        while True:
+            batch = list(islice(hit_ids, batch_size))
+            if len(batch) == 0:
+                break
+            output = [(hit_id, results) for hit_id, results
+                      in zip(batch, executor.map(fetch, batch))
+                      if len(results) > 0]
+            if approve:
+                submitted = [assignment['assignment_id']
+                             for _, results in output
+                             for assignment in results
+                             if assignment['status'] == 'Submitted']
+                approved = set(et.approve_assignments(
+                        submitted, num_workers=num_workers, rate=rate))
+                for _, results in output:
+                    for assignment in results:
+                        if assignment['assignment_id'] in approved:
+                            assignment['status'] = 'Approved'
+            for hit_id, results in output:
+                yield hit_id, results
+
+
+def fetch_completed_hits(hit_ids, approve=True, sandbox=False,
+                         num_workers=8, rate=5.0, et=None):
     """Grabs the results for the hit ids.
 
+    All the HITs are fetched before any is approved.
+
     Args:
-        hit_ids: A list of hit ids to fetch.
+        hit_ids: An iterable of hit ids to fetch.
         approve: Whether to approve the hits that have been submitted.
         sandbox: Whether to interact on sandbox or production.
+        num_workers: Maximum number of concurrent api calls.
+        rate: Maximum number of api calls per second.
+        et: Optional EasyTurk to fetch with, so that the outputs it already
+            parsed are reused across calls. sandbox is then ignored.
 
     Returns:
         A dictionary from hit_id to the result, if that hit_id has
         been submitted.
     """
-    et = EasyTurk(sandbox=sandbox)
-    output = {}
-    for hit_id in hit_ids:
-        results = et.get_results(hit_id, reject_on_fail=False)
-        if len(results) > 0:
-            output[hit_id] = results
-            if approve:
-                for assignment in results:
-                    assignment_id = assignment['assignment_id']
-                    et.approve_assignment(assignment_id)
-    return output
+    hit_ids = list(hit_ids)
+    return dict(iter_completed_hits(
+            hit_ids, approve=approve, sandbox=sandbox,
+            num_workers=num_workers, rate=rate,
+            batch_size=max(1, len(hit_ids)), et=et))
+
+
+def export_completed_hits(hit_ids, path, approve=True, sandbox=False,
+                          num_workers=8, rate=5.0, batch_size=1000,
+                          et=None):
+    """Streams the results for the hit ids to a file as they are fetched.
+
+    Unlike fetch_completed_hits, the results are never all in memory. The
+    file has one row per assignment, see export.COLUMNS, and can be read
+    back with export.read_results, or memory mapped with export.read_table.
+
+    Args:
+        hit_ids: An iterable of hit ids to fetch.
+        path: Location of a .jsonl, .parquet or .arrow file to write.
+        approve: Whether to approve the hits that have been submitted.
+        sandbox: Whether to interact on sandbox or production.
+        num_workers: Maximum number of concurrent api calls.
+        rate: Maximum number of api calls per second.
+        batch_size: Number of HITs fetched and written per batch.
+        et: Optional EasyTurk to fetch with, so that the outputs it already
+            parsed are reused across calls. sandbox is then ignored.
+
+    Returns:
+        The number of assignments written.
+    """
+    writer = open_writer(path)
+    try:
+        batch = []
+        for i, (_, results) in enumerate(iter_completed_hits(
+                hit_ids, approve=approve, sandbox=sandbox,
+                num_workers=num_workers, rate=rate, batch_size=batch_size,
+                et=et)):
+            batch.extend(results)
+            if (i + 1) % batch_size == 0:
+                writer.write(batch)
+                batch = []
+        writer.write(batch)
+    finally:
+        writer.close()
+    return writer.num_rows
@@ -0,0 +1,135 @@
+"""Crash-safe journal of the chunks launched by a bulk launch.
+
+Every chunk is identified by a deterministic token derived from its
+content, which is also sent to MTurk as the UniqueRequestToken and the
+RequesterAnnotation of its HIT. The journal is an append-only JSONL file: a
+line is written and synced to disk when a chunk is about to be launched and
+when its HIT was created, so a launch that dies halfway can be resumed
+without creating duplicate HITs.
+"""
+
+from .payload import compact_json
+
+import hashlib
+import json
+import os
+import re
+import threading
+
+
+# The error MTurk returns when a UniqueRequestToken is reused may include
+# the id of the existing HIT.
+HIT_ID_PATTERN = re.compile(r'\b([A-Z0-9]{30})\b')
+
+
+def chunk_token(template, tasks, start, hit_kwargs):
+    """Computes the UniqueRequestToken of a chunk.
+
+    Args:
+        template: The template the chunk is launched with.
+        tasks: The tasks of the chunk.
+        start: The index of the chunk's first task in the data, so that
+            identical chunks at different positions get different tokens.
+        hit_kwargs: The arguments passed to EasyTurk.launch_hit.
+
+    Returns:
+        A 64 character hexadecimal token.
+    """
+    content = compact_json([template, start, tasks,
+                            sorted(hit_kwargs.items())])
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def is_duplicate_token_error(error):
+    """Checks whether create_hit failed because its token was already used.
+
+    Args:
+        error: The exception raised by create_hit.
+
+    Returns:
+        A boolean.
+    """
+    return 'unique request token' in str(error).lower()
+
+
+def existing_hit_id(error):
+    """Gets the id of the HIT that was already created with a token.
+
+    The id is only found if the error message contains it. Otherwise the
+    HIT has to be looked up by its RequesterAnnotation, see
+    bulk.find_hits_by_token.
+
+    Args:
+        error: The exception raised by create_hit.
+
+    Returns:
+        The HITId if the error is a duplicate token error that names it,
+        or None.
+    """
+    if not is_duplicate_token_error(error):
+        return None
+    match = HIT_ID_PATTERN.search(str(error))
+    return match.group(1) if match else None
+
+
+class LaunchJournal(object):
+    """Append-only record of the chunks of bulk launches.
+    """
+
+    def __init__(self, path):
+        """Constructor for LaunchJournal.
+
+        Reads the records already in the file. A partially written last
+        line, left by a crash, is ignored.
+
+        Args:
+            path: Location of the JSONL file.
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.finished = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if record['event'] == 'finish':
+                        self.finished[record['token']] = record['hit_id']
+        self.f = open(path, 'a')
+
+    def _append(self, record):
+        with self.lock:
+            self.f.write(json.dumps(record) + '\n')
+            self.f.flush()
+            os.fsync(self.f.fileno())
+
+    def hit_id(self, token):
+        """Gets the HITId of a chunk that was already launched, or None.
+        """
+        return self.finished.get(token)
+
+    def start(self, token, chunk):
+        """Records that a chunk is about to be launched.
+
+        Args:
+            token: The chunk's token.
+            chunk: The index of the chunk.
+        """
+        self._append({'event': 'start', 'token': token, 'chunk': chunk})
+
+    def finish(self, token, chunk, hit_id):
+        """Records that the HIT of a chunk was created.
+
+        Args:
+            token: The chunk's token.
+            chunk: The index of the chunk.
+            hit_id: The id of the created HIT.
+        """
+        self._append({'event': 'finish', 'token': token, 'chunk': chunk,
+                      'hit_id': hit_id})
+        self.finished[token] = hit_id
+
+    def close(self):
+        self.f.close()
@@ -0,0 +1,286 @@
+"""Instrumentation of the MTurk api calls and processing stages.
+"""
+
+from .bulk import is_throttle_error
+from .bulk import monotonic
+from contextlib import contextmanager
+
+import json
+import threading
+
+
+# Upper bounds in seconds of the latency histogram buckets.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+
+
+def payload_size(obj):
+    """Approximates the number of bytes of the arguments of an api call.
+
+    Args:
+        obj: The arguments of the call.
+
+    Returns:
+        The total size of the strings encoded as UTF-8, plus 8 bytes per
+        other value.
+    """
+    if isinstance(obj, bytes):
+        return len(obj)
+    if isinstance(obj, str):
+        return len(obj.encode('utf-8'))
+    if isinstance(obj, dict):
+        return sum(payload_size(k) + payload_size(v)
+                   for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return sum(payload_size(v) for v in obj)
+    return 8
+
+
+def error_code(e):
+    """Gets the MTurk error code of an exception.
+
+    Args:
+        e: An exception raised by an api call.
+
+    Returns:
+        The error code, or the name of the exception's class.
+    """
+    response = getattr(e, 'response', None) or {}
+    return response.get('Error', {}).get('Code') or type(e).__name__
+
+
+def escape_label(value):
+    """Escapes a label value for the Prometheus text format.
+
+    Args:
+        value: The value of a label.
+
+    Returns:
+        The value with backslashes, double quotes and newlines escaped.
+    """
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+class Histogram(object):
+    """A histogram of durations with cumulative buckets.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def snapshot(self):
+        return {'count': self.count,
+                'sum': self.sum,
+                'buckets': dict(zip([str(b) for b in self.buckets],
+                                    self.counts))}
+
+
+class Metrics(object):
+    """Thread-safe collector of api call and stage metrics.
+
+    Any object with record_call, record_retry and time_stage methods can
+    be passed to EasyTurk instead, to send the measurements elsewhere.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forgets everything that has been recorded.
+        """
+        with self.lock:
+            self.calls = {}
+            self.stages = {}
+
+    def _operation(self, operation):
+        if operation not in self.calls:
+            self.calls[operation] = {'calls': 0,
+                                     'errors': {},
+                                     'throttles': 0,
+                                     'retries': 0,
+                                     'request_bytes': 0,
+                                     'latency': Histogram()}
+        return self.calls[operation]
+
+    def record_call(self, operation, seconds, request_bytes=0,
+                    error_code=None, throttled=False):
+        """Records a finished api call.
+
+        Args:
+            operation: Name of the api call.
+            seconds: Duration of the call.
+            request_bytes: Size of the arguments of the call.
+            error_code: The error code if the call failed.
+            throttled: Whether the call failed because of throttling.
+        """
+        with self.lock:
+            stats = self._operation(operation)
+            stats['calls'] += 1
+            stats['request_bytes'] += request_bytes
+            stats['latency'].observe(seconds)
+            if error_code is not None:
+                stats['errors'][error_code] = (
+                        stats['errors'].get(error_code, 0) + 1)
+            if throttled:
+                stats['throttles'] += 1
+
+    def record_retry(self, error):
+        """Records that a call is retried after an error.
+
+        Args:
+            error: The exception that caused the retry.
+        """
+        operation = getattr(error, 'operation_name', None) or 'unknown'
+        with self.lock:
+            self._operation(operation)['retries'] += 1
+
+    @contextmanager
+    def time_stage(self, stage):
+        """Context manager that records the duration of a stage.
+
+        Args:
+            stage: Name of the stage, like render or parse.
+        """
+        start = monotonic()
+        try:
+            yield
+        finally:
+            seconds = monotonic() - start
+            with self.lock:
+                if stage not in self.stages:
+                    self.stages[stage] = Histogram()
+                self.stages[stage].observe(seconds)
+
+    def snapshot(self):
+        """Takes a snapshot of everything recorded so far.
+
+        Returns:
+            A dictionary with an entry per api operation and per stage.
+        """
+        with self.lock:
+            operations = {}
+            for operation, stats in self.calls.items():
+                operations[operation] = {
+                    'calls': stats['calls'],
+                    'errors': dict(stats['errors']),
+                    'throttles': stats['throttles'],
+                    'retries': stats['retries'],
+                    'request_bytes': stats['request_bytes'],
+                    'latency': stats['latency'].snapshot()}
+            stages = dict((stage, h.snapshot())
+                          for stage, h in self.stages.items())
+        return {'operations': operations, 'stages': stages}
+
+    def to_json(self):
+        """Exports the snapshot as json.
+        """
+        return json.dumps(self.snapshot(), indent=2, sort_keys=True)
+
+    def to_prometheus(self):
+        """Exports the snapshot in the Prometheus text format.
+        """
+        snapshot = self.snapshot()
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append('# HELP %s %s' % (name, help_text))
+            lines.append('# TYPE %s %s' % (name, kind))
+            for labels, value in samples:
+                label_text = ','.join('%s="%s"' % (k, escape_label(v))
+                                      for k, v in labels)
+                lines.append('%s{%s} %s' % (name, label_text, value))
+
+        def histogram(name, help_text, label, histograms):
+            lines.append('# HELP %s %s' % (name, help_text))
+            lines.append('# TYPE %s histogram' % name)
+            for key in sorted(histograms):
+                h = histograms[key]
+                key = escape_label(key)
+                for bound in LATENCY_BUCKETS:
+                    lines.append('%s_bucket{%s="%s",le="%s"} %d' % (
+                        name, label, key, bound, h['buckets'][str(bound)]))
+                lines.append('%s_bucket{%s="%s",le="+Inf"} %d' % (
+                    name, label, key, h['count']))
+                lines.append('%s_sum{%s="%s"} %f' % (name, label, key,
+                                                     h['sum']))
+                lines.append('%s_count{%s="%s"} %d' % (name, label, key,
+                                                       h['count']))
+
+        operations = snapshot['operations']
+        names = sorted(operations)
+        metric('easyturk_api_calls_total', 'counter',
+               'Number of MTurk api calls.',
+               [([('operation', o)], operations[o]['calls']) for o in names])
+        metric('easyturk_api_errors_total', 'counter',
+               'Number of failed MTurk api calls.',
+               [([('operation', o), ('code', code)], count)
+                for o in names
+                for code, count in sorted(operations[o]['errors'].items())])
+        metric('easyturk_api_throttles_total', 'counter',
+               'Number of throttled MTurk api calls.',
+               [([('operation', o)], operations[o]['throttles'])
+                for o in names])
+        metric('easyturk_api_retries_total', 'counter',
+               'Number of retried MTurk api calls.',
+               [([('operation', o)], operations[o]['retries'])
+                for o in names])
+        metric('easyturk_api_request_bytes_total', 'counter',
+               'Size of the arguments of MTurk api calls.',
+               [([('operation', o)], operations[o]['request_bytes'])
+                for o in names])
+        histogram('easyturk_api_latency_seconds',
+                  'Latency of MTurk api calls.', 'operation',
+                  dict((o, operations[o]['latency']) for o in names))
+        histogram('easyturk_stage_seconds',
+                  'Duration of processing stages.', 'stage',
+                  snapshot['stages'])
+        return '\n'.join(lines) + '\n'
+
+
+class InstrumentedClient(object):
+    """Wraps an MTurk client and records every call in a Metrics.
+    """
+
+    def __init__(self, client, metrics):
+        """Constructor for InstrumentedClient.
+
+        Args:
+            client: The MTurk client to wrap.
+            metrics: The Metrics to record calls in.
+        """
+        self.client = client
+        self.metrics = metrics
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+        if not callable(method):
+            return method
+
+        def instrumented(*args, **kwargs):
+            start = monotonic()
+            code = None
+            throttled = False
+            try:
+                return method(*args, **kwargs)
+            except Exception as e:
+                code = error_code(e)
+                throttled = is_throttle_error(e)
+                raise
+            finally:
+                self.metrics.record_call(
+                        name, monotonic() - start,
+                        request_bytes=payload_size(kwargs),
+                        error_code=code, throttled=throttled)
+        return instrumented
@@ -0,0 +1,442 @@
+"""An in-process stand-in for the MTurk requester api.
+
+MockMTurk implements the client methods that EasyTurk uses, so it can be
+passed as the client of an EasyTurk to measure or test it without an AWS
+account. Workers answer every HIT with synthetic QuestionFormAnswers XML.
+LocalSQS stands in for the SQS queues that MTurk sends notifications to.
+"""
+
+from botocore.exceptions import ClientError
+from datetime import datetime
+from datetime import timedelta
+from dateutil.tz import tzlocal
+from xml.sax.saxutils import escape
+
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+
+
+ANSWER_TEMPLATE = (
+        '<?xml version="1.0" encoding="ASCII"?>'
+        '<QuestionFormAnswers xmlns="http://mechanicalturk.amazonaws.com/'
+        'AWSMechanicalTurkDataSchemas/2005-10-01/QuestionFormAnswers.xsd">'
+        '<Answer><QuestionIdentifier>output</QuestionIdentifier>'
+        '<FreeText>{}</FreeText></Answer></QuestionFormAnswers>')
+
+INPUT_PATTERN = re.compile(
+        r"<script type='text/json' id='input'>(.*?)</script>", re.S)
+
+
+def echo_answer(input_data):
+    """Default synthetic worker that returns its input as the output.
+
+    Args:
+        input_data: The list of tasks of the HIT.
+
+    Returns:
+        The worker's output.
+    """
+    return input_data
+
+
+class MockMTurk(object):
+    """Thread-safe in-memory MTurk client with latency and throttling.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, max_rate=None,
+                 throttle_probability=0.0, answer_fn=echo_answer,
+                 submit_delay=0.0, num_workers=10, seed=None, sqs=None):
+        """Constructor for MockMTurk.
+
+        Args:
+            latency: Seconds every call takes.
+            jitter: Maximum random seconds added to the latency.
+            max_rate: Calls per second above which calls are throttled.
+            throttle_probability: Probability that any call is throttled.
+            answer_fn: Function from a HIT's input to a worker's output.
+            submit_delay: Seconds after creation at which the assignments
+                of a HIT are submitted.
+            num_workers: Number of synthetic workers.
+            seed: Seed of the random number generator.
+            sqs: An optional LocalSQS that notifications are sent to.
+                Assignments of HIT types with notifications are submitted
+                submit_delay seconds after creation without being polled.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.max_rate = max_rate
+        self.throttle_probability = throttle_probability
+        self.answer_fn = answer_fn
+        self.submit_delay = submit_delay
+        self.worker_ids = ['W%08d' % i for i in range(num_workers)]
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.window = []
+        self.hits = {}
+        self.hit_types = {}
+        self.tokens = {}
+        self.notifications = {}
+        self.sqs = sqs
+        self.assignments = {}
+        self.calls = {}
+        self.balance = 10000.0
+
+    def _request(self, operation):
+        """Simulates the latency and throttling of a request.
+
+        Args:
+            operation: Name of the api call.
+        """
+        with self.lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+            now = time.time()
+            self.window = [t for t in self.window if now - t < 1.0]
+            self.window.append(now)
+            throttled = ((self.max_rate is not None and
+                          len(self.window) > self.max_rate) or
+                         self.random.random() < self.throttle_probability)
+            delay = self.latency + self.random.random() * self.jitter
+        if delay > 0:
+            time.sleep(delay)
+        if throttled:
+            raise ClientError(
+                    {'Error': {'Code': 'ThrottlingException',
+                               'Message': 'Rate exceeded'}},
+                    operation)
+
+    def _error(self, operation, message):
+        return ClientError(
+                {'Error': {'Code': 'RequestError', 'Message': message}},
+                operation)
+
+    def _now(self):
+        return datetime.now(tzlocal())
+
+    def _submit_assignments(self, hit):
+        """Submits synthetic assignments for a HIT once they are due.
+
+        Args:
+            hit: The internal HIT dictionary.
+        """
+        if hit['assignment_ids'] or hit['HITStatus'] == 'Disposed':
+            return
+        if time.time() - hit['created'] < self.submit_delay:
+            return
+        match = INPUT_PATTERN.search(hit['Question'])
+        input_data = json.loads(match.group(1)) if match else None
+        workers = self.random.sample(
+                self.worker_ids,
+                min(hit['MaxAssignments'], len(self.worker_ids)))
+        for worker_id in workers:
+            assignment_id = uuid.uuid4().hex.upper()[:30]
+            output = json.dumps(self.answer_fn(input_data))
+            now = self._now()
+            work_time = timedelta(seconds=self.random.uniform(30, 300))
+            self.assignments[assignment_id] = {
+                'AssignmentId': assignment_id,
+                'WorkerId': worker_id,
+                'HITId': hit['HITId'],
+                'AssignmentStatus': 'Submitted',
+                'AcceptTime': now - work_time,
+                'SubmitTime': now,
+                'Answer': ANSWER_TEMPLATE.format(escape(output)),
+            }
+            hit['assignment_ids'].append(assignment_id)
+            self._notify(hit, 'AssignmentSubmitted', assignment_id)
+        hit['HITStatus'] = 'Reviewable'
+        self._notify(hit, 'HITReviewable')
+
+    def _notify(self, hit, event_type, assignment_id=None):
+        """Sends a notification if the HIT's type subscribed to the event.
+        """
+        notification = self.notifications.get(hit['HITTypeId'])
+        if (self.sqs is None or notification is None or
+                event_type not in notification['EventTypes']):
+            return
+        event = {'EventType': event_type,
+                 'EventTimestamp': self._now().isoformat(),
+                 'HITId': hit['HITId'],
+                 'HITTypeId': hit['HITTypeId']}
+        if assignment_id is not None:
+            event['AssignmentId'] = assignment_id
+        self.sqs.send_message(
+                QueueUrl=notification['Destination'],
+                MessageBody=json.dumps({'Events': [event],
+                                        'EventDocVersion': '2014-08-15'}))
+
+    def _submit_later(self, hit_id):
+        with self.lock:
+            hit = self.hits.get(hit_id)
+            if hit is not None:
+                self._submit_assignments(hit)
+
+    def _hit_summary(self, hit):
+        """Builds the HIT dictionary returned by the api.
+
+        Args:
+            hit: The internal HIT dictionary.
+
+        Returns:
+            A HIT dictionary.
+        """
+        self._submit_assignments(hit)
+        statuses = [self.assignments[a]['AssignmentStatus']
+                    for a in hit['assignment_ids']]
+        done = len(statuses)
+        summary = dict((k, v) for k, v in hit.items()
+                       if k not in ('assignment_ids', 'created'))
+        summary['NumberOfAssignmentsPending'] = 0
+        summary['NumberOfAssignmentsAvailable'] = hit['MaxAssignments'] - done
+        summary['NumberOfAssignmentsCompleted'] = sum(
+                1 for s in statuses if s in ('Approved', 'Rejected'))
+        return summary
+
+    def get_account_balance(self):
+        self._request('get_account_balance')
+        return {'AvailableBalance': '%.2f' % self.balance}
+
+    def _add_hit(self, operation, properties, hit_type_id):
+        hit_id = uuid.uuid4().hex.upper()[:30]
+        token = properties.get('UniqueRequestToken')
+        with self.lock:
+            if token is not None and token in self.tokens:
+                raise self._error(
+                        operation,
+                        'There is already a HIT with this unique request '
+                        'token.')
+            if token is not None:
+                self.tokens[token] = hit_id
+        hit = dict(properties)
+        hit.update({'HITId': hit_id,
+                    'HITTypeId': hit_type_id,
+                    'HITStatus': 'Assignable',
+                    'CreationTime': self._now(),
+                    'Expiration': self._now() + timedelta(
+                        seconds=properties.get('LifetimeInSeconds', 0)),
+                    'created': time.time(),
+                    'assignment_ids': []})
+        hit.pop('UniqueRequestToken', None)
+        with self.lock:
+            self.hits[hit_id] = hit
+            if hit_type_id in self.notifications:
+                timer = threading.Timer(self.submit_delay, self._submit_later,
+                                        (hit_id,))
+                timer.daemon = True
+                timer.start()
+            return {'HIT': self._hit_summary(hit)}
+
+    def create_hit(self, **kwargs):
+        self._request('create_hit')
+        return self._add_hit('create_hit', kwargs, 'MOCKTYPE')
+
+    def create_hit_type(self, **kwargs):
+        self._request('create_hit_type')
+        # Like MTurk, identical properties always get the same id.
+        key = json.dumps(kwargs, sort_keys=True).encode('utf-8')
+        hit_type_id = hashlib.sha1(key).hexdigest().upper()[:30]
+        with self.lock:
+            self.hit_types[hit_type_id] = kwargs
+        return {'HITTypeId': hit_type_id}
+
+    def create_hit_with_hit_type(self, HITTypeId, **kwargs):
+        self._request('create_hit_with_hit_type')
+        with self.lock:
+            if HITTypeId not in self.hit_types:
+                raise self._error('create_hit_with_hit_type',
+                                  'Hit type %s does not exist.' % HITTypeId)
+            properties = dict(self.hit_types[HITTypeId])
+        properties.update(kwargs)
+        return self._add_hit('create_hit_with_hit_type', properties,
+                             HITTypeId)
+
+    def update_notification_settings(self, HITTypeId, Notification=None,
+                                     Active=None):
+        self._request('update_notification_settings')
+        with self.lock:
+            if Notification is not None:
+                self.notifications[HITTypeId] = Notification
+            if Active is False:
+                self.notifications.pop(HITTypeId, None)
+        return {}
+
+    def get_hit(self, HITId):
+        self._request('get_hit')
+        with self.lock:
+            if HITId not in self.hits:
+                raise self._error('get_hit', 'Hit %s does not exist.' % HITId)
+            return {'HIT': self._hit_summary(self.hits[HITId])}
+
+    def list_hits(self, MaxResults=10, NextToken=None):
+        self._request('list_hits')
+        start = int(NextToken or 0)
+        with self.lock:
+            hit_ids = sorted(self.hits)[start:start + MaxResults]
+            response = {'HITs': [self._hit_summary(self.hits[h])
+                                 for h in hit_ids],
+                        'NumResults': len(hit_ids)}
+            if start + MaxResults < len(self.hits):
+                response['NextToken'] = str(start + MaxResults)
+        return response
+
+    def list_assignments_for_hit(self, HITId, MaxResults=10, NextToken=None,
+                                 AssignmentStatuses=None):
+        self._request('list_assignments_for_hit')
+        start = int(NextToken or 0)
+        with self.lock:
+            if HITId not in self.hits:
+                raise self._error('list_assignments_for_hit',
+                                  'Hit %s does not exist.' % HITId)
+            hit = self.hits[HITId]
+            self._submit_assignments(hit)
+            assignments = [self.assignments[a] for a in hit['assignment_ids']]
+            if AssignmentStatuses is not None:
+                assignments = [a for a in assignments
+                               if a['AssignmentStatus'] in AssignmentStatuses]
+            page = [dict(a) for a in assignments[start:start + MaxResults]]
+        response = {'Assignments': page, 'NumResults': len(page)}
+        if start + MaxResults < len(assignments):
+            response['NextToken'] = str(start + MaxResults)
+        return response
+
+    def get_assignment(self, AssignmentId):
+        self._request('get_assignment')
+        with self.lock:
+            if AssignmentId not in self.assignments:
+                raise self._error('get_assignment',
+                                  'Assignment %s does not exist.' %
+                                  AssignmentId)
+            assignment = dict(self.assignments[AssignmentId])
+        return {'Assignment': assignment,
+                'HIT': {'HITId': assignment['HITId']}}
+
+    def _review(self, operation, assignment_id, status, allowed):
+        self._request(operation)
+        with self.lock:
+            assignment = self.assignments.get(assignment_id)
+            if assignment is None or assignment['AssignmentStatus'] not in allowed:
+                raise self._error(operation, 'Assignment %s cannot be %s.' %
+                                  (assignment_id, status.lower()))
+            assignment['AssignmentStatus'] = status
+        return {}
+
+    def approve_assignment(self, AssignmentId, RequesterFeedback=None,
+                           OverrideRejection=False):
+        allowed = ['Submitted'] + (['Rejected'] if OverrideRejection else [])
+        return self._review('approve_assignment', AssignmentId, 'Approved',
+                            allowed)
+
+    def reject_assignment(self, AssignmentId, RequesterFeedback=None):
+        return self._review('reject_assignment', AssignmentId, 'Rejected',
+                            ['Submitted'])
+
+    def update_expiration_for_hit(self, HITId, ExpireAt):
+        self._request('update_expiration_for_hit')
+        with self.lock:
+            if HITId not in self.hits:
+                raise self._error('update_expiration_for_hit',
+                                  'Hit %s does not exist.' % HITId)
+            self.hits[HITId]['Expiration'] = ExpireAt
+            if self.hits[HITId]['HITStatus'] == 'Assignable':
+                self.hits[HITId]['HITStatus'] = 'Reviewable'
+        return {}
+
+    def delete_hit(self, HITId):
+        self._request('delete_hit')
+        with self.lock:
+            hit = self.hits.get(HITId)
+            if hit is None:
+                raise self._error('delete_hit',
+                                  'Hit %s does not exist.' % HITId)
+            if hit['HITStatus'] == 'Assignable':
+                raise self._error('delete_hit',
+                                  'This HIT is currently in the state '
+                                  '\'Assignable\'.')
+            pending = [a for a in hit['assignment_ids']
+                       if self.assignments[a]['AssignmentStatus'] ==
+                       'Submitted']
+            if pending:
+                raise self._error('delete_hit',
+                                  'This HIT has assignments pending review.')
+            del self.hits[HITId]
+        return {}
+
+
+class LocalSQS(object):
+    """Thread-safe in-memory stand-in for the SQS api.
+
+    Supports long polling and visibility timeouts: received messages are
+    hidden until they are deleted or their visibility timeout expires.
+    """
+
+    def __init__(self, visibility_timeout=30):
+        """Constructor for LocalSQS.
+
+        Args:
+            visibility_timeout: Seconds a received message stays hidden.
+        """
+        self.visibility_timeout = visibility_timeout
+        self.condition = threading.Condition()
+        self.queues = {}
+
+    def create_queue(self, QueueName, Attributes=None):
+        url = 'https://sqs.local/%s' % QueueName
+        with self.condition:
+            self.queues.setdefault(url, [])
+        return {'QueueUrl': url}
+
+    def send_message(self, QueueUrl, MessageBody):
+        message = {'MessageId': uuid.uuid4().hex,
+                   'ReceiptHandle': None,
+                   'Body': MessageBody,
+                   'visible_at': 0}
+        with self.condition:
+            self.queues[QueueUrl].append(message)
+            self.condition.notify_all()
+        return {'MessageId': message['MessageId']}
+
+    def receive_message(self, QueueUrl, MaxNumberOfMessages=1,
+                        WaitTimeSeconds=0, VisibilityTimeout=None):
+        timeout = (self.visibility_timeout if VisibilityTimeout is None
+                   else VisibilityTimeout)
+        deadline = time.time() + WaitTimeSeconds
+        with self.condition:
+            while True:
+                now = time.time()
+                visible = [m for m in self.queues[QueueUrl]
+                           if m['visible_at'] <= now][:MaxNumberOfMessages]
+                if len(visible) > 0 or now >= deadline:
+                    break
+                # Wake up when a message is sent or becomes visible again.
+                hidden = [m['visible_at'] for m in self.queues[QueueUrl]]
+                self.condition.wait(min([deadline] + hidden) - now)
+            for m in visible:
+                m['visible_at'] = now + timeout
+                m['ReceiptHandle'] = uuid.uuid4().hex
+        response = {}
+        if len(visible) > 0:
+            response['Messages'] = [{'MessageId': m['MessageId'],
+                                     'ReceiptHandle': m['ReceiptHandle'],
+                                     'Body': m['Body']} for m in visible]
+        return response
+
+    def delete_message(self, QueueUrl, ReceiptHandle):
+        with self.condition:
+            self.queues[QueueUrl] = [m for m in self.queues[QueueUrl]
+                                     if m['ReceiptHandle'] != ReceiptHandle]
+        return {}
+
+    def delete_message_batch(self, QueueUrl, Entries):
+        handles = dict((e['ReceiptHandle'], e['Id']) for e in Entries)
+        with self.condition:
+            deleted = [m for m in self.queues[QueueUrl]
+                       if m['ReceiptHandle'] in handles]
+            self.queues[QueueUrl] = [m for m in self.queues[QueueUrl]
+                                     if m['ReceiptHandle'] not in handles]
+        return {'Successful': [{'Id': handles[m['ReceiptHandle']]}
+                               for m in deleted],
+                'Failed': []}
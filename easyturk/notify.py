@@ -0,0 +1,255 @@
+"""Event-driven ingestion of results from MTurk notifications.
+
+Instead of polling every open HIT, MTurk can send an AssignmentSubmitted
+or HITReviewable event to an SQS queue (see EasyTurk.enable_notifications).
+NotificationConsumer long-polls that queue and only fetches, parses and
+optionally approves the assignments named in the events, so the cost of
+ingestion is proportional to new work rather than to the number of HITs.
+Notifications are set per HIT type, so launch with the same EasyTurk:
+
+    et = EasyTurk(sandbox=False, store='project.db')
+    et.enable_notifications(queue_url)
+    interface.launch_caption(data, et=et)
+    consumer = NotificationConsumer(et, queue_url, approve=True)
+    consumer.run(callback=print)
+"""
+
+from .bulk import TokenBucket
+from .bulk import call_with_retry
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import json
+
+
+class NotificationConsumer(object):
+    """Ingests the assignments named in the events of an SQS queue.
+    """
+
+    def __init__(self, et, queue_url, sqs=None, approve=False, wait_time=20,
+                 max_messages=10, num_workers=8, rate=5.0, max_seen=100000):
+        """Constructor for NotificationConsumer.
+
+        Args:
+            et: The EasyTurk whose HIT types send notifications to the queue.
+                Results are added to its store if it has one.
+            queue_url: The url of the SQS queue.
+            sqs: An optional SQS client, such as mock_mturk.LocalSQS. By
+                default one is created from the mturk profile.
+            approve: Whether to approve the assignments that are ingested.
+            wait_time: Seconds each receive call waits for events, up to 20.
+            max_messages: Maximum number of messages per receive, up to 10.
+            num_workers: Maximum number of concurrent MTurk calls.
+            rate: Maximum number of MTurk calls per second.
+            max_seen: Number of recently ingested assignment ids remembered
+                to skip the events that MTurk or SQS deliver twice.
+        """
+        self.et = et
+        self.queue_url = queue_url
+        self._sqs = sqs
+        self.approve = approve
+        self.wait_time = wait_time
+        self.max_messages = max_messages
+        self.num_workers = num_workers
+        self.rate = rate
+        self.bucket = TokenBucket(rate=rate)
+        self.max_seen = max_seen
+        self.seen = OrderedDict()
+
+    @property
+    def sqs(self):
+        if self._sqs is None:
+            import boto3
+            session = boto3.Session(profile_name='mturk')
+            self._sqs = session.client('sqs', region_name='us-east-1')
+        return self._sqs
+
+    def _call(self, func):
+        return call_with_retry(func, rate_limiter=self.bucket,
+                               on_retry=self.et.metrics.record_retry)
+
+    def _remember(self, assignment_ids):
+        """Adds ingested assignments to the bounded set of seen ones.
+        """
+        for assignment_id in assignment_ids:
+            self.seen[assignment_id] = True
+            self.seen.move_to_end(assignment_id)
+        while len(self.seen) > self.max_seen:
+            self.seen.popitem(last=False)
+
+    def _events(self, message):
+        """Extracts the events of a received message.
+
+        Args:
+            message: A message returned by receive_message.
+
+        Returns:
+            A list of event dictionaries. Ping events, sent when the
+            notification settings are tested, are left out.
+        """
+        try:
+            body = json.loads(message['Body'])
+        except ValueError:
+            return []
+        return [e for e in body.get('Events', [])
+                if e.get('EventType') != 'Ping']
+
+    def _fetch(self, assignment_ids, hit_ids):
+        """Fetches the submitted assignments named in events.
+
+        AssignmentSubmitted events name an assignment, and HITReviewable
+        events name a HIT whose submitted assignments are all fetched.
+
+        Args:
+            assignment_ids: A set of assignment ids.
+            hit_ids: A set of hit ids.
+
+        Returns:
+            A tuple of a dictionary from assignment_id to the assignment
+            dictionary from boto, a dictionary from hit_id to the ids of
+            its submitted assignments, and the set of assignment and hit
+            ids whose fetch failed.
+        """
+        def get_assignment(assignment_id):
+            try:
+                response = self._call(
+                        lambda: self.et.mtc.get_assignment(
+                            AssignmentId=assignment_id))
+                return assignment_id, [response['Assignment']]
+            except Exception as e:
+                print(e)
+                return assignment_id, None
+
+        def list_assignments(hit_id):
+            try:
+                return hit_id, self._call(lambda: list(
+                    self.et.iter_assignments(hit_id,
+                                             statuses=['Submitted'])))
+            except Exception as e:
+                print(e)
+                return hit_id, None
+
+        assignments = {}
+        by_hit = {}
+        failed = set()
+        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+            calls = ([executor.submit(get_assignment, a)
+                      for a in sorted(assignment_ids)] +
+                     [executor.submit(list_assignments, h)
+                      for h in sorted(hit_ids)])
+            for i, call in enumerate(calls):
+                key, group = call.result()
+                if group is None:
+                    failed.add(key)
+                    continue
+                if i >= len(assignment_ids):
+                    by_hit[key] = [a['AssignmentId'] for a in group]
+                for assignment in group:
+                    assignments[assignment['AssignmentId']] = assignment
+        return assignments, by_hit, failed
+
+    def poll(self, return_errors=False):
+        """Receives one batch of events and ingests their assignments.
+
+        A message is deleted from the queue only after all of its
+        assignments were fetched, stored and, if approving, approved. The
+        other messages become visible again after the queue's visibility
+        timeout, so their events are retried, as they are if the process
+        dies. Assignments that can not be parsed are stored without an
+        output, and are neither approved nor returned.
+
+        Args:
+            return_errors: Whether to also return the parse errors instead
+                of printing them.
+
+        Returns:
+            A list of the new results, as returned by EasyTurk.get_results,
+            and the parse errors if return_errors is set.
+        """
+        response = self.sqs.receive_message(
+                QueueUrl=self.queue_url,
+                MaxNumberOfMessages=self.max_messages,
+                WaitTimeSeconds=self.wait_time)
+        messages = response.get('Messages', [])
+        if len(messages) == 0:
+            return ([], []) if return_errors else []
+
+        # The assignment and hit ids named by each message.
+        named = []
+        for message in messages:
+            ids = set()
+            hit_ids = set()
+            for event in self._events(message):
+                if event['EventType'] == 'AssignmentSubmitted':
+                    ids.add(event['AssignmentId'])
+                elif event['EventType'] == 'HITReviewable':
+                    hit_ids.add(event['HITId'])
+            named.append((ids - set(self.seen), hit_ids))
+
+        assignments, by_hit, failed = self._fetch(
+                set().union(*[ids for ids, _ in named]),
+                set().union(*[hit_ids for _, hit_ids in named]))
+        new = [a for a in assignments.values()
+               if a['AssignmentStatus'] == 'Submitted' and
+               a['AssignmentId'] not in self.seen]
+        outputs, errors = self.et.parse_assignments(new)
+        results = [self.et._result_from_assignment(
+                       a, outputs.get(a['AssignmentId']))
+                   for a in new]
+        if self.et.store is not None:
+            self.et.store.add_assignments(results)
+
+        results = [r for r in results if r['output'] is not None]
+
+        if self.approve:
+            parsed = [r['assignment_id'] for r in results]
+            approved = set(self.et.approve_assignments(
+                    parsed, num_workers=self.num_workers, rate=self.rate))
+            for result in results:
+                if result['assignment_id'] in approved:
+                    result['status'] = 'Approved'
+            if self.et.store is not None:
+                self.et.store.set_statuses(list(approved), 'Approved')
+            failed.update(set(parsed) - approved)
+        self._remember(a['AssignmentId'] for a in new
+                       if a['AssignmentId'] not in failed)
+
+        entries = []
+        for i, (message, (ids, hit_ids)) in enumerate(zip(messages, named)):
+            ids = ids.union(*[by_hit.get(h, []) for h in hit_ids])
+            if ids.isdisjoint(failed) and hit_ids.isdisjoint(failed):
+                entries.append({'Id': str(i),
+                                'ReceiptHandle': message['ReceiptHandle']})
+        if len(entries) > 0:
+            self.sqs.delete_message_batch(QueueUrl=self.queue_url,
+                                          Entries=entries)
+        if return_errors:
+            return results, errors
+        for error in errors:
+            print('Failed to parse assignment %s of hit %s: %s' % (
+                error['assignment_id'], error['hit_id'], error['message']))
+        return results
+
+    def run(self, callback=None, max_polls=None):
+        """Consumes events until interrupted.
+
+        Args:
+            callback: An optional function called with the list of new
+                results of every poll that found some.
+            max_polls: Optional number of receive calls after which to stop.
+
+        Returns:
+            The total number of results ingested.
+        """
+        total = 0
+        polls = 0
+        try:
+            while max_polls is None or polls < max_polls:
+                results = self.poll()
+                polls += 1
+                total += len(results)
+                if callback is not None and len(results) > 0:
+                    callback(results)
+        except KeyboardInterrupt:
+            pass
+        return total
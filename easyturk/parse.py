@@ -0,0 +1,166 @@
+"""Fast parsing of worker answers from MTurk assignments.
+"""
+
+from collections import OrderedDict
+from xml.etree.ElementTree import ParseError as XMLParseError
+from xml.etree.ElementTree import XMLPullParser
+
+import json
+import threading
+
+
+# Size of the pieces the answer XML is fed to the parser in.
+FEED_SIZE = 65536
+
+
+def extract_answer(answer, identifier='output'):
+    """Extracts the text of a named answer from QuestionFormAnswers XML.
+
+    The XML is fed to an incremental parser piece by piece, and parsing
+    stops as soon as the answer has been found.
+
+    Args:
+        answer: The QuestionFormAnswers XML of an assignment.
+        identifier: The QuestionIdentifier of the answer to extract.
+
+    Returns:
+        The text of the answer, or None if there is no such answer.
+    """
+    parser = XMLPullParser(events=('end',))
+    current = None
+    for start in range(0, len(answer), FEED_SIZE):
+        parser.feed(answer[start:start + FEED_SIZE])
+        for _, elem in parser.read_events():
+            tag = elem.tag.rsplit('}', 1)[-1]
+            if tag == 'QuestionIdentifier':
+                current = elem.text
+            elif tag == 'FreeText' and current == identifier:
+                return elem.text or ''
+            elif tag == 'Answer':
+                current = None
+                elem.clear()
+    parser.close()
+    return None
+
+
+def parse_answer(answer, identifier='output'):
+    """Parses the json output of a worker out of an assignment's answer.
+
+    Args:
+        answer: The QuestionFormAnswers XML of an assignment.
+        identifier: The QuestionIdentifier of the answer to parse.
+
+    Returns:
+        A tuple of the parsed output and an error. The error is None on
+        success, otherwise a tuple of the error type ('xml', 'missing' or
+        'json') and a message.
+    """
+    try:
+        text = extract_answer(answer, identifier=identifier)
+    except XMLParseError as e:
+        return None, ('xml', str(e))
+    if text is None:
+        return None, ('missing', 'No answer named %s.' % identifier)
+    try:
+        return json.loads(text), None
+    except ValueError as e:
+        return None, ('json', str(e))
+
+
+class AnswerParser(object):
+    """Parses assignments in batches and memoizes outputs by assignment id.
+
+    Answers never change once an assignment is submitted, so repeated
+    fetches of the same assignments skip parsing. Outputs returned from the
+    cache are the same objects every time and should not be modified.
+    """
+
+    def __init__(self, cache_size=100000, processes=None,
+                 min_parallel_bytes=8 * 1024 * 1024):
+        """Constructor for AnswerParser.
+
+        Args:
+            cache_size: Maximum number of parsed outputs to memoize.
+            processes: Number of processes used for large batches.
+                None parses every batch in the calling thread.
+            min_parallel_bytes: Total answer size above which a batch is
+                spread across the process pool.
+        """
+        self.cache_size = cache_size
+        self.processes = processes
+        self.min_parallel_bytes = min_parallel_bytes
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _remember(self, assignment_id, output):
+        with self.lock:
+            self.cache[assignment_id] = output
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def parse_batch(self, assignments):
+        """Parses the outputs of many assignments.
+
+        Args:
+            assignments: A list of assignment dictionaries from boto.
+
+        Returns:
+            A tuple of a dictionary from assignment_id to the parsed output
+            and a list of parse errors. Each error is a dictionary with the
+            following fields:
+                - assignment_id
+                - hit_id
+                - worker_id
+                - type
+                - message
+        """
+        outputs = {}
+        todo = []
+        with self.lock:
+            for a in assignments:
+                if a['AssignmentId'] in self.cache:
+                    outputs[a['AssignmentId']] = self.cache[a['AssignmentId']]
+                else:
+                    todo.append(a)
+
+        answers = [a['Answer'] for a in todo]
+        size = sum(len(answer) for answer in answers)
+        if (self.processes is not None and len(todo) > 1 and
+                size >= self.min_parallel_bytes):
+            # Imported here since multiprocessing is slow to import.
+            from concurrent.futures import ProcessPoolExecutor
+
+            chunksize = max(1, len(answers) // (self.processes * 4))
+            with ProcessPoolExecutor(max_workers=self.processes) as executor:
+                parsed = list(executor.map(parse_answer, answers,
+                                           chunksize=chunksize))
+        else:
+            parsed = [parse_answer(answer) for answer in answers]
+
+        errors = []
+        for a, (output, error) in zip(todo, parsed):
+            if error is None:
+                outputs[a['AssignmentId']] = output
+                self._remember(a['AssignmentId'], output)
+            else:
+                errors.append({'assignment_id': a['AssignmentId'],
+                               'hit_id': a.get('HITId'),
+                               'worker_id': a.get('WorkerId'),
+                               'type': error[0],
+                               'message': error[1]})
+        return outputs, errors
+
+    def parse(self, assignment):
+        """Parses the output of a single assignment.
+
+        Args:
+            assignment: An assignment dictionary from boto.
+
+        Returns:
+            A tuple of the parsed output, or None, and the parse error,
+            or None.
+        """
+        outputs, errors = self.parse_batch([assignment])
+        if len(errors) > 0:
+            return None, errors[0]
+        return outputs[assignment['AssignmentId']], None
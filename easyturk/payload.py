@@ -0,0 +1,131 @@
+"""Measures and budgets the size of the questions sent to MTurk.
+"""
+
+import json
+import re
+
+
+# MTurk rejects HITs whose Question is larger than this many bytes.
+MAX_QUESTION_BYTES = 65535
+
+COMMENT_PATTERN = re.compile(r'<!--(?!\[if).*?-->', re.S)
+PRESERVE_OPEN = re.compile(r'<(pre|textarea)\b', re.I)
+PRESERVE_CLOSE = re.compile(r'</(pre|textarea)>', re.I)
+
+
+def compact_json(data):
+    """Serializes data as json without optional whitespace.
+
+    Args:
+        data: A json serializable object.
+
+    Returns:
+        A json string.
+    """
+    return json.dumps(data, separators=(',', ':'))
+
+
+def minify_html(html):
+    """Conservatively minifies html and the javascript inlined in it.
+
+    Removes html comments, indentation, blank lines and javascript lines
+    that only contain a // comment. Line breaks are kept so that
+    javascript relying on automatic semicolon insertion still works, and
+    the contents of pre and textarea elements are left untouched.
+
+    Args:
+        html: The html to minify.
+
+    Returns:
+        The minified html.
+    """
+    html = COMMENT_PATTERN.sub('', html)
+    lines = []
+    preserve = False
+    for line in html.split('\n'):
+        if preserve or PRESERVE_OPEN.search(line):
+            lines.append(line)
+            opened = len(PRESERVE_OPEN.findall(line))
+            closed = len(PRESERVE_CLOSE.findall(line))
+            if opened > closed:
+                preserve = True
+            elif closed > opened:
+                preserve = False
+            continue
+        stripped = line.strip()
+        if len(stripped) == 0 or stripped.startswith('//'):
+            continue
+        lines.append(stripped)
+    return '\n'.join(lines)
+
+
+def byte_size(text):
+    """Number of bytes of a string once encoded as utf-8.
+    """
+    return len(text.encode('utf-8'))
+
+
+class PayloadPlanner(object):
+    """Packs tasks into chunks whose rendered questions fit a byte budget.
+    """
+
+    def __init__(self, et, template_location, max_bytes=MAX_QUESTION_BYTES,
+                 frame_height=9000, minify=True):
+        """Constructor for PayloadPlanner.
+
+        Args:
+            et: An EasyTurk instance.
+            template_location: The template the tasks will be launched with.
+            max_bytes: Maximum size of a question in bytes.
+            frame_height: The frame height of the questions.
+            minify: Whether the questions will be minified.
+        """
+        parts = et.get_template_parts(template_location, minify=minify)
+        if parts is None:
+            raise ValueError('Template %s must render its input exactly '
+                             'once to plan payloads.' % template_location)
+        static_html = parts[0] + parts[1]
+        self.max_bytes = max_bytes
+        self.overhead = byte_size(
+                et.create_html_question(static_html, frame_height))
+
+    def size(self, task_sizes):
+        """Computes the size of a question from the sizes of its tasks.
+
+        Args:
+            task_sizes: A list of the byte sizes of each task's json.
+
+        Returns:
+            The size of the question in bytes.
+        """
+        separators = max(0, len(task_sizes) - 1)
+        return self.overhead + 2 + sum(task_sizes) + separators
+
+    def plan(self, tasks, max_tasks_per_hit):
+        """Greedily packs tasks into chunks that fit the budget.
+
+        Each chunk holds as many consecutive tasks as fit in max_bytes, up
+        to max_tasks_per_hit. A task that does not fit on its own is
+        returned in a chunk of its own, whose size is over the budget.
+
+        Args:
+            tasks: An iterable of tasks.
+            max_tasks_per_hit: Maximum number of tasks in a chunk.
+
+        Yields:
+            Tuples of a chunk of tasks and the size of its question.
+        """
+        chunk = []
+        size = self.size([])
+        for task in tasks:
+            task_size = byte_size(compact_json(task))
+            new_size = size + task_size + (1 if len(chunk) > 0 else 0)
+            if len(chunk) > 0 and (new_size > self.max_bytes or
+                                   len(chunk) >= max_tasks_per_hit):
+                yield chunk, size
+                chunk = []
+                new_size = self.size([task_size])
+            chunk.append(task)
+            size = new_size
+        if len(chunk) > 0:
+            yield chunk, size
@@ -1,23 +1,34 @@
 """Script to render a given EasyTurk task.
+
+Only needs the templates: no AWS session is created and boto3 is never
+imported.
 """
 
 import argparse
+import json
 
-from easyturk import EasyTurk
+from .easyturk import EasyTurk
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--template', required=True)
     parser.add_argument('--output', required=True)
+    parser.add_argument('--input', default=None,
+                        help='Optional json file with the input of the task.')
+    parser.add_argument('--minify', action='store_true')
     args = parser.parse_args()
 
     # Compile the template.
     et = EasyTurk()
-    env = et.get_jinja_env()
-    template = env.get_template(args.template)
-
-    html = template.render({'input': ''})
+    if args.input is None:
+        template = et.get_jinja_env().get_template(args.template)
+        html = template.render({'input': ''})
+    else:
+        with open(args.input) as f:
+            input_data = json.load(f)
+        html = et.render_template(args.template, input_data,
+                                  minify=args.minify)
 
     # Save to output.
     with open(args.output, 'w') as f:
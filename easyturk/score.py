@@ -0,0 +1,329 @@
+"""Vectorized quality scores of worker outputs for automatic review.
+
+Computes the same intersection over union as templates/javascript/iou.js
+and the same bleu score as templates/javascript/bleu.js, but over whole
+arrays at once, so that every assignment returned by get_results can be
+scored against gold labels, or against the other workers, in one pass.
+
+Requires numpy.
+"""
+
+from itertools import chain
+
+import numpy as np
+
+
+def boxes_to_array(rects):
+    """Converts bbox dictionaries into an array.
+
+    Args:
+        rects: A list of dictionaries with x, y, w, h, or None for a
+            missing box.
+
+    Returns:
+        A float array of shape (N, 4) with a row of nan for missing boxes.
+    """
+    array = np.full((len(rects), 4), np.nan)
+    for i, rect in enumerate(rects):
+        if rect is not None:
+            array[i] = (rect['x'], rect['y'], rect['w'], rect['h'])
+    return array
+
+
+def iou(boxes, others):
+    """Computes the intersection over union of pairs of bboxes.
+
+    Args:
+        boxes: An array of shape (N, 4) of x, y, w, h.
+        others: An array of the same shape.
+
+    Returns:
+        An array of N IoUs. Pairs with a missing (nan) box score 0.
+    """
+    boxes = np.asarray(boxes, dtype=float)
+    others = np.asarray(others, dtype=float)
+    x1 = np.maximum(boxes[..., 0], others[..., 0])
+    x2 = np.minimum(boxes[..., 0] + boxes[..., 2],
+                    others[..., 0] + others[..., 2])
+    y1 = np.maximum(boxes[..., 1], others[..., 1])
+    y2 = np.minimum(boxes[..., 1] + boxes[..., 3],
+                    others[..., 1] + others[..., 3])
+    overlap = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    areas = boxes[..., 2] * boxes[..., 3]
+    other_areas = others[..., 2] * others[..., 3]
+    with np.errstate(invalid='ignore'):
+        scores = overlap / (areas + other_areas - overlap + 1e-9)
+    return np.nan_to_num(scores)
+
+
+def pairwise_iou(boxes, others):
+    """Computes the IoU between every box and every other box.
+
+    Args:
+        boxes: An array of shape (N, 4) of x, y, w, h.
+        others: An array of shape (M, 4).
+
+    Returns:
+        An array of shape (N, M).
+    """
+    boxes = np.asarray(boxes, dtype=float)
+    others = np.asarray(others, dtype=float)
+    return iou(boxes[:, None, :], others[None, :, :])
+
+
+def tokenize(sentence):
+    """Lowercases a sentence and splits it into words.
+    """
+    if sentence is None:
+        return []
+    return sentence.lower().split()
+
+
+def _ngrams(tokens, n, vocab):
+    """Ids of the n-grams compared by bleu.js, for sizes 1 to n.
+
+    Like bleu.js, the n-grams of each size are taken at steps of their
+    size, so they do not overlap.
+    """
+    ids = []
+    for size in range(1, n + 1):
+        for start in range(0, len(tokens) - size + 1, size):
+            ngram = tuple(tokens[start:start + size])
+            if ngram not in vocab:
+                vocab[ngram] = len(vocab)
+            ids.append(vocab[ngram])
+    return ids
+
+
+def bleu(sentences, references, n=4):
+    """Computes the bleu-n score of pairs of sentences.
+
+    Every n-gram of the sentence that appears in the reference counts as a
+    match, and the score is the fraction of matched n-grams, as in
+    bleu.js. Each distinct sentence is split into n-grams once, and the
+    n-grams of all pairs are matched at once with numpy.
+
+    Args:
+        sentences: A list of strings, or of lists of words.
+        references: A list of the same length of strings or lists of words.
+        n: The largest n-gram size.
+
+    Returns:
+        An array of scores between 0 and 1. Empty sentences score 0.
+    """
+    vocab = {}
+    cache = {}
+
+    def ngram_ids(sentence):
+        key = tuple(sentence) if isinstance(sentence, list) else sentence
+        if key not in cache:
+            tokens = (sentence if isinstance(sentence, list)
+                      else tokenize(sentence))
+            cache[key] = _ngrams(tokens, n, vocab)
+        return cache[key]
+
+    def keys(texts):
+        ids = [ngram_ids(text) for text in texts]
+        lengths = np.asarray([len(i) for i in ids], dtype=np.int64)
+        pairs = np.repeat(np.arange(len(ids), dtype=np.int64), lengths)
+        flat = np.fromiter(chain.from_iterable(ids), dtype=np.int64,
+                           count=int(lengths.sum()))
+        return pairs, flat
+
+    sentence_pairs, sentence_ids = keys(sentences)
+    reference_pairs, reference_ids = keys(references)
+
+    # Make the n-gram ids unique per pair so that they can be matched all
+    # at once.
+    size = max(1, len(vocab))
+    matched = np.isin(sentence_pairs * size + sentence_ids,
+                      reference_pairs * size + reference_ids)
+
+    num_pairs = len(sentences)
+    totals = np.bincount(sentence_pairs, minlength=num_pairs)
+    matches = np.bincount(sentence_pairs, weights=matched,
+                          minlength=num_pairs)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.nan_to_num(matches / totals)
+
+
+def max_bleu(sentences, references, n=4):
+    """Computes the best bleu-n score of each sentence over its references.
+
+    Args:
+        sentences: A list of strings.
+        references: A list of the same length of lists of strings.
+        n: The largest n-gram size.
+
+    Returns:
+        An array of scores. Sentences without references score nan.
+    """
+    pairs = []
+    pair_sentences = []
+    pair_references = []
+    for i, (sentence, refs) in enumerate(zip(sentences, references)):
+        for ref in refs:
+            if ref:
+                pairs.append(i)
+                pair_sentences.append(sentence)
+                pair_references.append(ref)
+    best = np.full(len(sentences), np.nan)
+    if len(pairs) > 0:
+        scores = bleu(pair_sentences, pair_references, n=n)
+        pairs = np.asarray(pairs)
+        np.fmax.at(best, pairs, scores)
+    return best
+
+
+def _mean_per_assignment(rows, scores, num_assignments):
+    """Averages the scores of the rows of every assignment, ignoring nan.
+    """
+    valid = ~np.isnan(scores)
+    totals = np.bincount(rows[valid], weights=scores[valid],
+                         minlength=num_assignments)
+    counts = np.bincount(rows[valid], minlength=num_assignments)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return totals / counts
+
+
+def _group_median(groups, values):
+    """Computes the median of the values of every group.
+
+    Args:
+        groups: An array of N group indices between 0 and G - 1.
+        values: An array of shape (N, D).
+
+    Returns:
+        An array of shape (G, D).
+    """
+    num_groups = groups.max() + 1 if len(groups) > 0 else 0
+    counts = np.bincount(groups, minlength=num_groups)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    medians = np.empty((num_groups, values.shape[1]))
+    for d in range(values.shape[1]):
+        column = values[:, d]
+        # Missing values sort last, so the median ignores them.
+        order = np.lexsort((column, groups))
+        ordered = column[order]
+        present = np.bincount(groups, weights=~np.isnan(column),
+                              minlength=num_groups).astype(int)
+        low = starts + np.maximum(present - 1, 0) // 2
+        high = starts + np.maximum(present, 1) // 2
+        medians[:, d] = np.where(present > 0,
+                                 (ordered[low] + ordered[high]) / 2, np.nan)
+    return medians
+
+
+def score_bboxes(results, gold=None):
+    """Scores the bboxes drawn in every assignment.
+
+    Works with the output of annotate_bbox, where each task of a HIT has a
+    list of objects with a rect. Each box is compared with the gold box of
+    the same HIT, task and object or, without gold, with the median box of
+    all the workers of the HIT.
+
+    Args:
+        results: A list of results, as returned by EasyTurk.get_results.
+        gold: An optional dictionary from (hit_id, task index) to the list
+            of gold rects of the task's objects.
+
+    Returns:
+        A dictionary from assignment_id to the mean IoU of its boxes, which
+        is nan when none of its boxes can be compared.
+    """
+    assignment_ids = [r['assignment_id'] for r in results]
+    rows = []
+    keys = []
+    rects = []
+    for row, result in enumerate(results):
+        for i, task in enumerate(result['output'] or []):
+            for k, obj in enumerate(task.get('objects') or []):
+                rows.append(row)
+                keys.append((result['hit_id'], i, k))
+                rects.append(obj.get('rect'))
+    rows = np.asarray(rows, dtype=np.int64)
+    boxes = boxes_to_array(rects)
+
+    if gold is not None:
+        gold_rects = []
+        for hit_id, i, k in keys:
+            task_gold = gold.get((hit_id, i)) or []
+            gold_rects.append(task_gold[k] if k < len(task_gold) else None)
+        references = boxes_to_array(gold_rects)
+        compared = ~np.isnan(references).any(axis=1)
+    else:
+        group_ids = {}
+        groups = np.asarray([group_ids.setdefault(key, len(group_ids))
+                             for key in keys], dtype=np.int64)
+        references = _group_median(groups, boxes)[groups]
+        compared = np.bincount(groups)[groups] > 1
+
+    scores = iou(boxes, references)
+    scores[~compared] = np.nan
+    means = _mean_per_assignment(rows, scores, len(results))
+    return dict(zip(assignment_ids, means.tolist()))
+
+
+def score_captions(results, gold=None, field='caption', n=4):
+    """Scores the sentences written in every assignment.
+
+    Works with the output of write_caption, where each task of a HIT has a
+    caption. Each caption is compared with the gold captions of the same
+    HIT and task or, without gold, with the captions the other workers
+    wrote for it, and gets its best bleu-n score.
+
+    Args:
+        results: A list of results, as returned by EasyTurk.get_results.
+        gold: An optional dictionary from (hit_id, task index) to a list of
+            reference sentences.
+        field: The field of each task's output that holds the sentence.
+        n: The largest n-gram size.
+
+    Returns:
+        A dictionary from assignment_id to the mean score of its sentences,
+        which is nan when none of its sentences can be compared.
+    """
+    assignment_ids = [r['assignment_id'] for r in results]
+    rows = []
+    keys = []
+    sentences = []
+    for row, result in enumerate(results):
+        for i, task in enumerate(result['output'] or []):
+            rows.append(row)
+            keys.append((result['hit_id'], i))
+            sentences.append(task.get(field))
+    rows = np.asarray(rows, dtype=np.int64)
+
+    if gold is not None:
+        references = [gold.get(key) or [] for key in keys]
+    else:
+        by_task = {}
+        for index, key in enumerate(keys):
+            by_task.setdefault(key, []).append(index)
+        references = [[sentences[j] for j in by_task[key] if j != index]
+                      for index, key in enumerate(keys)]
+
+    scores = max_bleu(sentences, references, n=n)
+    empty = np.asarray([not s for s in sentences], dtype=bool)
+    scores[empty & ~np.isnan(scores)] = 0
+    means = _mean_per_assignment(rows, scores, len(results))
+    return dict(zip(assignment_ids, means.tolist()))
+
+
+def decide(scores, threshold):
+    """Splits scored assignments into ones to approve and to reject.
+
+    Args:
+        scores: A dictionary from assignment_id to a score.
+        threshold: The lowest score that gets approved.
+
+    Returns:
+        A tuple of the assignment ids to approve and to reject. Assignments
+        with a nan score are in neither.
+    """
+    ids = list(scores)
+    values = np.asarray([scores[a] for a in ids], dtype=float)
+    approve = values >= threshold
+    reject = values < threshold
+    return ([a for a, ok in zip(ids, approve) if ok],
+            [a for a, bad in zip(ids, reject) if bad])
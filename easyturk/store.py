@@ -0,0 +1,611 @@
+"""A local SQLite store that tracks launched HITs and their assignments.
+"""
+
+from .worker_stats import WorkerStatsBuilder
+from .worker_stats import suspiciousness
+
+import json
+import sqlite3
+import threading
+import time
+
+
+# Assignment statuses that will not change anymore.
+FINAL_STATUSES = ('Approved', 'Rejected')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS hits (
+    hit_id TEXT PRIMARY KEY,
+    template TEXT,
+    input TEXT,
+    max_assignments INTEGER,
+    closed INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS assignments (
+    assignment_id TEXT PRIMARY KEY,
+    hit_id TEXT NOT NULL,
+    worker_id TEXT,
+    status TEXT,
+    output TEXT,
+    submit_time TEXT
+);
+CREATE INDEX IF NOT EXISTS assignments_hit_id ON assignments (hit_id);
+CREATE INDEX IF NOT EXISTS hits_closed ON hits (closed);
+"""
+
+RESULTS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS workers (
+    position INTEGER PRIMARY KEY,
+    worker_id TEXT UNIQUE NOT NULL,
+    num_assignments INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    worker_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    assignment_id TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (worker_id, idx)
+);
+CREATE TABLE IF NOT EXISTS statuses (
+    assignment_id TEXT PRIMARY KEY,
+    worker_id TEXT NOT NULL,
+    status TEXT
+);
+CREATE TABLE IF NOT EXISTS worker_stats (
+    worker_id TEXT PRIMARY KEY,
+    num_assignments INTEGER NOT NULL,
+    num_approved INTEGER NOT NULL,
+    num_rejected INTEGER NOT NULL,
+    median_work_time REAL,
+    disagreement REAL,
+    speed REAL,
+    suspiciousness REAL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE INDEX IF NOT EXISTS statuses_worker_id ON statuses (worker_id);
+CREATE INDEX IF NOT EXISTS worker_stats_suspiciousness
+    ON worker_stats (suspiciousness);
+"""
+
+# The columns of the worker_stats table, in order.
+WORKER_STATS_COLUMNS = ('worker_id', 'num_assignments', 'num_approved',
+                        'num_rejected', 'median_work_time', 'disagreement',
+                        'speed', 'suspiciousness')
+
+REVIEW_SCHEMA = """
+CREATE TABLE IF NOT EXISTS reviews (
+    assignment_id TEXT PRIMARY KEY,
+    approve INTEGER NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+
+class HITStore(object):
+    """Records launched HITs, their inputs, assignments and review state.
+    """
+
+    def __init__(self, path):
+        """Constructor for HITStore.
+
+        Args:
+            path: Location of the SQLite database file.
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.lock:
+            self.conn.executescript(SCHEMA)
+            self.conn.commit()
+
+    def add_hit(self, hit_id, template, input_data, max_assignments):
+        """Records a launched HIT.
+
+        Args:
+            hit_id: The hit id of the HIT.
+            template: The template the HIT was launched with.
+            input_data: The chunk of tasks the HIT was launched with.
+            max_assignments: Number of assignments requested for the HIT.
+        """
+        with self.lock:
+            self.conn.execute(
+                    'INSERT OR REPLACE INTO hits (hit_id, template, input, '
+                    'max_assignments, closed) VALUES (?, ?, ?, ?, 0)',
+                    (hit_id, template, json.dumps(input_data),
+                     max_assignments))
+            self.conn.commit()
+
+    def open_hits(self):
+        """Lists the HITs that may still receive or need to review work.
+
+        Returns:
+            A list of (hit_id, max_assignments) tuples.
+        """
+        with self.lock:
+            return self.conn.execute(
+                    'SELECT hit_id, max_assignments FROM hits '
+                    'WHERE closed = 0').fetchall()
+
+    def close_hit(self, hit_id):
+        """Marks a HIT as fully collected so that sync skips it.
+
+        Args:
+            hit_id: The hit id of the HIT.
+        """
+        with self.lock:
+            self.conn.execute('UPDATE hits SET closed = 1 WHERE hit_id = ?',
+                              (hit_id,))
+            self.conn.commit()
+
+    def assignment_statuses(self, hit_id):
+        """Gets the known assignments of a HIT.
+
+        Args:
+            hit_id: The hit id of the HIT.
+
+        Returns:
+            A dictionary from assignment_id to its recorded status.
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                    'SELECT assignment_id, status FROM assignments '
+                    'WHERE hit_id = ?', (hit_id,)).fetchall()
+        return dict(rows)
+
+    def add_assignments(self, results):
+        """Records parsed assignments.
+
+        Args:
+            results: A list of dictionaries as returned by
+                EasyTurk.get_results.
+        """
+        rows = [(r['assignment_id'], r['hit_id'], r['worker_id'],
+                 r['status'], json.dumps(r['output']), str(r['submit_time']))
+                for r in results]
+        with self.lock:
+            self.conn.executemany(
+                    'INSERT OR REPLACE INTO assignments (assignment_id, '
+                    'hit_id, worker_id, status, output, submit_time) '
+                    'VALUES (?, ?, ?, ?, ?, ?)', rows)
+            self.conn.commit()
+
+    def set_statuses(self, assignment_ids, status):
+        """Updates the status of assignments.
+
+        Args:
+            assignment_ids: A list of assignment ids.
+            status: The new assignment status.
+        """
+        with self.lock:
+            self.conn.executemany(
+                    'UPDATE assignments SET status = ? '
+                    'WHERE assignment_id = ?',
+                    [(status, a) for a in assignment_ids])
+            self.conn.commit()
+
+    def submitted_assignment_ids(self, hit_ids, parsed=True):
+        """Lists the assignments that are awaiting review.
+
+        Args:
+            hit_ids: A list of hit ids.
+            parsed: Whether to list the parsable assignments, or the ones
+                that could not be parsed.
+
+        Returns:
+            A list of assignment ids.
+        """
+        comparison = '!=' if parsed else '='
+        output = []
+        with self.lock:
+            for hit_id in hit_ids:
+                rows = self.conn.execute(
+                        'SELECT assignment_id FROM assignments '
+                        'WHERE hit_id = ? AND status = ? AND output %s ?'
+                        % comparison, (hit_id, 'Submitted', 'null')).fetchall()
+                output.extend(row[0] for row in rows)
+        return output
+
+    def get_results(self, hit_ids=None):
+        """Reads back the recorded results.
+
+        Args:
+            hit_ids: An optional list of hit ids to restrict the results to.
+
+        Returns:
+            A dictionary from hit_id to a list of the parsable assignment
+            dictionaries, in the same format as
+            interface.fetch_completed_hits.
+        """
+        query = ('SELECT assignment_id, hit_id, worker_id, status, output, '
+                 'submit_time FROM assignments')
+        with self.lock:
+            rows = self.conn.execute(query).fetchall()
+        wanted = set(hit_ids) if hit_ids is not None else None
+        output = {}
+        for assignment_id, hit_id, worker_id, status, out, submit in rows:
+            if wanted is not None and hit_id not in wanted:
+                continue
+            if out == 'null':
+                continue
+            output.setdefault(hit_id, []).append({
+                'assignment_id': assignment_id,
+                'hit_id': hit_id,
+                'worker_id': worker_id,
+                'output': json.loads(out),
+                'submit_time': submit,
+                'status': status,
+            })
+        return output
+
+    def close(self):
+        """Closes the database connection.
+        """
+        with self.lock:
+            self.conn.close()
+
+
+class ReviewStore(object):
+    """Records the approve and reject decisions made by reviewers.
+
+    Decisions are keyed by assignment id and every batch of decisions is
+    written in a single transaction, so recording a decision costs time
+    proportional to the number of assignments in it, and concurrent
+    reviewers cannot corrupt each other's decisions.
+    """
+
+    def __init__(self, path):
+        """Constructor for ReviewStore.
+
+        Args:
+            path: Location of the SQLite database file.
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30,
+                                    check_same_thread=False)
+        with self.lock:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.executescript(REVIEW_SCHEMA)
+            self.conn.commit()
+
+    def record(self, assignment_ids, approve):
+        """Records a decision for assignments.
+
+        Args:
+            assignment_ids: A list of assignment ids.
+            approve: Whether the assignments were approved or rejected.
+        """
+        now = time.time()
+        rows = [(a, int(approve), now) for a in assignment_ids]
+        with self.lock:
+            with self.conn:
+                self.conn.executemany(
+                        'INSERT OR REPLACE INTO reviews (assignment_id, '
+                        'approve, updated) VALUES (?, ?, ?)', rows)
+
+    def decisions(self, assignment_ids=None):
+        """Reads the recorded decisions.
+
+        Args:
+            assignment_ids: An optional list of assignment ids to read the
+                decisions of. Defaults to all the decisions.
+
+        Returns:
+            A dictionary from assignment_id to whether it was approved.
+        """
+        rows = []
+        with self.lock:
+            if assignment_ids is None:
+                rows = self.conn.execute(
+                        'SELECT assignment_id, approve FROM reviews'
+                        ).fetchall()
+            else:
+                assignment_ids = list(assignment_ids)
+                for i in range(0, len(assignment_ids), 500):
+                    batch = assignment_ids[i:i+500]
+                    rows.extend(self.conn.execute(
+                            'SELECT assignment_id, approve FROM reviews '
+                            'WHERE assignment_id IN (%s)' %
+                            ','.join('?' * len(batch)), batch).fetchall())
+        return dict((a, bool(approve)) for a, approve in rows)
+
+    def close(self):
+        """Closes the database connection.
+        """
+        with self.lock:
+            self.conn.close()
+
+
+class ResultsIndex(object):
+    """An index of fetched results, ordered and paginated by worker.
+
+    It also keeps the statistics of every worker, see worker_stats, which
+    are computed while the index is built and updated with every review.
+    """
+
+    def __init__(self, path):
+        """Constructor for ResultsIndex.
+
+        Args:
+            path: Location of the SQLite database file.
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30,
+                                    check_same_thread=False)
+        with self.lock:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.executescript(RESULTS_SCHEMA)
+            self.conn.commit()
+
+    def is_built(self):
+        """Checks whether the index has been built.
+
+        Returns:
+            A boolean.
+        """
+        with self.lock:
+            row = self.conn.execute('SELECT 1 FROM workers LIMIT 1').fetchone()
+        return row is not None
+
+    def source(self):
+        """Gets the signature of the results file the index was built from.
+
+        Returns:
+            The signature passed to set_source, or None.
+        """
+        with self.lock:
+            row = self.conn.execute(
+                    'SELECT value FROM meta '
+                    'WHERE key = \'source\'').fetchone()
+        return row[0] if row is not None else None
+
+    def set_source(self, source):
+        """Records the signature of the results file the index was built from.
+
+        Args:
+            source: A string that changes whenever the results file does.
+        """
+        with self.lock:
+            with self.conn:
+                self.conn.execute(
+                        'INSERT OR REPLACE INTO meta (key, value) '
+                        'VALUES (\'source\', ?)', (source,))
+
+    def build(self, converted):
+        """Builds the index from converted results.
+
+        Args:
+            converted: The output of evaluate.convert.
+        """
+        workers = []
+        rows = []
+        builder = WorkerStatsBuilder()
+        for position, worker_id in enumerate(converted['worker_ids']):
+            indices = converted['workers'][worker_id]
+            workers.append((position, worker_id, len(indices)))
+            for idx, hit_index in enumerate(indices):
+                hit = converted['hits'][hit_index]
+                rows.append((worker_id, idx, hit['assignment_id'],
+                             json.dumps(hit)))
+                builder.add(hit)
+        with self.lock:
+            with self.conn:
+                self.conn.execute('DELETE FROM workers')
+                self.conn.execute('DELETE FROM results')
+                self.conn.executemany(
+                        'INSERT INTO workers (position, worker_id, '
+                        'num_assignments) VALUES (?, ?, ?)', workers)
+                self.conn.executemany(
+                        'INSERT INTO results (worker_id, idx, '
+                        'assignment_id, data) VALUES (?, ?, ?, ?)', rows)
+                self._write_worker_stats(builder)
+
+    def build_from_results(self, results, batch_size=10000):
+        """Builds the index from a stream of results in one pass.
+
+        Workers are ordered by their first assignment, as in
+        evaluate.convert, but only one batch of results is in memory at a
+        time.
+
+        Args:
+            results: An iterable of result dictionaries, such as
+                export.iter_rows decoded with export.unflatten.
+            batch_size: Number of results inserted per statement.
+        """
+        counts = {}
+        builder = WorkerStatsBuilder()
+        with self.lock:
+            with self.conn:
+                self.conn.execute('DELETE FROM workers')
+                self.conn.execute('DELETE FROM results')
+                rows = []
+                for result in results:
+                    builder.add(result)
+                    worker_id = result['worker_id']
+                    idx = counts.get(worker_id, 0)
+                    counts[worker_id] = idx + 1
+                    rows.append((worker_id, idx, result['assignment_id'],
+                                 json.dumps(result)))
+                    if len(rows) >= batch_size:
+                        self.conn.executemany(
+                                'INSERT INTO results (worker_id, idx, '
+                                'assignment_id, data) VALUES (?, ?, ?, ?)',
+                                rows)
+                        rows = []
+                self.conn.executemany(
+                        'INSERT INTO results (worker_id, idx, '
+                        'assignment_id, data) VALUES (?, ?, ?, ?)', rows)
+                self.conn.executemany(
+                        'INSERT INTO workers (position, worker_id, '
+                        'num_assignments) VALUES (?, ?, ?)',
+                        [(position, worker_id, count) for position,
+                         (worker_id, count) in enumerate(counts.items())])
+                self._write_worker_stats(builder)
+
+    def _write_worker_stats(self, builder):
+        """Replaces the worker statistics. Called inside a transaction.
+
+        Args:
+            builder: A WorkerStatsBuilder that has seen every result.
+        """
+        self.conn.execute('DELETE FROM statuses')
+        self.conn.execute('DELETE FROM worker_stats')
+        self.conn.executemany(
+                'INSERT OR REPLACE INTO statuses (assignment_id, worker_id, '
+                'status) VALUES (?, ?, ?)', builder.statuses)
+        self.conn.executemany(
+                'INSERT INTO worker_stats (%s) VALUES (%s)' % (
+                    ', '.join(WORKER_STATS_COLUMNS),
+                    ', '.join('?' * len(WORKER_STATS_COLUMNS))),
+                [tuple(stats[c] for c in WORKER_STATS_COLUMNS)
+                 for stats in builder.stats()])
+
+    def has_worker_stats(self):
+        """Checks whether the worker statistics have been computed.
+
+        Indexes built by earlier versions only have the results.
+
+        Returns:
+            A boolean.
+        """
+        with self.lock:
+            row = self.conn.execute(
+                    'SELECT 1 FROM worker_stats LIMIT 1').fetchone()
+        return row is not None
+
+    def build_worker_stats(self):
+        """Computes the worker statistics from the indexed results.
+        """
+        builder = WorkerStatsBuilder()
+        with self.lock:
+            for row in self.conn.execute('SELECT data FROM results'):
+                builder.add(json.loads(row[0]))
+            with self.conn:
+                self._write_worker_stats(builder)
+
+    def record_decisions(self, assignment_ids, approve):
+        """Updates the statistics of workers after a review.
+
+        Only the approval and rejection counts, and the suspiciousness, of
+        the workers of the reviewed assignments are recomputed.
+
+        Args:
+            assignment_ids: A list of assignment ids.
+            approve: Whether the assignments were approved or rejected.
+        """
+        status = 'Approved' if approve else 'Rejected'
+        with self.lock:
+            with self.conn:
+                self.conn.executemany(
+                        'UPDATE statuses SET status = ? '
+                        'WHERE assignment_id = ?',
+                        [(status, a) for a in assignment_ids])
+                worker_ids = set()
+                for assignment_id in assignment_ids:
+                    row = self.conn.execute(
+                            'SELECT worker_id FROM statuses '
+                            'WHERE assignment_id = ?',
+                            (assignment_id,)).fetchone()
+                    if row is not None:
+                        worker_ids.add(row[0])
+                for worker_id in worker_ids:
+                    num_approved, num_rejected = self.conn.execute(
+                            'SELECT SUM(status = \'Approved\'), '
+                            'SUM(status = \'Rejected\') FROM statuses '
+                            'WHERE worker_id = ?', (worker_id,)).fetchone()
+                    disagreement, speed = self.conn.execute(
+                            'SELECT disagreement, speed FROM worker_stats '
+                            'WHERE worker_id = ?', (worker_id,)).fetchone()
+                    self.conn.execute(
+                            'UPDATE worker_stats SET num_approved = ?, '
+                            'num_rejected = ?, suspiciousness = ? '
+                            'WHERE worker_id = ?',
+                            (num_approved, num_rejected,
+                             suspiciousness(num_approved, num_rejected,
+                                            disagreement, speed),
+                             worker_id))
+
+    def worker_stats(self, offset=0, limit=None):
+        """Lists the statistics of workers, most suspicious first.
+
+        Args:
+            offset: Number of workers to skip.
+            limit: Maximum number of workers to return.
+
+        Returns:
+            A list of dictionaries with the columns of WORKER_STATS_COLUMNS.
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                    'SELECT %s FROM worker_stats '
+                    'ORDER BY suspiciousness IS NULL, suspiciousness DESC, '
+                    'num_assignments DESC LIMIT ? OFFSET ?' %
+                    ', '.join(WORKER_STATS_COLUMNS),
+                    (-1 if limit is None else limit, offset)).fetchall()
+        return [dict(zip(WORKER_STATS_COLUMNS, row)) for row in rows]
+
+    def workers(self, offset=0, limit=None):
+        """Lists the workers in order.
+
+        Args:
+            offset: Number of workers to skip.
+            limit: Maximum number of workers to return.
+
+        Returns:
+            A list of dictionaries with worker_id and num_assignments.
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                    'SELECT worker_id, num_assignments FROM workers '
+                    'ORDER BY position LIMIT ? OFFSET ?',
+                    (-1 if limit is None else limit, offset)).fetchall()
+        return [{'worker_id': w, 'num_assignments': n} for w, n in rows]
+
+    def num_assignments(self, worker_id=None):
+        """Counts the assignments of a worker or of all workers.
+
+        Args:
+            worker_id: An optional worker id.
+
+        Returns:
+            The number of assignments.
+        """
+        with self.lock:
+            if worker_id is None:
+                row = self.conn.execute(
+                        'SELECT SUM(num_assignments) FROM workers').fetchone()
+            else:
+                row = self.conn.execute(
+                        'SELECT num_assignments FROM workers '
+                        'WHERE worker_id = ?', (worker_id,)).fetchone()
+        if row is None or row[0] is None:
+            return 0
+        return row[0]
+
+    def assignments(self, worker_id, offset=0, limit=50):
+        """Reads a page of a worker's assignments.
+
+        Args:
+            worker_id: The worker id.
+            offset: Number of assignments to skip.
+            limit: Maximum number of assignments to return.
+
+        Returns:
+            A list of assignment dictionaries.
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                    'SELECT data FROM results WHERE worker_id = ? '
+                    'AND idx >= ? ORDER BY idx LIMIT ?',
+                    (worker_id, offset, limit)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def close(self):
+        """Closes the database connection.
+        """
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,168 @@
+"""Per-worker statistics that help reviewers find careless workers.
+
+WorkerStatsBuilder accumulates, in a single pass over the results, each
+worker's number of assignments, approvals and rejections, median work time
+(SubmitTime minus AcceptTime) and disagreement with the other workers of
+the same HITs. These are combined into a suspiciousness score between 0
+and 1, so that the workers most likely to be spamming can be reviewed
+first.
+"""
+
+from datetime import datetime
+from .payload import compact_json
+
+
+def parse_time(value):
+    """Converts a time from boto, json or an export into a datetime.
+
+    Args:
+        value: A datetime, an ISO 8601 string or None.
+
+    Returns:
+        A datetime, or None if the value is missing.
+    """
+    if value is None or isinstance(value, datetime):
+        return value
+    from dateutil.parser import parse
+    return parse(value)
+
+
+def median(values):
+    """Computes the median of a list of numbers, or None if it is empty.
+    """
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2 == 1:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def suspiciousness(num_approved, num_rejected, disagreement, speed):
+    """Combines a worker's statistics into a score between 0 and 1.
+
+    The score is the mean of the rejection rate of the worker's reviewed
+    assignments, their disagreement with other workers and how much faster
+    than usual they work. Signals that are not available are left out.
+
+    Args:
+        num_approved: Number of approved assignments.
+        num_rejected: Number of rejected assignments.
+        disagreement: Fraction of answers that differ from the other
+            workers' answers to the same tasks, or None.
+        speed: How much shorter than the median work time of all workers
+            the worker's median work time is, between 0 and 1, or None.
+
+    Returns:
+        A score, or None if no signal is available.
+    """
+    signals = [s for s in (disagreement, speed) if s is not None]
+    if num_approved + num_rejected > 0:
+        signals.append(float(num_rejected) / (num_approved + num_rejected))
+    if len(signals) == 0:
+        return None
+    return sum(signals) / len(signals)
+
+
+def _tasks(output):
+    """Splits the output of an assignment into the answers of its tasks.
+    """
+    if isinstance(output, list):
+        return output
+    return [output]
+
+
+class WorkerStatsBuilder(object):
+    """Accumulates per-worker statistics from a stream of results.
+    """
+
+    def __init__(self):
+        self.workers = {}
+        self.statuses = []
+        # For every (hit_id, task index), the number of workers that gave
+        # each answer, and for every worker, the answers they gave.
+        self.answer_counts = {}
+        self.answers = {}
+
+    def add(self, result):
+        """Adds one assignment.
+
+        Args:
+            result: A dictionary as returned by EasyTurk.get_results.
+        """
+        worker_id = result['worker_id']
+        status = result.get('status')
+        if worker_id not in self.workers:
+            self.workers[worker_id] = {'num_assignments': 0,
+                                       'num_approved': 0,
+                                       'num_rejected': 0,
+                                       'work_times': []}
+            self.answers[worker_id] = []
+        worker = self.workers[worker_id]
+        worker['num_assignments'] += 1
+        if status == 'Approved':
+            worker['num_approved'] += 1
+        elif status == 'Rejected':
+            worker['num_rejected'] += 1
+        self.statuses.append((result['assignment_id'], worker_id, status))
+
+        accept_time = parse_time(result.get('accept_time'))
+        submit_time = parse_time(result.get('submit_time'))
+        if accept_time is not None and submit_time is not None:
+            worker['work_times'].append(
+                    (submit_time - accept_time).total_seconds())
+
+        if result.get('output') is None:
+            return
+        for i, answer in enumerate(_tasks(result['output'])):
+            key = (result['hit_id'], i)
+            answer = hash(compact_json(answer))
+            counts = self.answer_counts.setdefault(key, {})
+            counts[answer] = counts.get(answer, 0) + 1
+            self.answers[worker_id].append((key, answer))
+
+    def _disagreement(self, worker_id):
+        """The mean fraction of other workers that answered differently.
+        """
+        fractions = []
+        for key, answer in self.answers[worker_id]:
+            counts = self.answer_counts[key]
+            others = sum(counts.values()) - 1
+            if others > 0:
+                fractions.append(float(others - counts[answer] + 1) / others)
+        if len(fractions) == 0:
+            return None
+        return sum(fractions) / len(fractions)
+
+    def stats(self):
+        """Computes the statistics of every worker.
+
+        Returns:
+            A list of dictionaries with worker_id, num_assignments,
+            num_approved, num_rejected, median_work_time (in seconds),
+            disagreement, speed and suspiciousness, in the order the
+            workers were first seen.
+        """
+        medians = dict((worker_id, median(worker['work_times']))
+                       for worker_id, worker in self.workers.items())
+        typical = median([m for m in medians.values() if m is not None])
+        stats = []
+        for worker_id, worker in self.workers.items():
+            speed = None
+            if medians[worker_id] is not None and typical:
+                speed = min(1.0, max(0.0, 1 - medians[worker_id] / typical))
+            disagreement = self._disagreement(worker_id)
+            stats.append({
+                'worker_id': worker_id,
+                'num_assignments': worker['num_assignments'],
+                'num_approved': worker['num_approved'],
+                'num_rejected': worker['num_rejected'],
+                'median_work_time': medians[worker_id],
+                'disagreement': disagreement,
+                'speed': speed,
+                'suspiciousness': suspiciousness(
+                    worker['num_approved'], worker['num_rejected'],
+                    disagreement, speed),
+            })
+        return stats
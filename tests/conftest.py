@@ -0,0 +1,28 @@
+"""Shared fixtures of the tests, which run against mock_mturk.MockMTurk.
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from easyturk import EasyTurk  # noqa: E402
+from easyturk.mock_mturk import MockMTurk  # noqa: E402
+
+
+@pytest.fixture
+def mock():
+    return MockMTurk(seed=0)
+
+
+@pytest.fixture
+def et(mock):
+    return EasyTurk(client=mock)
+
+
+@pytest.fixture
+def caption_data():
+    return [{'url': 'http://example.com/%d.jpg' % i} for i in range(10)]
@@ -0,0 +1,119 @@
+"""Tests of AsyncEasyTurk against the mock, wrapped in coroutines.
+"""
+
+import asyncio
+
+import pytest
+
+from easyturk import EasyTurk
+from easyturk import async_easyturk
+from easyturk.async_easyturk import AsyncEasyTurk
+from easyturk.mock_mturk import LocalSQS
+from easyturk.mock_mturk import MockMTurk
+
+
+class AsyncClient(object):
+    """Exposes the methods of a client as coroutines.
+    """
+
+    def __init__(self, client, failing=()):
+        self.client = client
+        self.failing = failing
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+
+        async def call(**kwargs):
+            if kwargs.get('AssignmentId') in self.failing:
+                raise RuntimeError('Failed %s.' % name)
+            return method(**kwargs)
+        return call
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(async_easyturk, 'backoff_delay', lambda attempt: 0)
+
+
+def _run(client, coroutine):
+    async def run():
+        async with AsyncEasyTurk(client=client, max_retries=20) as et:
+            return et, await coroutine(et)
+    return asyncio.run(run())
+
+
+def test_throttled_calls_are_retried(caption_data):
+    mock = MockMTurk(seed=0, throttle_probability=0.3)
+
+    async def launch(et):
+        hits = await asyncio.gather(*[et.launch_hit(
+                'write_caption.html', [task], max_assignments=2)
+                for task in caption_data])
+        return [await et.get_results(hit['HIT']['HITId']) for hit in hits]
+
+    et, results = _run(AsyncClient(mock), launch)
+    assert len(mock.hits) == len(caption_data)
+    assert [r[0]['output'] for r in results] == [[task]
+                                                 for task in caption_data]
+    snapshot = et.metrics.snapshot()['operations']
+    assert sum(s['retries'] for s in snapshot.values()) > 0
+
+
+def test_approve_hit_returns_only_successful_calls(caption_data):
+    mock = MockMTurk(seed=0)
+
+    async def launch(et):
+        hit = await et.launch_hit('write_caption.html', caption_data[:1],
+                                  max_assignments=3)
+        return hit['HIT']['HITId']
+
+    _, hit_id = _run(AsyncClient(mock), launch)
+    assignment_ids = sorted(mock.assignments)
+    client = AsyncClient(mock, failing=assignment_ids[:1])
+    _, (approved, rejected) = _run(client, lambda et: et.approve_hit(hit_id))
+    assert sorted(approved) == assignment_ids[1:]
+    assert rejected == []
+    assert [mock.assignments[a]['AssignmentStatus']
+            for a in assignment_ids] == ['Submitted', 'Approved', 'Approved']
+
+
+def test_launch_hit_sends_request_tokens(caption_data):
+    mock = MockMTurk(seed=0)
+
+    async def launch(et):
+        hit = await et.launch_hit('write_caption.html', caption_data[:1],
+                                  unique_request_token='token',
+                                  requester_annotation='token')
+        with pytest.raises(Exception) as error:
+            await et.launch_hit('write_caption.html', caption_data[:1],
+                                unique_request_token='token')
+        return hit['HIT']['HITId'], error.value
+
+    _, (hit_id, error) = _run(AsyncClient(mock), launch)
+    assert mock.hits[hit_id]['RequesterAnnotation'] == 'token'
+    assert mock.tokens == {'token': hit_id}
+    assert 'unique request token' in str(error).lower()
+
+
+def test_hit_types_and_notifications_are_shared(caption_data):
+    sqs = LocalSQS()
+    queue_url = sqs.create_queue(QueueName='events')['QueueUrl']
+    mock = MockMTurk(seed=0, sqs=sqs)
+    et = EasyTurk(client=mock)
+    et.enable_notifications(queue_url)
+    et.launch_hit('write_caption.html', caption_data[:1])
+
+    async def launch(async_et):
+        return await asyncio.gather(*[async_et.launch_hit(
+                'write_caption.html', [task]) for task in caption_data])
+
+    async_et = AsyncEasyTurk(client=AsyncClient(mock), easyturk=et)
+    asyncio.run(launch(async_et))
+    assert mock.calls['create_hit_type'] == 1
+    assert len(mock.hits) == len(caption_data) + 1
+
+    async_et = AsyncEasyTurk(client=AsyncClient(mock), easyturk=et)
+    asyncio.run(async_et.launch_hit('write_caption.html', caption_data[:1],
+                                    reward=2))
+    assert mock.calls['create_hit_type'] == 2
+    assert set(mock.notifications) == set(et.hit_types.values())
@@ -0,0 +1,31 @@
+"""Tests of the benchmark against the mock.
+"""
+
+from easyturk.benchmark import benchmark
+from easyturk.benchmark import histogram_percentile
+
+
+def test_histogram_percentile_interpolates_within_buckets():
+    histogram = {'count': 4,
+                 'buckets': {'0.005': 0, '0.01': 0, '0.025': 0,
+                             '0.05': 2, '0.1': 4, '0.25': 4, '0.5': 4,
+                             '1.0': 4, '2.5': 4, '5.0': 4, '10.0': 4}}
+    assert abs(histogram_percentile(histogram, 50) - 0.05) < 1e-9
+    assert abs(histogram_percentile(histogram, 75) - 0.075) < 1e-9
+    assert histogram_percentile({'count': 0, 'buckets': {}}, 50) is None
+
+
+def test_benchmark_reports_calls_from_the_metrics():
+    stages = benchmark(num_hits=5, tasks_per_hit=2, num_workers=4,
+                       rate=1000, latency=0.0, jitter=0.0)
+    by_name = dict((s['stage'], s) for s in stages)
+    assert [s['stage'] for s in stages] == ['launch', 'fetch', 'approve',
+                                            'cleanup']
+    # One create_hit_type and one create_hit_with_hit_type per HIT.
+    assert by_name['launch']['calls'] == 6
+    assert by_name['fetch']['calls'] == 5
+    assert by_name['approve']['items'] == 5
+    assert by_name['approve']['calls'] == 5
+    assert by_name['cleanup']['calls'] == 5
+    assert all(s['p50'] is not None and s['p50'] <= s['p99']
+               for s in stages)
@@ -0,0 +1,119 @@
+"""Tests of the bulk launch and cleanup of HITs.
+"""
+
+import json
+import time
+
+from easyturk.mock_mturk import MockMTurk
+
+from easyturk import EasyTurk
+from easyturk.bulk import cleanup_hits
+from easyturk.bulk import TokenBucket
+from easyturk.bulk import launch_hits
+from easyturk.journal import LaunchJournal
+
+
+def test_launch_hits_in_order(et, mock, caption_data):
+    hit_ids, report = launch_hits(et, 'write_caption.html', caption_data, 3)
+    assert len(hit_ids) == 4
+    assert all(r['success'] for r in report)
+    assert [r['size'] for r in report] == [3, 3, 3, 1]
+    assert set(hit_ids) == set(mock.hits)
+
+
+def test_relaunch_without_journal_creates_new_hits(et, mock, caption_data):
+    first, _ = launch_hits(et, 'write_caption.html', caption_data, 5)
+    second, report = launch_hits(et, 'write_caption.html', caption_data, 5)
+    assert set(first).isdisjoint(second)
+    assert not any(r['resumed'] for r in report)
+    assert len(mock.hits) == 4
+    assert len(mock.tokens) == 0
+
+
+def test_journal_resumes_finished_chunks(et, mock, caption_data, tmp_path):
+    path = str(tmp_path / 'launch.jsonl')
+    first, _ = launch_hits(et, 'write_caption.html', caption_data, 3,
+                           journal=path)
+    second, report = launch_hits(et, 'write_caption.html', caption_data, 3,
+                                 journal=path)
+    assert second == first
+    assert all(r['resumed'] for r in report)
+    assert len(mock.hits) == 4
+
+
+def test_journal_recovers_chunks_in_flight(et, mock, caption_data,
+                                           tmp_path):
+    path = str(tmp_path / 'launch.jsonl')
+    first, _ = launch_hits(et, 'write_caption.html', caption_data, 3,
+                           journal=path)
+    # Simulate a crash after the HITs were created but before they were
+    # recorded as finished.
+    with open(path) as f:
+        records = [json.loads(line) for line in f]
+    with open(path, 'w') as f:
+        for record in records:
+            if record['event'] == 'start':
+                f.write(json.dumps(record) + '\n')
+
+    second, report = launch_hits(et, 'write_caption.html', caption_data, 3,
+                                 journal=path)
+    assert second == first
+    assert all(r['success'] and r['resumed'] for r in report)
+    assert len(mock.hits) == 4
+    assert LaunchJournal(path).hit_id(mock.hits[first[0]][
+        'RequesterAnnotation']) == first[0]
+
+
+def test_journal_from_path_is_closed(et, caption_data, tmp_path,
+                                     monkeypatch):
+    journals = []
+    original = LaunchJournal.__init__
+
+    def init(self, path):
+        original(self, path)
+        journals.append(self)
+
+    monkeypatch.setattr(LaunchJournal, '__init__', init)
+    launch_hits(et, 'write_caption.html', caption_data, 3,
+                journal=str(tmp_path / 'launch.jsonl'))
+    assert len(journals) == 1
+    assert journals[0].f.closed
+
+
+def test_cleanup_deletes_hits(et, mock, caption_data):
+    hit_ids, _ = launch_hits(et, 'write_caption.html', caption_data, 5)
+    reports = cleanup_hits(et, approve=True, rate=1000)
+    assert set(r['hit_id'] for r in reports) == set(hit_ids)
+    assert all(r['deleted'] and r['error'] is None for r in reports)
+    assert len(mock.hits) == 0
+
+
+def test_cleanup_settles_submissions_racing_the_expiry(caption_data,
+                                                       monkeypatch):
+    mock = MockMTurk(seed=0, submit_delay=3600)
+    et = EasyTurk(client=mock)
+    launch_hits(et, 'write_caption.html', caption_data, 5)
+    original = mock.update_expiration_for_hit
+
+    def update_expiration_for_hit(**kwargs):
+        # The workers submit after the HITs were listed, before they expire.
+        mock.submit_delay = 0
+        return original(**kwargs)
+
+    monkeypatch.setattr(mock, 'update_expiration_for_hit',
+                        update_expiration_for_hit)
+    reports = cleanup_hits(et, approve=True, rate=1000)
+    assert all(r['expired'] and r['deleted'] for r in reports)
+    assert all(r['error'] is None for r in reports)
+    assert all(r['approved'] > 0 for r in reports)
+    assert len(mock.hits) == 0
+
+
+def test_token_bucket_ignores_wall_clock_jumps(monkeypatch):
+    bucket = TokenBucket(rate=20, capacity=1)
+    bucket.acquire()
+    start = time.monotonic()
+    # A step of the system clock must not refill the bucket.
+    monkeypatch.setattr(time, 'time', lambda: 1e12)
+    bucket.acquire()
+    assert time.monotonic() - start >= 0.04
@@ -0,0 +1,71 @@
+"""Tests of the aggregation of redundant labels.
+"""
+
+import random
+
+import pytest
+
+pytest.importorskip('numpy')
+
+from easyturk.consensus import VoteAggregator  # noqa: E402
+
+
+def _votes(seed=0, num_hits=200):
+    """Votes of three careful workers and four that answer at random.
+    """
+    rng = random.Random(seed)
+    accuracies = [('G%d' % i, 0.85) for i in range(3)]
+    accuracies += [('R%d' % i, 0.5) for i in range(4)]
+    truth = {}
+    results = []
+    for h in range(num_hits):
+        hit_id = 'H%d' % h
+        truth[(hit_id, 0)] = rng.choice(['yes', 'no'])
+        for worker_id, accuracy in accuracies:
+            label = truth[(hit_id, 0)]
+            if rng.random() >= accuracy:
+                label = 'no' if label == 'yes' else 'yes'
+            results.append({'assignment_id': hit_id + worker_id,
+                            'hit_id': hit_id,
+                            'worker_id': worker_id,
+                            'output': [{'option': label}]})
+    return truth, results
+
+
+def _accuracy(consensus, truth):
+    return sum(consensus[key] == label
+               for key, label in truth.items()) / float(len(truth))
+
+
+def test_em_outperforms_majority_with_random_workers():
+    truth, results = _votes()
+    majority = VoteAggregator(method='majority')
+    majority.add(results)
+    em = VoteAggregator(method='em')
+    em.add(results)
+    assert _accuracy(em.consensus(), truth) >= 0.9
+    assert (_accuracy(em.consensus(), truth) >
+            _accuracy(majority.consensus(), truth) + 0.05)
+
+    reliability = em.worker_reliability()
+    careful = [r for w, r in reliability.items() if w.startswith('G')]
+    careless = [r for w, r in reliability.items() if w.startswith('R')]
+    assert min(careful) > max(careless) + 0.1
+
+
+def test_incremental_em_matches_a_full_fit():
+    truth, results = _votes()
+    full = VoteAggregator(method='em')
+    full.add(results)
+
+    incremental = VoteAggregator(method='em')
+    half = len(results) // 2
+    first = incremental.add(results[:half])
+    assert len(first) == len(truth) // 2
+    incremental.consensus()
+    updated = incremental.add(results[half:] + results[:10])
+    assert updated.isdisjoint(first)
+    assert incremental.consensus() == full.consensus()
+    assert incremental.consensus(keys=updated) == dict(
+            (key, label) for key, label in full.consensus().items()
+            if key in updated)
@@ -0,0 +1,238 @@
+"""Tests of rendering, launching, fetching results and syncing the store of
+an EasyTurk.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from datetime import timedelta
+
+import os
+
+import pytest
+
+from easyturk import EasyTurk
+from easyturk import easyturk
+from easyturk.easyturk import get_client
+from easyturk.easyturk import get_jinja_env
+from easyturk.mock_mturk import MockMTurk
+from easyturk.payload import compact_json
+
+
+def _launch(et, max_assignments):
+    hit = et.launch_hit('write_caption.html',
+                        [{'url': 'http://example.com/0.jpg'}],
+                        max_assignments=max_assignments)
+    return hit['HIT']['HITId']
+
+
+@pytest.fixture
+def clients(tmp_path, monkeypatch):
+    # Creating a boto3 client needs credentials, but no connection.
+    config = tmp_path / 'aws_config'
+    config.write_text(u'[profile mturk]\naws_access_key_id = AKID\n'
+                      u'aws_secret_access_key = secret\n')
+    monkeypatch.setenv('AWS_CONFIG_FILE', str(config))
+    monkeypatch.setattr(easyturk, '_clients', {})
+    return easyturk._clients
+
+
+def test_clients_are_shared_by_configuration(clients):
+    et = EasyTurk()
+    other = EasyTurk()
+    assert et.mtc.client is other.mtc.client
+    assert et.mtc.client is get_client()
+    assert EasyTurk(sandbox=False).mtc.client is not et.mtc.client
+    assert len(clients) == 2
+    config = EasyTurk(max_pool_connections=64).mtc.client.meta.config
+    assert config.max_pool_connections == 64
+    assert config.tcp_keepalive
+
+
+def test_clients_without_tcp_keepalive(clients, monkeypatch):
+    from botocore import config
+
+    Config = config.Config
+
+    def old_config(**kwargs):
+        if 'tcp_keepalive' in kwargs:
+            raise TypeError('Got unexpected keyword argument tcp_keepalive')
+        return Config(**kwargs)
+
+    monkeypatch.setattr(config, 'Config', old_config)
+    client = get_client(max_pool_connections=8)
+    assert client.meta.config.max_pool_connections == 8
+    assert not client.meta.config.tcp_keepalive
+
+
+def test_render_template_matches_a_full_render(et):
+    data = [{'url': 'http://example.com/%d.jpg' % i} for i in range(3)]
+    template = et.get_jinja_env().get_template('write_caption.html')
+    expected = template.render({'input': compact_json(data)})
+    assert et.render_template('write_caption.html', data) == expected
+    assert et.template_parts[('write_caption.html', False)] is not None
+    other = [{'url': 'http://example.com/other.jpg'}]
+    assert et.render_template('write_caption.html', other) == (
+            template.render({'input': compact_json(other)}))
+
+
+def test_templates_are_compiled_into_a_shared_cache(tmp_path):
+    cache_dir = str(tmp_path / 'templates')
+    et = EasyTurk(template_cache_dir=cache_dir)
+    other = EasyTurk(template_cache_dir=cache_dir)
+    assert et.get_jinja_env() is other.get_jinja_env()
+    assert et.get_jinja_env() is get_jinja_env(cache_dir)
+    et.render_template('write_caption.html', [])
+    assert len(os.listdir(cache_dir)) > 0
+
+
+def test_hits_with_the_same_configuration_share_a_hit_type(et, mock):
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        hit_ids = list(executor.map(lambda _: _launch(et, 1), range(16)))
+    assert mock.calls['create_hit_type'] == 1
+    assert len(set(mock.hits[h]['HITTypeId'] for h in hit_ids)) == 1
+    assert 'create_hit' not in mock.calls
+
+    hit = et.launch_hit('write_caption.html', [], reward=0.5)
+    assert mock.calls['create_hit_type'] == 2
+    assert mock.hits[hit['HIT']['HITId']]['Reward'] == '0.5'
+    assert len(et.hit_types) == 2
+
+
+def test_hits_can_be_launched_without_a_hit_type(et, mock):
+    hit = et.launch_hit('write_caption.html', [], hit_type=False)
+    assert mock.calls['create_hit'] == 1
+    assert 'create_hit_type' not in mock.calls
+    assert len(et.hit_types) == 0
+    assert mock.hits[hit['HIT']['HITId']]['Question'] is not None
+
+
+def test_list_hits_follows_next_token(et, mock):
+    hit_ids = [_launch(et, 1) for _ in range(5)]
+    assert sorted(h['HITId'] for h in et.list_hits(page_size=2)) == sorted(
+            hit_ids)
+    assert mock.calls['list_hits'] == 3
+    wanted = set(hit_ids[:2])
+    hits = et.list_hits(page_size=2, where=lambda h: h['HITId'] in wanted)
+    assert set(h['HITId'] for h in hits) == wanted
+
+
+def test_iter_assignments_follows_next_token(et, mock):
+    hit_id = _launch(et, 5)
+    assert len(et.get_results(hit_id)) == 5
+    calls = mock.calls['list_assignments_for_hit']
+    assignments = list(et.iter_assignments(hit_id, page_size=2))
+    assert len(set(a['AssignmentId'] for a in assignments)) == 5
+    assert mock.calls['list_assignments_for_hit'] - calls == 3
+
+
+def test_iter_assignments_stops_early(et, mock):
+    hit_id = _launch(et, 5)
+    et.get_results(hit_id)
+    calls = mock.calls['list_assignments_for_hit']
+    next(et.iter_assignments(hit_id, page_size=2))
+    assert mock.calls['list_assignments_for_hit'] - calls == 1
+
+
+def test_show_bulk_progress_reads_the_listing(et, mock):
+    hit_ids = [_launch(et, 2) for _ in range(3)]
+    progress = et.show_bulk_progress(hit_ids, rate=1000)
+    assert sorted(progress['hits']) == sorted(hit_ids)
+    assert progress['errors'] == {}
+    assert 'get_hit' not in mock.calls
+    summary = progress['summary']
+    assert summary['hits'] == 3 and summary['max_assignments'] == 6
+    assert summary['completed'] + summary['available'] == 6
+
+
+def test_show_bulk_progress_fetches_missing_hits(et, mock, monkeypatch):
+    hit_ids = [_launch(et, 2) for _ in range(3)]
+    hidden = hit_ids[0]
+    list_hits = mock.list_hits
+
+    def partial_list_hits(**kwargs):
+        response = list_hits(**kwargs)
+        response['HITs'] = [h for h in response['HITs']
+                            if h['HITId'] != hidden]
+        return response
+
+    monkeypatch.setattr(mock, 'list_hits', partial_list_hits)
+    progress = et.show_bulk_progress(hit_ids + ['MISSING'], rate=1000)
+    assert sorted(progress['hits']) == sorted(hit_ids)
+    assert progress['hits'][hidden]['max_assignments'] == 2
+    assert list(progress['errors']) == ['MISSING']
+    assert mock.calls['get_hit'] == 2
+
+
+def test_get_results_returns_parse_errors(et, mock):
+    hit_id = _launch(et, 2)
+    results = et.get_results(hit_id)
+    broken = results[0]['assignment_id']
+    mock.assignments[broken]['Answer'] = '<QuestionFormAnswers>'
+    et.parser.cache.clear()
+    results, errors = et.get_results(hit_id, return_errors=True)
+    assert [r['assignment_id'] for r in results] == [
+            results[0]['assignment_id']]
+    assert broken != results[0]['assignment_id']
+    assert [e['assignment_id'] for e in errors] == [broken]
+    assert errors[0]['hit_id'] == hit_id
+
+
+def test_get_results_prints_parse_errors(et, mock, capsys):
+    hit_id = _launch(et, 1)
+    assignment_id = list(mock.assignments)[0]
+    mock.assignments[assignment_id]['Answer'] = '<QuestionFormAnswers>'
+    assert et.get_results(hit_id) == []
+    assert assignment_id in capsys.readouterr().out
+
+
+def test_sync_closes_reviewed_hits(tmp_path):
+    et = EasyTurk(client=MockMTurk(seed=0), store=str(tmp_path / 'hits.db'))
+    hit_id = _launch(et, 1)
+    report = et.sync(rate=1000)
+    assert report['new'] == 1 and report['closed'] == 0
+    report = et.sync(approve=True, rate=1000)
+    assert report['approved'] == 1 and report['closed'] == 1
+    assert hit_id not in dict(et.store.open_hits())
+
+
+def test_sync_closes_reviewable_hits_short_of_assignments(tmp_path):
+    mock = MockMTurk(seed=0, num_workers=1)
+    et = EasyTurk(client=mock, store=str(tmp_path / 'hits.db'))
+    hit_id = _launch(et, 3)
+    assert et.sync(rate=1000)['closed'] == 0
+    report = et.sync(approve=True, rate=1000)
+    assert report['approved'] == 1 and report['closed'] == 1
+    assert mock.hits[hit_id]['HITStatus'] == 'Reviewable'
+    assert hit_id not in dict(et.store.open_hits())
+
+
+def test_sync_reports_and_rejects_unparsable_assignments(tmp_path):
+    mock = MockMTurk(seed=0)
+    et = EasyTurk(client=mock, store=str(tmp_path / 'hits.db'))
+    hit_id = _launch(et, 1)
+    broken = et.get_results(hit_id)[0]['assignment_id']
+    mock.assignments[broken]['Answer'] = '<QuestionFormAnswers>'
+    et.parser.cache.clear()
+    report = et.sync(approve=True, rate=1000)
+    assert report['approved'] == 0 and report['unparsable'] == 1
+    assert report['closed'] == 0
+    assert hit_id in dict(et.store.open_hits())
+    report = et.sync(approve=True, reject_on_fail=True, rate=1000)
+    assert report['rejected'] == 1 and report['unparsable'] == 0
+    assert report['closed'] == 1
+    assert mock.assignments[broken]['AssignmentStatus'] == 'Rejected'
+    assert hit_id not in dict(et.store.open_hits())
+
+
+def test_sync_closes_expired_hits(tmp_path):
+    mock = MockMTurk(seed=0, submit_delay=3600)
+    et = EasyTurk(client=mock, store=str(tmp_path / 'hits.db'))
+    expired = _launch(et, 3)
+    running = _launch(et, 3)
+    mock.hits[expired]['Expiration'] = (mock.hits[expired]['Expiration'] -
+                                        timedelta(days=30))
+    report = et.sync(rate=1000)
+    assert report['polled'] == 2 and report['closed'] == 1
+    assert list(dict(et.store.open_hits())) == [running]
+    assert mock.hits[running]['Expiration'] > datetime.now(
+            mock.hits[running]['Expiration'].tzinfo)
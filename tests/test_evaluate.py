@@ -0,0 +1,182 @@
+"""Tests of the review decisions and the index of results behind the review
+server.
+"""
+
+import json
+import os
+import threading
+
+import pytest
+
+from easyturk import evaluate
+from easyturk.store import ResultsIndex
+from easyturk.store import ReviewStore
+
+
+@pytest.fixture(autouse=True)
+def fresh_server(monkeypatch):
+    monkeypatch.setattr(evaluate, 'review_stores', {})
+    monkeypatch.setattr(evaluate, 'results_indexes', {})
+
+
+def _write_results(path, num_workers):
+    results = {}
+    for i in range(num_workers):
+        results['HIT%d' % i] = [{'assignment_id': 'A%d' % i,
+                                 'hit_id': 'HIT%d' % i,
+                                 'worker_id': 'W%d' % i,
+                                 'output': ['caption'],
+                                 'status': 'Submitted'}]
+    with open(path, 'w') as f:
+        json.dump(results, f)
+
+
+def test_review_store_keeps_the_latest_decisions(tmp_path):
+    path = str(tmp_path / 'reviews.db')
+    store = ReviewStore(path)
+    assignment_ids = ['A%d' % i for i in range(1200)]
+    store.record(assignment_ids, True)
+    store.record(['A0', 'A1'], False)
+    store.close()
+
+    store = ReviewStore(path)
+    decisions = store.decisions()
+    assert len(decisions) == 1200
+    assert not decisions['A0'] and not decisions['A1'] and decisions['A2']
+    assert store.decisions(['A1', 'A1000', 'B0']) == {'A1': False,
+                                                       'A1000': True}
+
+
+def test_decisions_of_converted_results_are_migrated(tmp_path):
+    results_file = str(tmp_path / 'results.json')
+    _write_results(results_file, 3)
+    eresults_file = evaluate.get_e_filename(results_file)
+    converted = evaluate.convert(json.load(open(results_file)))
+    for hit in converted['hits']:
+        hit['approve'] = hit['assignment_id'] != 'A0'
+    with open(eresults_file, 'w') as f:
+        json.dump(converted, f)
+    mtime = os.path.getmtime(results_file) + 1
+    os.utime(eresults_file, (mtime, mtime))
+    evaluate.get_review_store(eresults_file).record(['A1'], False)
+
+    index = evaluate.get_results_index(results_file)
+    decisions = evaluate.get_review_store(eresults_file).decisions()
+    assert decisions == {'A0': False, 'A1': False, 'A2': True}
+    stats = dict((s['worker_id'], s) for s in index.worker_stats())
+    assert stats['W1']['num_rejected'] == 1
+    assert stats['W2']['num_approved'] == 1
+
+
+def test_index_is_rebuilt_when_the_results_change(tmp_path):
+    results_file = str(tmp_path / 'results.json')
+    _write_results(results_file, 2)
+    index = evaluate.get_results_index(results_file)
+    assert index.num_assignments() == 2
+    eresults_file = evaluate.get_e_filename(results_file)
+    evaluate.get_review_store(eresults_file).record(['A0'], False)
+    index.record_decisions(['A0'], False)
+
+    _write_results(results_file, 3)
+    index = evaluate.get_results_index(results_file)
+    assert index.num_assignments() == 3
+    stats = dict((s['worker_id'], s) for s in index.worker_stats())
+    assert stats['W0']['num_rejected'] == 1
+    assert os.path.exists(evaluate.get_db_filename(eresults_file))
+
+
+def test_index_is_built_once_by_concurrent_requests(tmp_path, monkeypatch):
+    results_file = str(tmp_path / 'results.json')
+    _write_results(results_file, 2)
+    builds = []
+    build = ResultsIndex.build
+
+    def counting_build(self, converted):
+        builds.append(self)
+        build(self, converted)
+
+    monkeypatch.setattr(ResultsIndex, 'build', counting_build)
+    indexes = []
+    threads = [threading.Thread(target=lambda: indexes.append(
+                   evaluate.get_results_index(results_file)))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(builds) == 1
+    assert len(set(id(index) for index in indexes)) == 1
+    assert indexes[0].num_assignments() == 2
+
+
+def _write_worker_results(path, num_assignments):
+    results = dict(('HIT%d' % i, [{'assignment_id': 'A%d' % i,
+                                   'hit_id': 'HIT%d' % i,
+                                   'worker_id': 'W0',
+                                   'output': ['caption %d' % i],
+                                   'status': 'Submitted'}])
+                   for i in range(num_assignments))
+    results['HIT_OTHER'] = [{'assignment_id': 'B0', 'hit_id': 'HIT_OTHER',
+                             'worker_id': 'W1', 'output': ['caption'],
+                             'status': 'Submitted'}]
+    with open(path, 'w') as f:
+        json.dump(results, f)
+
+
+def test_api_paginates_workers_and_assignments(tmp_path):
+    results_file = str(tmp_path / 'results.json')
+    _write_worker_results(results_file, 5)
+    client = evaluate.app.test_client()
+
+    response = client.get('/api/workers',
+                          query_string={'results': results_file,
+                                        'limit': 1, 'offset': 1})
+    page = json.loads(response.data)
+    assert page['num_assignments'] == 6 and page['offset'] == 1
+    assert len(page['workers']) == 1
+
+    seen = []
+    offset = 0
+    while True:
+        response = client.get('/api/workers/W0/assignments',
+                              query_string={'results': results_file,
+                                            'offset': offset, 'limit': 2})
+        page = json.loads(response.data)
+        assert page['total'] == 5
+        if len(page['assignments']) == 0:
+            break
+        seen.extend(a['assignment_id'] for a in page['assignments'])
+        offset += len(page['assignments'])
+    assert sorted(seen) == ['A%d' % i for i in range(5)]
+
+
+def test_api_reports_decisions_posted_to_the_interface(tmp_path, et, mock,
+                                                       monkeypatch):
+    hit = et.launch_hit('write_caption.html',
+                        [{'url': 'http://example.com/0.jpg'}],
+                        max_assignments=2)
+    hit_id = hit['HIT']['HITId']
+    results = {hit_id: et.get_results(hit_id)}
+    results_file = str(tmp_path / 'results.json')
+    with open(results_file, 'w') as f:
+        json.dump(results, f, default=str)
+    monkeypatch.setattr(evaluate.EasyTurk, '_create_client',
+                        lambda self: mock)
+    client = evaluate.app.test_client()
+    client.get('/api/workers', query_string={'results': results_file})
+
+    rejected = results[hit_id][0]
+    response = client.post('/interface', data={
+            'assignment_ids': json.dumps([rejected['assignment_id']]),
+            'approve': json.dumps(False),
+            'eresults_file': evaluate.get_e_filename(results_file)})
+    assert response.status_code == 200
+    assert (mock.assignments[rejected['assignment_id']]['AssignmentStatus']
+            == 'Rejected')
+
+    response = client.get(
+            '/api/workers/%s/assignments' % rejected['worker_id'],
+            query_string={'results': results_file})
+    assignments = json.loads(response.data)['assignments']
+    assert [a['approve'] for a in assignments
+            if a['assignment_id'] == rejected['assignment_id']] == [False]
@@ -0,0 +1,50 @@
+"""Tests of streaming fetched results to JSONL, Parquet and Arrow files.
+"""
+
+import pytest
+
+from easyturk import export
+from easyturk import interface
+from easyturk.bulk import launch_hits
+
+
+@pytest.fixture
+def hit_ids(et, caption_data):
+    hit_ids, _ = launch_hits(et, 'write_caption.html', caption_data, 2,
+                             max_assignments=2)
+    return hit_ids
+
+
+@pytest.mark.parametrize('format', export.FORMATS)
+def test_export_round_trips(et, hit_ids, tmp_path, format):
+    if format != 'jsonl':
+        pytest.importorskip('pyarrow')
+    path = str(tmp_path / ('results.' + format))
+    num_rows = interface.export_completed_hits(
+            hit_ids, path, approve=False, rate=1000, batch_size=2, et=et)
+    assert num_rows == 10
+    expected = interface.fetch_completed_hits(hit_ids, approve=False,
+                                              rate=1000, et=et)
+    results = export.read_results(path)
+    assert sorted(results) == sorted(expected)
+    for hit_id, assignments in expected.items():
+        assert results[hit_id] == [
+                export.unflatten(export.flatten(a)) for a in assignments]
+        assert [a['output'] for a in results[hit_id]] == [
+                a['output'] for a in assignments]
+
+
+@pytest.mark.parametrize('format', ['parquet', 'arrow'])
+def test_read_table_has_the_export_columns(et, hit_ids, tmp_path, format):
+    pytest.importorskip('pyarrow')
+    path = str(tmp_path / ('results.' + format))
+    interface.export_completed_hits(hit_ids, path, approve=False, rate=1000,
+                                    et=et)
+    table = export.read_table(path)
+    assert tuple(table.column_names) == export.COLUMNS
+    assert table.num_rows == 10
+
+
+def test_unknown_formats_are_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        export.open_writer(str(tmp_path / 'results.csv'))
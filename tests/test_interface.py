@@ -0,0 +1,61 @@
+"""Tests of the task specific launch and fetch functions.
+"""
+
+import pytest
+
+from easyturk import interface
+from easyturk.bulk import launch_hits
+
+
+@pytest.fixture
+def hit_ids(et, caption_data, monkeypatch, mock):
+    # The interface functions create their own EasyTurk, which gets the
+    # mock as its client.
+    monkeypatch.setattr(interface.EasyTurk, '_create_client',
+                        lambda self: mock)
+    hit_ids, _ = launch_hits(et, 'write_caption.html', caption_data, 2,
+                             max_assignments=2)
+    return hit_ids
+
+
+def test_fetch_completed_hits_accepts_generators(hit_ids):
+    results = interface.fetch_completed_hits(
+            (hit_id for hit_id in hit_ids), approve=True, rate=1000)
+    assert sorted(results) == sorted(hit_ids)
+    assert all(len(r) == 2 for r in results.values())
+    assert all(a['status'] == 'Approved'
+               for r in results.values() for a in r)
+
+
+def test_fetch_completed_hits_without_hits(hit_ids):
+    assert interface.fetch_completed_hits(iter([]), rate=1000) == {}
+
+
+def test_fetch_completed_hits_reuses_parsed_outputs(et, hit_ids,
+                                                    monkeypatch):
+    first = interface.fetch_completed_hits(hit_ids, approve=False,
+                                           rate=1000, et=et)
+
+    def parse_answer(answer):
+        raise AssertionError('The output was parsed again.')
+
+    monkeypatch.setattr('easyturk.parse.parse_answer', parse_answer)
+    second = interface.fetch_completed_hits(hit_ids, approve=False,
+                                            rate=1000, et=et)
+    assert second == first
+
+
+def test_iter_completed_hits_approves_only_submitted(et, hit_ids, mock):
+    rejected = et.get_results(hit_ids[0])[0]['assignment_id']
+    et.reject_assignment(rejected)
+    get_assignment_calls = mock.calls['get_assignment']
+    results = list(interface.iter_completed_hits(
+            hit_ids, approve=True, rate=1000, batch_size=2, et=et))
+    assert [hit_id for hit_id, _ in results] == hit_ids
+    statuses = dict((a['assignment_id'], a['status'])
+                    for _, r in results for a in r)
+    assert statuses.pop(rejected) == 'Rejected'
+    assert set(statuses.values()) == set(['Approved'])
+    assert mock.calls['approve_assignment'] == len(statuses)
+    assert mock.assignments[rejected]['AssignmentStatus'] == 'Rejected'
+    assert mock.calls['get_assignment'] == get_assignment_calls
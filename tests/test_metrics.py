@@ -0,0 +1,25 @@
+"""Tests of the instrumentation of api calls.
+"""
+
+from easyturk.metrics import Metrics
+from easyturk.metrics import escape_label
+from easyturk.metrics import payload_size
+
+
+def test_payload_size_counts_utf8_bytes():
+    assert payload_size('abc') == 3
+    assert payload_size(u'café') == 5
+    assert payload_size({u'é': [u'中', 1]}) == 2 + 3 + 8
+
+
+def test_prometheus_label_values_are_escaped():
+    assert escape_label('a\\b"c\nd') == 'a\\\\b\\"c\\nd'
+    metrics = Metrics()
+    metrics.record_call('get_hit', 0.1, error_code='Bad "code"\n')
+    with metrics.time_stage('parse\\'):
+        pass
+    text = metrics.to_prometheus()
+    assert ('easyturk_api_errors_total{operation="get_hit",'
+            'code="Bad \\"code\\"\\n"} 1') in text
+    assert 'easyturk_stage_seconds_count{stage="parse\\\\"} 1' in text
+
@@ -0,0 +1,111 @@
+"""Tests of the ingestion of results from notifications.
+"""
+
+import time
+
+import pytest
+
+from easyturk import EasyTurk
+from easyturk import interface
+from easyturk.mock_mturk import LocalSQS
+from easyturk.mock_mturk import MockMTurk
+from easyturk.notify import NotificationConsumer
+from easyturk.store import HITStore
+
+
+@pytest.fixture
+def sqs():
+    return LocalSQS(visibility_timeout=0.2)
+
+
+@pytest.fixture
+def queue_url(sqs):
+    return sqs.create_queue(QueueName='events')['QueueUrl']
+
+
+@pytest.fixture
+def notified_et(sqs, queue_url, tmp_path):
+    mock = MockMTurk(seed=0, sqs=sqs)
+    et = EasyTurk(client=mock, store=HITStore(str(tmp_path / 'hits.db')))
+    et.enable_notifications(queue_url)
+    return et
+
+
+def consume(consumer, num_polls):
+    results = []
+    for _ in range(num_polls):
+        results.extend(consumer.poll())
+    return results
+
+
+def test_launch_with_et_publishes_events(notified_et, sqs, queue_url,
+                                         caption_data):
+    hit_ids = interface.launch_caption(caption_data, tasks_per_hit=5,
+                                       rate=1000, et=notified_et)
+    consumer = NotificationConsumer(notified_et, queue_url, sqs=sqs,
+                                    approve=True, wait_time=0.2, rate=1000)
+    results = consume(consumer, 4)
+    assert sorted(r['hit_id'] for r in results) == sorted(hit_ids)
+    assert all(r['status'] == 'Approved' for r in results)
+    assert len(sqs.queues[queue_url]) == 0
+    stored = notified_et.store.get_results()
+    assert sorted(stored) == sorted(hit_ids)
+
+
+def test_failed_fetch_keeps_the_message(notified_et, sqs, queue_url,
+                                        caption_data, monkeypatch):
+    interface.launch_caption(caption_data, tasks_per_hit=10, rate=1000,
+                            et=notified_et)
+    mock = notified_et.mtc.client
+
+    def fail(**kwargs):
+        raise RuntimeError('get_assignment failed')
+
+    monkeypatch.setattr(mock, 'get_assignment', fail)
+    monkeypatch.setattr(mock, 'list_assignments_for_hit', fail)
+    consumer = NotificationConsumer(notified_et, queue_url, sqs=sqs,
+                                    wait_time=0.2, rate=1000)
+    assert consume(consumer, 2) == []
+    assert len(sqs.queues[queue_url]) == 2
+
+    # The messages are redelivered once the fetches succeed again.
+    monkeypatch.undo()
+    results = consume(consumer, 3)
+    assert len(results) == 1
+    assert len(sqs.queues[queue_url]) == 0
+
+
+def test_seen_assignments_are_bounded(notified_et, sqs, queue_url,
+                                      caption_data):
+    interface.launch_caption(caption_data, tasks_per_hit=1, rate=1000,
+                            et=notified_et)
+    consumer = NotificationConsumer(notified_et, queue_url, sqs=sqs,
+                                    wait_time=0.2, rate=1000, max_seen=3)
+    results = consume(consumer, 4)
+    assert len(results) == 10
+    assert len(consumer.seen) == 3
+
+
+def test_unparsable_assignments_are_reported(notified_et, sqs, queue_url,
+                                             caption_data):
+    interface.launch_caption(caption_data, tasks_per_hit=5, rate=1000,
+                            et=notified_et)
+    mock = notified_et.mtc.client
+    deadline = time.time() + 5
+    while len(mock.assignments) < 2 and time.time() < deadline:
+        time.sleep(0.01)
+    broken = sorted(mock.assignments)[0]
+    mock.assignments[broken]['Answer'] = '<QuestionFormAnswers>'
+    consumer = NotificationConsumer(notified_et, queue_url, sqs=sqs,
+                                    approve=True, wait_time=0.2, rate=1000)
+    results = []
+    errors = []
+    for _ in range(4):
+        new, new_errors = consumer.poll(return_errors=True)
+        results.extend(new)
+        errors.extend(new_errors)
+    assert [r['output'] is not None for r in results] == [True]
+    assert broken not in [r['assignment_id'] for r in results]
+    assert [e['assignment_id'] for e in errors] == [broken]
+    assert mock.assignments[broken]['AssignmentStatus'] == 'Submitted'
+    assert len(sqs.queues[queue_url]) == 0
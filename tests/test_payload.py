@@ -0,0 +1,92 @@
+"""Tests of the minification and size planning of questions.
+"""
+
+import re
+import shutil
+import subprocess
+
+import pytest
+
+from easyturk.bulk import launch_hits
+from easyturk.payload import MAX_QUESTION_BYTES
+from easyturk.payload import PayloadPlanner
+from easyturk.payload import byte_size
+
+
+TEMPLATES = ['annotate_bbox.html', 'verify_bbox.html', 'verify_caption.html',
+             'verify_question_answer.html', 'verify_relationship.html',
+             'write_caption.html']
+
+INLINE_SCRIPT = re.compile(r'<script(?![^>]*\bsrc=)([^>]*)>(.*?)</script>',
+                           re.S)
+
+
+def _tasks(num_tasks):
+    return [{'url': 'http://example.com/%d.jpg' % i,
+             'caption': 'a "quoted" caption </b> %d' % i,
+             'objects': [{'name': 'dog', 'rect': {'x': i, 'y': 1, 'w': 2,
+                                                  'h': 3}}]}
+            for i in range(num_tasks)]
+
+
+@pytest.mark.parametrize('template', TEMPLATES)
+def test_minified_templates_round_trip(et, template):
+    tasks = _tasks(4)
+    hit_ids, report = launch_hits(et, template, tasks, 2, minify=True)
+    assert all(r['success'] for r in report)
+    outputs = [et.get_results(hit_id)[0]['output'] for hit_id in hit_ids]
+    assert outputs == [tasks[:2], tasks[2:]]
+
+
+@pytest.mark.parametrize('template', TEMPLATES)
+def test_minified_javascript_is_valid(et, template, tmp_path):
+    node = shutil.which('node')
+    if node is None:
+        pytest.skip('node is not installed.')
+    html = et.render_template(template, _tasks(1), minify=True)
+    scripts = [body for attributes, body in INLINE_SCRIPT.findall(html)
+               if 'text/json' not in attributes]
+    assert len(scripts) > 0
+    for i, script in enumerate(scripts):
+        path = tmp_path / ('%d.js' % i)
+        path.write_text(script)
+        subprocess.check_call([node, '--check', str(path)])
+
+
+def test_minification_is_opt_in(et, mock, caption_data):
+    hit_ids, _ = launch_hits(et, 'write_caption.html', caption_data, 10,
+                             max_bytes=MAX_QUESTION_BYTES)
+    question = mock.hits[hit_ids[0]]['Question']
+    assert question == et.create_html_question(
+            et.render_template('write_caption.html', caption_data), 9000)
+
+
+def test_chunks_fit_the_budget(et, mock, caption_data):
+    plain = byte_size(et.create_html_question(
+            et.render_template('write_caption.html', caption_data[:3]), 9000))
+    hit_ids, report = launch_hits(et, 'write_caption.html', caption_data, 10,
+                                  max_bytes=plain)
+    assert [r['size'] for r in report] == [3, 3, 3, 1]
+    assert all(byte_size(mock.hits[h]['Question']) <= plain
+               for h in hit_ids)
+
+
+@pytest.mark.parametrize('minify', [False, True])
+def test_planned_sizes_match_the_questions(et, minify):
+    tasks = _tasks(4) + [{'url': u'http://example.com/\u00e9t\u00e9.jpg'}]
+    planner = PayloadPlanner(et, 'write_caption.html', minify=minify)
+    for chunk, size in planner.plan(tasks, 2):
+        question = et.create_html_question(et.render_template(
+                'write_caption.html', chunk, minify=minify), 9000)
+        assert size == byte_size(question)
+
+
+def test_oversized_tasks_are_not_sent(et, mock, caption_data):
+    budget = byte_size(et.create_html_question(
+            et.render_template('write_caption.html', caption_data[:1]), 9000))
+    tasks = caption_data[:2] + [{'url': 'x' * budget}] + caption_data[2:4]
+    hit_ids, report = launch_hits(et, 'write_caption.html', tasks, 10,
+                                  max_bytes=budget)
+    assert [r['success'] for r in report] == [True, True, False, True, True]
+    assert 'over the limit' in report[2]['error']
+    assert len(mock.hits) == 4
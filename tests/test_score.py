@@ -0,0 +1,91 @@
+"""Tests that score.py computes the same scores as iou.js and bleu.js.
+"""
+
+import json
+import os
+import random
+import shutil
+import subprocess
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from easyturk import score  # noqa: E402
+
+
+JAVASCRIPT_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'easyturk', 'templates', 'javascript')
+
+WORDS = ['a', 'man', 'dog', 'the', 'on', 'red', 'ball', 'park']
+
+
+def _run_javascript(filename, calls):
+    """Evaluates calls of the ETJS functions of a file with node.
+
+    Args:
+        filename: A file in templates/javascript.
+        calls: A list of tuples of a function name and its arguments.
+
+    Returns:
+        The list of return values.
+    """
+    node = shutil.which('node')
+    if node is None:
+        pytest.skip('node is not installed.')
+    with open(os.path.join(JAVASCRIPT_DIR, filename)) as f:
+        source = f.read()
+    # bleu.js refers to its own functions through vg.
+    program = (source + '\nvar vg = ETJS;\n' +
+               'var calls = %s;\n' % json.dumps(calls) +
+               'console.log(JSON.stringify(calls.map(function(c) {' +
+               ' return ETJS[c[0]].apply(null, c[1]); })));')
+    output = subprocess.check_output([node, '-e', program])
+    return json.loads(output.decode('utf-8'))
+
+
+def _box(rng):
+    return {'x': rng.randint(0, 50), 'y': rng.randint(0, 50),
+            'w': rng.randint(1, 40), 'h': rng.randint(1, 40)}
+
+
+def _sentence(rng):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 12)))
+
+
+def test_iou_matches_iou_js():
+    rng = random.Random(0)
+    pairs = [(_box(rng), _box(rng)) for _ in range(300)]
+    pairs.append(({'x': 0, 'y': 0, 'w': 10, 'h': 10},
+                  {'x': 10, 'y': 0, 'w': 10, 'h': 10}))
+    expected = _run_javascript(
+            'iou.js', [('intersection_over_union', list(pair))
+                       for pair in pairs])
+    scores = score.iou(score.boxes_to_array([a for a, _ in pairs]),
+                       score.boxes_to_array([b for _, b in pairs]))
+    np.testing.assert_allclose(scores, expected, rtol=1e-9, atol=1e-12)
+    assert any(e > 0 for e in expected)
+
+
+@pytest.mark.parametrize('n', [1, 2, 4])
+def test_bleu_matches_bleu_js(n):
+    rng = random.Random(n)
+    pairs = [(_sentence(rng).split(' '), _sentence(rng).split(' '))
+             for _ in range(300)]
+    expected = _run_javascript(
+            'bleu.js', [('bleu_score', [s, r, n]) for s, r in pairs])
+    scores = score.bleu([s for s, _ in pairs], [r for _, r in pairs], n=n)
+    np.testing.assert_allclose(scores, expected, rtol=1e-12)
+    assert 0 < np.mean(scores) < 1
+
+
+def test_max_bleu_matches_max_bleu_score_js():
+    rng = random.Random(0)
+    sentences = [_sentence(rng).upper() for _ in range(100)]
+    references = [[_sentence(rng) for _ in range(rng.randint(1, 4))]
+                  for _ in sentences]
+    expected = _run_javascript(
+            'bleu.js', [('max_bleu_score', [s, refs, 4])
+                        for s, refs in zip(sentences, references)])
+    scores = score.max_bleu(sentences, references, n=4)
+    np.testing.assert_allclose(scores, expected, rtol=1e-12)